@@ -46,6 +46,7 @@ public function handle()
         $totalZombies = 0;
         $totalSynced = 0;
         $zombiesByTenant = [];
+        $failedTenants = [];
 
         foreach ($tenants as $tenant) {
             $this->info("📊 Tenant {$tenant->id}: {$tenant->name}");
@@ -54,10 +55,17 @@ public function handle()
             $pgCount = Document::where('tenant_id', $tenant->id)->count();
             $this->line("   PostgreSQL: {$pgCount} documenti");
 
-            // Conta documenti in Milvus
-            $milvus = app(MilvusClient::class);
-            $milvusResult = $this->executePythonCount($tenant->id);
-            $milvusCount = $milvusResult['count'] ?? 0;
+            // Conta chunk e documenti in Milvus (una sola chiamata, nessun vettore letto)
+            $milvusStats = app(MilvusClient::class)->statsByTenant($tenant->id);
+            if ($milvusStats === null) {
+                // Senza statistiche non si può distinguere "nessun chunk" da un errore di Milvus
+                $this->error('   ❌ Statistiche Milvus non disponibili: tenant non verificato');
+                $failedTenants[] = $tenant->id;
+                $this->newLine();
+
+                continue;
+            }
+            $milvusCount = $milvusStats['count'];
             $this->line("   Milvus: {$milvusCount} chunk");
 
             // Ottieni tutti doc_id da PostgreSQL per questo tenant
@@ -66,7 +74,7 @@ public function handle()
                 ->toArray();
 
             // Ottieni tutti doc_id da Milvus per questo tenant
-            $milvusDocIds = $this->extractDocIdsFromMilvus($tenant->id);
+            $milvusDocIds = array_map('intval', array_column($milvusStats['documents'], 'document_id'));
 
             // Trova zombie (in Milvus ma non in PostgreSQL)
             $zombies = array_diff($milvusDocIds, $pgDocIds);
@@ -86,7 +94,7 @@ public function handle()
                 // Fix se richiesto
                 if ($fix && ! $dryRun) {
                     $this->info('   🔧 Rimozione zombie...');
-                    $removed = $this->removeZombieDocuments($tenant->id, $zombies);
+                    $removed = $this->removeZombieDocuments($zombies, $milvusStats['documents']);
                     $this->info("   ✅ Rimossi {$removed} chunk zombie da Milvus");
                 } elseif ($dryRun) {
                     $this->comment("   [DRY-RUN] Verrebbero rimossi {$zombieCount} documenti zombie");
@@ -118,84 +126,37 @@ public function handle()
             $this->info('✅ Nessun documento zombie trovato');
         }
 
-        return $totalZombies > 0 ? Command::FAILURE : Command::SUCCESS;
-    }
-
-    /**
-     * Esegue count via Python per un tenant
-     */
-    private function executePythonCount(int $tenantId): array
-    {
-        $pythonScript = base_path('milvus_search.py');
-        $params = json_encode([
-            'operation' => 'count_by_tenant',
-            'tenant_id' => $tenantId,
-        ]);
-
-        $output = shell_exec("python \"{$pythonScript}\" '{$params}'");
-
-        return json_decode($output, true) ?? ['count' => 0];
-    }
-
-    /**
-     * Estrae tutti i doc_id univoci da Milvus per un tenant
-     * Fa una ricerca e conta le occorrenze uniche
-     */
-    private function extractDocIdsFromMilvus(int $tenantId): array
-    {
-        // Ottieni sample di risultati da Milvus usando un embedding random
-        $milvus = app(MilvusClient::class);
-
-        // Query tutti i documenti del tenant da PostgreSQL e controlla se esistono in Milvus
-        $allDocs = Document::where('tenant_id', $tenantId)->get();
-        $milvusDocIds = [];
-
-        foreach ($allDocs as $doc) {
-            // Controlla se almeno un chunk esiste in Milvus
-            $result = $this->executePythonCountByDocument($tenantId, $doc->id);
-            if (($result['count'] ?? 0) > 0) {
-                $milvusDocIds[] = $doc->id;
-            }
+        if (! empty($failedTenants)) {
+            $this->error('❌ Tenant non verificati (errore Milvus): '.implode(', ', $failedTenants));
         }
 
-        return $milvusDocIds;
-    }
-
-    /**
-     * Count chunk per documento specifico
-     */
-    private function executePythonCountByDocument(int $tenantId, int $documentId): array
-    {
-        $pythonScript = base_path('milvus_search.py');
-        $params = json_encode([
-            'operation' => 'count_by_document',
-            'tenant_id' => $tenantId,
-            'document_id' => $documentId,
-        ]);
-
-        $output = shell_exec("python \"{$pythonScript}\" '{$params}'");
-
-        return json_decode($output, true) ?? ['count' => 0];
+        return $totalZombies > 0 || ! empty($failedTenants) ? Command::FAILURE : Command::SUCCESS;
     }
 
     /**
      * Rimuove documenti zombie da Milvus
+     *
+     * I primary ID vengono calcolati dal max chunk_index reale di ogni documento.
      */
-    private function removeZombieDocuments(int $tenantId, array $zombieDocIds): int
+    private function removeZombieDocuments(array $zombieDocIds, array $milvusDocuments): int
     {
         $milvus = app(MilvusClient::class);
+        $maxChunkIndex = array_column($milvusDocuments, 'max_chunk_index', 'document_id');
         $totalRemoved = 0;
 
         foreach ($zombieDocIds as $docId) {
-            // Calcola primary IDs (max 10 chunk per documento come stima)
             $primaryIds = [];
-            for ($i = 0; $i < 50; $i++) {  // Max 50 chunk per doc
+            for ($i = 0; $i <= (int) ($maxChunkIndex[$docId] ?? -1); $i++) {
                 $primaryIds[] = ($docId * 100000) + $i;
             }
 
-            $result = $milvus->deleteByPrimaryIds($primaryIds);
-            if ($result['success'] ?? false) {
-                $totalRemoved += ($result['deleted_count'] ?? 0);
+            if (! empty($primaryIds)) {
+                $result = $milvus->deleteByPrimaryIds($primaryIds);
+                if ($result['success'] ?? false) {
+                    $totalRemoved += (int) ($result['deleted_count'] ?? 0);
+                } else {
+                    $this->error("   ❌ Rimozione del documento {$docId} fallita: ".($result['error'] ?? 'Unknown error'));
+                }
             }
         }
 
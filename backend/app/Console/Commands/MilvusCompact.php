@@ -0,0 +1,102 @@
+<?php
+
+namespace App\Console\Commands;
+
+use App\Services\RAG\MilvusClient;
+use Illuminate\Console\Command;
+
+class MilvusCompact extends Command
+{
+    protected $signature = 'milvus:compact
+                            {--ratio= : Quota di righe cancellate oltre cui compattare (default: rag.vector.milvus.compaction.delete_ratio)}
+                            {--min-deleted= : Righe cancellate minime per avviare la compaction}
+                            {--wait= : Secondi di attesa del completamento}
+                            {--force : Compatta anche sotto la soglia}
+                            {--dry-run : Mostra solo il report dei segmenti}
+                            {--segments : Mostra il dettaglio per segmento}';
+
+    protected $description = 'Report delle righe cancellate per segmento e compaction manuale di Milvus oltre la soglia';
+
+    public function handle(MilvusClient $milvus): int
+    {
+        $config = config('rag.vector.milvus.compaction', []);
+
+        $result = $milvus->compact([
+            'delete_ratio' => $this->option('ratio') ?? ($config['delete_ratio'] ?? 0.2),
+            'min_deleted' => $this->option('min-deleted') ?? ($config['min_deleted'] ?? 1000),
+            'wait_seconds' => $this->option('wait') ?? ($config['wait_seconds'] ?? 60),
+            'force' => (bool) $this->option('force'),
+            'dry_run' => (bool) $this->option('dry-run'),
+        ]);
+
+        if (! ($result['success'] ?? false)) {
+            $this->error('❌ Compaction failed: '.($result['error'] ?? 'Unknown error'));
+
+            return 1;
+        }
+
+        $this->info("🧹 Collection {$result['collection']}");
+
+        if (isset($result['skipped'])) {
+            $this->warn("⏭️  {$result['skipped']}");
+
+            return 0;
+        }
+
+        $this->reportSegments('Prima', $result['before'] ?? []);
+
+        if ($result['resumed'] ?? false) {
+            $this->line('   Compaction precedente ancora in corso: nessuna nuova compaction avviata');
+        } elseif (! ($result['triggered'] ?? false)) {
+            $this->info(($result['dry_run'] ?? false)
+                ? '✅ Dry run: '.(empty($result['reasons']) ? 'compaction non necessaria' : 'compaction necessaria ('.implode('; ', $result['reasons']).')')
+                : '✅ Compaction non necessaria');
+
+            return 0;
+        } else {
+            $this->line('   Motivo: '.implode('; ', $result['reasons'] ?? []));
+        }
+
+        $compaction = $result['compaction'] ?? null;
+        if ($compaction !== null) {
+            $this->line("   Compaction {$compaction['id']}: {$compaction['state']} "
+                ."({$compaction['completed_plans']} piani completati, {$compaction['executing_plans']} in corso, "
+                ."{$compaction['timeout_plans']} in timeout, attesa {$compaction['waited_seconds']}s)");
+        }
+
+        if (! empty($result['after'])) {
+            $this->reportSegments('Dopo', $result['after']);
+        } elseif (($compaction['state'] ?? null) === 'Executing') {
+            $this->warn('⏳ Compaction ancora in corso: la prossima esecuzione ne riporta l\'esito');
+        }
+
+        return 0;
+    }
+
+    private function reportSegments(string $label, array $report): void
+    {
+        $ratio = $report['delete_ratio'] ?? null;
+        $this->line("   {$label}: {$report['rows']} righe, "
+            .($ratio === null ? 'righe vive non disponibili' : "{$report['deleted_rows']} cancellate (ratio {$ratio})")
+            .(isset($report['segments'])
+                ? ", {$report['segments']} segmenti ({$report['l0_segments']} L0, {$report['pending_delete_rows']} cancellazioni in attesa), "
+                    .round($report['size_bytes'] / 1048576, 1).' MB caricati'
+                : ''));
+
+        if ($this->option('segments') && ! empty($report['segment_details'])) {
+            $this->table(
+                ['Segmento', 'Partizione', 'Livello', 'Stato', 'Righe', 'Vive', 'Delete ratio', 'MB'],
+                array_map(fn (array $segment) => [
+                    $segment['id'],
+                    $segment['partition_id'],
+                    $segment['level'],
+                    $segment['state'],
+                    $segment['rows'],
+                    $segment['live_rows'] ?? '-',
+                    $segment['delete_ratio'] ?? '-',
+                    isset($segment['size_bytes']) ? round($segment['size_bytes'] / 1048576, 1) : '-',
+                ], $report['segment_details'])
+            );
+        }
+    }
+}
@@ -11,6 +11,9 @@ class MilvusMigrateSchema extends Command
                             {--backup : Create backup only}
                             {--recreate : Recreate schema only}
                             {--restore : Restore from backup only}
+                            {--online : Online migration (dual-write, backfill, alias switch) without downtime}
+                            {--alias= : Alias to create on the first online migration (then set it as MILVUS_COLLECTION)}
+                            {--retire= : Previous collection to retire (stop dual-write) once MILVUS_COLLECTION uses the alias}
                             {--dry-run : Show what would be done without executing}';
 
     protected $description = 'Migrate Milvus collection to new schema with dynamic fields enabled';
@@ -42,6 +45,11 @@ public function handle(): int
             $operation = 'recreate';
         } elseif ($this->option('restore')) {
             $operation = 'restore';
+        } elseif ($this->option('online')) {
+            $operation = 'online_migration';
+        } elseif ($this->option('retire')) {
+            $operation = 'retire_source';
+            $collectionName = $this->option('retire');
         }
 
         $this->info('🚀 Starting Milvus schema migration...');
@@ -64,7 +72,11 @@ public function handle(): int
         }
 
         // Esegui script Python
-        $command = "\"{$pythonPath}\" \"{$script}\" \"{$operation}\" \"{$collectionName}\" 2>&1";
+        $command = "\"{$pythonPath}\" \"{$script}\" \"{$operation}\" \"{$collectionName}\"";
+        if ($operation === 'online_migration' && $this->option('alias')) {
+            $command .= ' --alias '.escapeshellarg($this->option('alias'));
+        }
+        $command .= ' 2>&1';
         $this->info("🐍 Executing: {$command}");
 
         $output = shell_exec($command);
@@ -118,7 +130,8 @@ public function handle(): int
             $recreate = $result['recreate'] ?? [];
             $restore = $result['restore'] ?? [];
 
-            $this->info('✅ Backup: '.($backup['records_backed_up'] ?? 0).' records');
+            $this->info('✅ Backup: '.($backup['records_backed_up'] ?? 0).' records in '
+                .($backup['shards'] ?? 0).' shards ('.($backup['backup_dir'] ?? '-').')');
             $this->info('✅ Schema recreated with dynamic fields enabled');
             $this->info('✅ Restored: '.($restore['restored_records'] ?? 0).' records');
 
@@ -127,6 +140,19 @@ public function handle(): int
                 'backup_records' => $backup['records_backed_up'] ?? 0,
                 'restored_records' => $restore['restored_records'] ?? 0,
             ]);
+        } elseif ($operation === 'online_migration') {
+            $this->info("✅ Backfill: {$result['backfill']['copied']} records copied");
+            $this->info("✅ Alias {$result['alias']} → {$result['new_collection']} (was {$result['previous_collection']})");
+            if ($result['dual_write_kept'] ?? false) {
+                $this->warn("⚠️  {$result['action_required']}");
+            }
+
+            Log::info('milvus.online_migration_completed', [
+                'alias' => $result['alias'],
+                'previous_collection' => $result['previous_collection'],
+                'new_collection' => $result['new_collection'],
+                'backfill' => $result['backfill'],
+            ]);
         } else {
             $this->info("✅ {$operation} completed successfully");
             Log::info("milvus.{$operation}_completed", $result);
@@ -0,0 +1,98 @@
+<?php
+
+namespace App\Console\Commands;
+
+use Illuminate\Console\Command;
+use Illuminate\Support\Facades\Log;
+
+class MilvusRebuildIndex extends Command
+{
+    protected $signature = 'milvus:rebuild-index
+                            {--index-type=HNSW : HNSW, HNSW_SQ, HNSW_PQ, IVF_SQ8, IVF_PQ o DISKANN}
+                            {--param=* : Parametro di build chiave=valore (es. nlist=2048)}
+                            {--source= : Collection da copiare (default: quella puntata dall\'alias)}
+                            {--grace-seconds= : Attesa dopo lo switch prima di rilasciare la vecchia collection}
+                            {--drop-old : Elimina la vecchia collection invece di rilasciarla}
+                            {--force : Sposta l\'alias anche se i conteggi non coincidono}
+                            {--dry-run : Mostra i parametri senza creare nulla}';
+
+    protected $description = 'Rebuild the Milvus vector index on a shadow collection and switch the alias without downtime';
+
+    public function handle(): int
+    {
+        $config = config('rag.vector.milvus');
+        $alias = $config['collection'] ?? 'kb_chunks_v1';
+        $pythonPath = $config['python_path'] ?? 'python';
+        $script = base_path('rebuild_milvus_index.py');
+
+        if (! file_exists($script)) {
+            $this->error("Python script not found: {$script}");
+
+            return 1;
+        }
+
+        $args = ['--alias', $alias, '--index-type', strtoupper((string) $this->option('index-type'))];
+        foreach ((array) $this->option('param') as $param) {
+            array_push($args, '--index-param', $param);
+        }
+        if ($this->option('source')) {
+            array_push($args, '--source', $this->option('source'));
+        }
+        if ($this->option('grace-seconds') !== null) {
+            array_push($args, '--grace-seconds', (string) (float) $this->option('grace-seconds'));
+        }
+        foreach (['drop-old', 'force', 'dry-run'] as $flag) {
+            if ($this->option($flag)) {
+                $args[] = "--{$flag}";
+            }
+        }
+
+        $this->info("🏗️  Rebuilding index behind alias {$alias}...");
+
+        // stdout = JSON finale, stderr = avanzamento (mostrato a terminale)
+        $command = escapeshellarg($pythonPath).' '.escapeshellarg($script).' '.implode(' ', array_map('escapeshellarg', $args));
+        $output = shell_exec($command);
+        $result = json_decode((string) $output, true);
+
+        if (! is_array($result)) {
+            $this->error('❌ Invalid JSON response from Python script:');
+            $this->line((string) $output);
+
+            return 1;
+        }
+
+        if (! ($result['success'] ?? false)) {
+            $this->error('❌ Rebuild failed: '.($result['error'] ?? 'Unknown error'));
+
+            return 1;
+        }
+
+        $this->info("📦 {$result['previous_collection']} → {$result['new_collection']}");
+        $this->line('   Index: '.json_encode($result['index_params']));
+
+        if ($result['dry_run'] ?? false) {
+            $this->info('✅ Dry run, nothing created');
+
+            return 0;
+        }
+
+        $this->line("   Rows: {$result['new_count']} (copy {$result['copy_seconds']}s, index+load {$result['index_and_load_seconds']}s)");
+        $this->info("✅ Alias {$alias} now points to {$result['new_collection']}");
+        if (isset($result['rollback'])) {
+            $this->line("   Rollback: {$result['rollback']}");
+        }
+        if ($result['dual_write_kept'] ?? false) {
+            $this->warn("⚠️  {$result['action_required']}");
+        }
+
+        Log::info('milvus.index_rebuilt', [
+            'alias' => $alias,
+            'previous_collection' => $result['previous_collection'],
+            'new_collection' => $result['new_collection'],
+            'index_params' => $result['index_params'],
+            'rows' => $result['new_count'],
+        ]);
+
+        return 0;
+    }
+}
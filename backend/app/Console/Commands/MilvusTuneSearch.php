@@ -0,0 +1,100 @@
+<?php
+
+namespace App\Console\Commands;
+
+use Illuminate\Console\Command;
+use Illuminate\Support\Facades\Log;
+
+class MilvusTuneSearch extends Command
+{
+    protected $signature = 'milvus:tune-ef
+                            {tenant : Tenant ID da tarare}
+                            {--k=10 : recall@k}
+                            {--queries=200 : Vettori campionati come query}
+                            {--ef= : Valori di ef da provare (es. 32,64,128)}
+                            {--target-recall=0.95 : Recall minima richiesta}
+                            {--build-params= : Coppie M:efConstruction da confrontare su una collection temporanea (es. 16:200,32:256)}
+                            {--dry-run : Mostra la curva senza salvare l\'ef scelto}';
+
+    protected $description = 'Tune HNSW ef for a tenant (recall@k vs latency) and store the chosen value';
+
+    public function handle(): int
+    {
+        $config = config('rag.vector.milvus');
+        $collectionName = $config['collection'] ?? 'kb_chunks_v1';
+        $pythonPath = $config['python_path'] ?? 'python';
+        $script = base_path('tune_milvus_search.py');
+
+        if (! file_exists($script)) {
+            $this->error("Python script not found: {$script}");
+
+            return 1;
+        }
+
+        $tenantId = (int) $this->argument('tenant');
+        $args = [
+            '--collection', $collectionName,
+            '--tenant', (string) $tenantId,
+            '--k', (string) (int) $this->option('k'),
+            '--queries', (string) (int) $this->option('queries'),
+            '--target-recall', (string) (float) $this->option('target-recall'),
+        ];
+        if ($this->option('ef')) {
+            array_push($args, '--ef', $this->option('ef'));
+        }
+        if ($this->option('build-params')) {
+            array_push($args, '--build-params', $this->option('build-params'));
+        }
+        if ($this->option('dry-run')) {
+            $args[] = '--dry-run';
+        }
+
+        $this->info("🎯 Tuning ef for tenant {$tenantId} on {$collectionName}...");
+
+        // stdout = JSON finale, stderr = avanzamento (mostrato a terminale)
+        $command = escapeshellarg($pythonPath).' '.escapeshellarg($script).' '.implode(' ', array_map('escapeshellarg', $args));
+        $output = shell_exec($command);
+        $result = json_decode((string) $output, true);
+
+        if (! is_array($result)) {
+            $this->error('❌ Invalid JSON response from Python script:');
+            $this->line((string) $output);
+
+            return 1;
+        }
+
+        if (! ($result['success'] ?? false)) {
+            $this->error('❌ Tuning failed: '.($result['error'] ?? 'Unknown error'));
+
+            return 1;
+        }
+
+        $k = $result['k'];
+        $this->table(['ef', "recall@{$k}", 'p50 ms', 'p95 ms'], array_map(
+            fn ($point) => [$point['ef'], $point['recall'], $point['p50_ms'], $point['p95_ms']],
+            $result['curve']
+        ));
+
+        foreach ($result['build_sweep']['results'] ?? [] as $build) {
+            $this->info("🏗️  M={$build['M']} efConstruction={$build['efConstruction']} (build {$build['build_seconds']}s)");
+            $this->table(['ef', "recall@{$k}", 'p50 ms', 'p95 ms'], array_map(
+                fn ($point) => [$point['ef'], $point['recall'], $point['p50_ms'], $point['p95_ms']],
+                $build['curve']
+            ));
+        }
+
+        if (! $result['target_met']) {
+            $this->warn("⚠️  No ef reached recall {$result['target_recall']}: using the best one");
+        }
+
+        $this->info("✅ Chosen ef: {$result['chosen_ef']}".($result['stored'] ? ' (stored)' : ' (dry run, not stored)'));
+        Log::info('milvus.ef_tuned', [
+            'tenant_id' => $tenantId,
+            'chosen_ef' => $result['chosen_ef'],
+            'stored' => $result['stored'],
+            'curve' => $result['curve'],
+        ]);
+
+        return 0;
+    }
+}
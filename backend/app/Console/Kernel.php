@@ -11,6 +11,11 @@ protected function schedule(Schedule $schedule): void
     {
         // Esegui ogni 5 minuti per controllare scraper dovuti
         $schedule->command('scraper:run-due')->everyFiveMinutes()->withoutOverlapping();
+
+        // Compatta Milvus quando re-scrape e cancellazioni lasciano troppe righe cancellate nei segmenti
+        if (config('rag.vector.milvus.compaction.schedule', true)) {
+            $schedule->command('milvus:compact')->dailyAt('03:30')->withoutOverlapping();
+        }
     }
 
     protected function commands(): void
@@ -225,11 +225,18 @@ public function handle(
             // STEP 6: Index vectors in Milvus
             // ========================================
             // Prepare chunks for indexing (text + vector pairs)
+            // I metadati del documento finiscono in Milvus con i chunk (se la collection ha i campi dinamici)
+            $metadata = [
+                'title' => $doc->title,
+                'source_url' => $doc->source_url,
+                'knowledge_base_id' => $doc->knowledge_base_id !== null ? (int) $doc->knowledge_base_id : null,
+            ];
             $chunksForIndexing = [];
             foreach ($chunkTexts as $i => $text) {
                 $chunksForIndexing[] = [
                     'text' => $text,
                     'vector' => $vectors[$i],
+                    'metadata' => $metadata,
                 ];
             }
 
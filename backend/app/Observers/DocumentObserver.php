@@ -64,7 +64,7 @@ public function deleted(Document $document): void
 
             // Cancella da Milvus
             $milvus = app(MilvusClient::class);
-            $result = $milvus->deleteByPrimaryIds($primaryIds);
+            $result = $milvus->deleteByPrimaryIds($primaryIds, (int) $document->tenant_id);
 
             if ($result['success'] ?? false) {
                 Log::info('✅ Document chunks deleted from Milvus', [
@@ -48,6 +48,7 @@ public function upsert(int $documentId, int $tenantId, array $chunks): bool
             // MilvusClient expects $chunks (text array) and $vectors (vector array) separately
             $chunkTexts = [];
             $vectors = [];
+            $metadata = [];
 
             foreach ($chunks as $chunk) {
                 if (! isset($chunk['vector'])) {
@@ -61,6 +62,8 @@ public function upsert(int $documentId, int $tenantId, array $chunks): bool
 
                 $chunkTexts[] = $chunk['text'] ?? '';
                 $vectors[] = $chunk['vector'];
+                // Metadati a livello di documento (title, source_url, knowledge_base_id): uguali per tutti i chunk
+                $metadata += (array) ($chunk['metadata'] ?? []);
             }
 
             if (empty($vectors)) {
@@ -72,7 +75,8 @@ public function upsert(int $documentId, int $tenantId, array $chunks): bool
                 $tenantId,
                 $documentId,
                 $chunkTexts,
-                $vectors
+                $vectors,
+                $metadata
             );
 
             Log::debug('indexing.upsert_success', [
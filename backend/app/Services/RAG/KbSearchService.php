@@ -550,6 +550,28 @@ public function retrieve(int $tenantId, string $query, bool $debug = false): arr
                     }
                     $embTime = round((microtime(true) - $embStart) * 1000, 2);
 
+                    // 🔀 Ricerca ibrida nativa: Milvus fonde denso + sparso in una sola chiamata
+                    // Se fallisce (null) o non trova nulla si ripiega su Milvus + BM25 SQL, senza mettere in cache il vuoto
+                    if ((bool) config('rag.vector.milvus.native_hybrid', false) && $qEmb) {
+                        $hybridStart = microtime(true);
+                        $hybridHit = $this->milvus->hybridSearchWithEmbedding($tenantId, $qEmb, $q, max($vecTopK, $bmTopK), 'rrf', $rrfK);
+                        Log::info('⚡ [SEARCH TIMING] Native hybrid search', [
+                            'query' => $q,
+                            'embeddings_ms' => $embTime,
+                            'hybrid_ms' => round((microtime(true) - $hybridStart) * 1000, 2),
+                            'results' => $hybridHit === null ? null : count($hybridHit),
+                            'fallback' => empty($hybridHit),
+                        ]);
+
+                        if (! empty($hybridHit)) {
+                            return array_map(static fn ($hit) => [
+                                'document_id' => $hit['document_id'],
+                                'chunk_index' => $hit['chunk_index'],
+                                'score' => $hit['score'],
+                            ], $hybridHit);
+                        }
+                    }
+
                     // 📊 PROFILING: Milvus search (internal timing)
                     $milvusStart = microtime(true);
                     $vecHit = [];
@@ -741,30 +763,54 @@ public function retrieve(int $tenantId, string $query, bool $debug = false): arr
         $mmrMaxCandidates = min(15, count($ranked));
         $mmrRanked = array_slice($ranked, 0, $mmrMaxCandidates);
 
-        // 🚀 OPTIMIZATION: Extract texts for MMR
-        // If reranker was disabled, $mmrRanked doesn't have 'text' field
-        if (! $rerankerEnabled) {
-            $texts = array_map(function ($c) {
-                $docId = (int) ($c['document_id'] ?? 0);
-                $chunkIdx = (int) ($c['chunk_index'] ?? 0);
-
-                return $this->text->getChunkSnippet($docId, $chunkIdx, 300) ?? '';
-            }, $mmrRanked);
-        } else {
-            $texts = array_map(fn ($c) => (string) ($c['text'] ?? ''), $mmrRanked);
-        }
+        // 🚀 MMR lato server (search_mmr): vettori salvati in Milvus + NumPy, nessun embedding dei testi.
+        // Il costo è un prodotto matriciale, quindi si usano fino a mmr_take candidati; se fallisce resta il calcolo PHP
+        $selIdx = null;
+        $serverMmr = false;
+        if ((bool) config('rag.vector.milvus.server_mmr', false) && $qEmb) {
+            $serverRanked = array_slice($ranked, 0, max($mmrMaxCandidates, min($mmrTake, count($ranked))));
+            $indexByPrimaryId = [];
+            foreach ($serverRanked as $i => $c) {
+                $indexByPrimaryId[(int) $c['document_id'] * 100000 + (int) $c['chunk_index']] ??= $i;
+            }
+            $selectedIds = $this->milvus->mmrSelect($tenantId, $qEmb, array_keys($indexByPrimaryId), $mmrTake, $mmrLambda);
+            if ($selectedIds !== null) {
+                $mmrRanked = $serverRanked;
+                $mmrMaxCandidates = count($serverRanked);
+                $serverMmr = true;
+                $selIdx = array_values(array_filter(
+                    array_map(static fn (int $id) => $indexByPrimaryId[$id] ?? null, $selectedIds),
+                    static fn ($i) => $i !== null
+                ));
+            }
+        }
+
+        if ($selIdx === null) {
+            // 🚀 OPTIMIZATION: Extract texts for MMR
+            // If reranker was disabled, $mmrRanked doesn't have 'text' field
+            if (! $rerankerEnabled) {
+                $texts = array_map(function ($c) {
+                    $docId = (int) ($c['document_id'] ?? 0);
+                    $chunkIdx = (int) ($c['chunk_index'] ?? 0);
+
+                    return $this->text->getChunkSnippet($docId, $chunkIdx, 300) ?? '';
+                }, $mmrRanked);
+            } else {
+                $texts = array_map(fn ($c) => (string) ($c['text'] ?? ''), $mmrRanked);
+            }
 
-        // Cache embeddings + MMR calculation
-        // Note: When reranker disabled, we skip cache to avoid serialization issues
-        if (! $rerankerEnabled) {
-            $docEmb = $texts ? $this->embeddings->embedTexts($texts) : [];
-            $selIdx = $this->mmr($qEmb, $docEmb, $mmrLambda, $mmrTake);
-        } else {
-            $selIdx = $this->cache->remember($mmrCacheKey, function () use ($texts, $qEmb, $mmrLambda, $mmrTake) {
+            // Cache embeddings + MMR calculation
+            // Note: When reranker disabled, we skip cache to avoid serialization issues
+            if (! $rerankerEnabled) {
                 $docEmb = $texts ? $this->embeddings->embedTexts($texts) : [];
+                $selIdx = $this->mmr($qEmb, $docEmb, $mmrLambda, $mmrTake);
+            } else {
+                $selIdx = $this->cache->remember($mmrCacheKey, function () use ($texts, $qEmb, $mmrLambda, $mmrTake) {
+                    $docEmb = $texts ? $this->embeddings->embedTexts($texts) : [];
 
-                return $this->mmr($qEmb, $docEmb, $mmrLambda, $mmrTake);
-            });
+                    return $this->mmr($qEmb, $docEmb, $mmrLambda, $mmrTake);
+                });
+            }
         }
 
         // 📊 Log optimization impact
@@ -772,6 +818,7 @@ public function retrieve(int $tenantId, string $query, bool $debug = false): arr
             Log::info('🚀 [MMR] Performance optimization applied', [
                 'total_ranked_docs' => count($ranked),
                 'mmr_candidates_used' => $mmrMaxCandidates,
+                'server_mmr' => $serverMmr,
                 'performance_gain_estimate' => round((count($ranked) ** 2) / ($mmrMaxCandidates ** 2), 1).'x faster',
             ]);
         }
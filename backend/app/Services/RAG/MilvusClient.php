@@ -10,11 +10,32 @@ class MilvusClient
 
     private string $pythonScript;
 
+    private ?string $workerSocket;
+
+    private float $workerTimeout;
+
+    private bool $binaryVectors;
+
+    private bool $timings;
+
+    private bool $sparse;
+
+    private bool $payload;
+
+    private RagTelemetry $telemetry;
+
     public function __construct()
     {
         $cfg = config('rag.vector.milvus');
         $this->collection = (string) ($cfg['collection'] ?? 'kb_chunks_v1');
         $this->pythonScript = base_path('milvus_search.py');
+        $this->workerSocket = ! empty($cfg['worker_socket']) ? (string) $cfg['worker_socket'] : null;
+        $this->workerTimeout = (float) ($cfg['worker_timeout'] ?? 30);
+        $this->binaryVectors = (bool) ($cfg['binary_vectors'] ?? true);
+        $this->timings = (bool) ($cfg['timings'] ?? false);
+        $this->sparse = (bool) ($cfg['sparse'] ?? false);
+        $this->payload = (bool) ($cfg['payload'] ?? false);
+        $this->telemetry = new RagTelemetry;
 
         if (! file_exists($this->pythonScript)) {
             Log::error('milvus.python_script_not_found', ['script' => $this->pythonScript]);
@@ -33,6 +54,19 @@ private function executePythonOperation(string $operation, array $params = []):
                 'operation' => $operation,
                 'collection' => $this->collection,
             ], $params);
+            if ($this->timings) {
+                $pythonParams['timings'] = true;
+            }
+
+            // Worker persistente (milvus_search.py --serve): evita avvio interprete, connect e load
+            $result = $this->executeViaWorker($pythonParams);
+            if ($result !== null) {
+                return $this->logOperationResult($operation, $result);
+            }
+
+            // Fallback: processo one-shot
+            // `sent_at` permette allo script di misurare l'avvio dell'interprete
+            $pythonParams['sent_at'] = microtime(true);
 
             // Su Windows, escapeshellarg rovina il JSON. Usiamo un file temporaneo
             $tempFile = tempnam(sys_get_temp_dir(), 'milvus_params_');
@@ -57,7 +91,15 @@ private function executePythonOperation(string $operation, array $params = []):
                 return ['success' => false, 'error' => 'No output from Python script'];
             }
 
-            $result = json_decode(trim($output), true);
+            // stderr è unito a stdout: la risposta è l'ultima riga JSON, le altre sono diagnostica (es. chiamate lente)
+            $jsonLine = '';
+            foreach (array_reverse(explode("\n", trim($output))) as $line) {
+                if (str_starts_with(ltrim($line), '{')) {
+                    $jsonLine = $line;
+                    break;
+                }
+            }
+            $result = json_decode(trim($jsonLine), true);
 
             if (! $result) {
                 Log::error('milvus.python.invalid_json', [
@@ -68,18 +110,7 @@ private function executePythonOperation(string $operation, array $params = []):
                 return ['success' => false, 'error' => 'Invalid JSON response from Python script'];
             }
 
-            if (! $result['success']) {
-                Log::warning('milvus.python.operation_failed', [
-                    'operation' => $operation,
-                    'error' => $result['error'] ?? 'Unknown error',
-                ]);
-            } else {
-                Log::debug('milvus.python.operation_success', [
-                    'operation' => $operation,
-                ]);
-            }
-
-            return $result;
+            return $this->logOperationResult($operation, $result);
 
         } catch (\Throwable $e) {
             Log::error('milvus.python.exception', [
@@ -91,13 +122,174 @@ private function executePythonOperation(string $operation, array $params = []):
         }
     }
 
-    public function upsertVectors(int $tenantId, int $documentId, array $chunks, array $vectors): void
+    /**
+     * 🔌 Invia la richiesta al worker persistente via Unix socket (NDJSON)
+     *
+     * Ritorna null se il worker non è configurato o non raggiungibile,
+     * così il chiamante ripiega sul processo one-shot.
+     */
+    private function executeViaWorker(array $pythonParams): ?array
+    {
+        $stream = $this->openWorkerStream($pythonParams);
+        if ($stream === null) {
+            return null;
+        }
+
+        try {
+            $line = fgets($stream);
+            if ($line === false) {
+                Log::warning('milvus.worker.no_response', [
+                    'operation' => $pythonParams['operation'] ?? null,
+                    'timed_out' => stream_get_meta_data($stream)['timed_out'] ?? false,
+                ]);
+
+                return ['success' => false, 'error' => 'No response from Milvus worker'];
+            }
+
+            $result = json_decode(trim($line), true);
+
+            return is_array($result)
+                ? $result
+                : ['success' => false, 'error' => 'Invalid JSON response from Milvus worker'];
+        } finally {
+            fclose($stream);
+        }
+    }
+
+    /**
+     * Apre una connessione al worker e invia la richiesta; null se il worker non è disponibile
+     *
+     * @return resource|null
+     */
+    private function openWorkerStream(array $pythonParams)
+    {
+        if ($this->workerSocket === null) {
+            return null;
+        }
+
+        $errno = 0;
+        $errstr = '';
+        $stream = @stream_socket_client('unix://'.$this->workerSocket, $errno, $errstr, 1.0);
+        if ($stream === false) {
+            // Il chiamante ripiega sul processo one-shot: con il worker attivo indica un backlog saturo
+            Log::warning('milvus.worker.unavailable', [
+                'socket' => $this->workerSocket,
+                'operation' => $pythonParams['operation'] ?? null,
+                'errno' => $errno,
+                'error' => $errstr,
+                'fallback' => 'one-shot',
+            ]);
+
+            return null;
+        }
+
+        stream_set_timeout($stream, (int) ceil($this->workerTimeout));
+
+        if (fwrite($stream, json_encode($pythonParams)."\n") === false) {
+            fclose($stream);
+
+            return null;
+        }
+
+        return $stream;
+    }
+
+    /**
+     * 🌊 Esegue un'operazione in streaming, restituendo i frame NDJSON man mano che arrivano
+     *
+     * L'ultimo frame (`done: true`) chiude lo stream; se riporta un errore viene
+     * sollevata un'eccezione.
+     *
+     * @return \Generator<int, array>
+     */
+    private function streamPythonOperation(string $operation, array $params = []): \Generator
+    {
+        $pythonParams = array_merge([
+            'operation' => $operation,
+            'collection' => $this->collection,
+        ], $params);
+
+        $tempFile = null;
+        $stream = $this->openWorkerStream($pythonParams);
+
+        if ($stream === null) {
+            $tempFile = tempnam(sys_get_temp_dir(), 'milvus_params_');
+            file_put_contents($tempFile, json_encode($pythonParams));
+
+            // Senza 2>&1: eventuali messaggi su stderr non devono mescolarsi ai frame
+            $pythonPath = config('rag.vector.milvus.python_path', 'python');
+            $stream = popen("\"{$pythonPath}\" \"{$this->pythonScript}\" \"@{$tempFile}\"", 'r');
+
+            if ($stream === false) {
+                unlink($tempFile);
+                throw new \RuntimeException("Unable to start Milvus stream for {$operation}");
+            }
+        }
+
+        try {
+            while (($line = fgets($stream)) !== false) {
+                $frame = json_decode(trim($line), true);
+                if (! is_array($frame)) {
+                    continue;
+                }
+
+                // Frame finale o errore di validazione
+                if (array_key_exists('success', $frame)) {
+                    if (! $frame['success']) {
+                        Log::error('milvus.stream_failed', [
+                            'operation' => $operation,
+                            'error' => $frame['error'] ?? 'Unknown error',
+                        ]);
+
+                        throw new \RuntimeException('Milvus stream failed: '.($frame['error'] ?? 'Unknown error'));
+                    }
+
+                    return;
+                }
+
+                yield $frame;
+            }
+
+            throw new \RuntimeException("Milvus stream for {$operation} ended without final frame");
+        } finally {
+            if ($tempFile !== null) {
+                pclose($stream);
+                unlink($tempFile);
+            } else {
+                fclose($stream);
+            }
+        }
+    }
+
+    private function logOperationResult(string $operation, array $result): array
     {
-        $result = $this->executePythonOperation('upsert', [
+        if (isset($result['timings'])) {
+            $this->telemetry->event('milvus.timings', ['operation' => $operation] + $result['timings']);
+        }
+
+        if (! ($result['success'] ?? false)) {
+            Log::warning('milvus.python.operation_failed', [
+                'operation' => $operation,
+                'error' => $result['error'] ?? 'Unknown error',
+            ]);
+        } else {
+            Log::debug('milvus.python.operation_success', [
+                'operation' => $operation,
+            ]);
+        }
+
+        return $result;
+    }
+
+    /**
+     * @param  array{title?: string, source_url?: string, knowledge_base_id?: int}  $metadata  salvati con i chunk (campi dinamici)
+     */
+    public function upsertVectors(int $tenantId, int $documentId, array $chunks, array $vectors, array $metadata = []): void
+    {
+        $result = $this->executePythonOperation('upsert', array_merge([
             'tenant_id' => $tenantId,
             'document_id' => $documentId,
-            'vectors' => $vectors,
-        ]);
+        ], $this->vectorsParam('vectors', array_values($vectors)), $this->chunksParam($chunks, $metadata)));
 
         if (! $result['success']) {
             Log::error('milvus.upsert_failed', [
@@ -114,6 +306,80 @@ public function upsertVectors(int $tenantId, int $documentId, array $chunks, arr
         }
     }
 
+    /**
+     * 🔄 Re-indicizzazione incrementale di un documento (sync_document)
+     *
+     * Riscrive solo i chunk modificati (confronto via hash del testo),
+     * elimina i chunk_index non più presenti e lascia invariati gli altri.
+     *
+     * @return array{upserted_count?: int, unchanged_count?: int, deleted_count?: int}
+     */
+    public function syncDocumentVectors(int $tenantId, int $documentId, array $chunks, array $vectors, array $metadata = []): array
+    {
+        $result = $this->executePythonOperation('sync_document', array_merge([
+            'tenant_id' => $tenantId,
+            'document_id' => $documentId,
+            'chunk_hashes' => array_map(static fn ($chunk) => sha1((string) $chunk), array_values($chunks)),
+        ], $this->vectorsParam('vectors', array_values($vectors)), $this->chunksParam($chunks, $metadata)));
+
+        if (! $result['success']) {
+            Log::error('milvus.sync_document_failed', [
+                'tenant_id' => $tenantId,
+                'document_id' => $documentId,
+                'error' => $result['error'] ?? 'Unknown error',
+            ]);
+
+            return [];
+        }
+
+        Log::info('milvus.sync_document_success', [
+            'tenant_id' => $tenantId,
+            'document_id' => $documentId,
+            'upserted_count' => $result['upserted_count'] ?? 0,
+            'unchanged_count' => $result['unchanged_count'] ?? 0,
+            'deleted_count' => $result['deleted_count'] ?? 0,
+        ]);
+
+        return $result;
+    }
+
+    /**
+     * 📚 Upsert di molti documenti in una sola chiamata (bulk_upsert)
+     *
+     * @param  array<int, array{tenant_id: int, document_id: int, vectors: array, chunks?: array, metadata?: array}>  $documents
+     * @return array<int, array> report per documento (inserted_count, success, error)
+     */
+    public function bulkUpsertVectors(array $documents): array
+    {
+        if (empty($documents)) {
+            return [];
+        }
+
+        $payload = array_map(fn (array $doc) => array_merge([
+            'tenant_id' => (int) $doc['tenant_id'],
+            'document_id' => (int) $doc['document_id'],
+        ], $this->vectorsParam('vectors', array_values($doc['vectors'] ?? [])), $this->chunksParam($doc['chunks'] ?? [], $doc['metadata'] ?? [])), array_values($documents));
+
+        $result = $this->executePythonOperation('bulk_upsert', ['documents' => $payload]);
+
+        if (! $result['success']) {
+            Log::error('milvus.bulk_upsert_failed', [
+                'documents_count' => count($documents),
+                'error' => $result['error'] ?? 'Unknown error',
+            ]);
+
+            return [];
+        }
+
+        Log::info('milvus.bulk_upsert_success', [
+            'documents_count' => count($documents),
+            'inserted_count' => $result['inserted_count'] ?? 0,
+            'failed_documents' => $result['failed_documents'] ?? 0,
+        ]);
+
+        return $result['documents'] ?? [];
+    }
+
     public function deleteByDocument(int $tenantId, int $documentId): void
     {
         // Deprecated in favore di deleteByPrimaryIds calcolati esternamente
@@ -124,13 +390,28 @@ public function searchTopK(int $tenantId, array $queryVector, int $k = 10): arra
         return $this->searchTopKWithEmbedding($tenantId, $queryVector, $k);
     }
 
-    public function searchTopKWithEmbedding(int $tenantId, array $queryEmbedding, int $k = 10): array
+    /**
+     * 🔍 Ricerca top-k del tenant
+     *
+     * Opzioni: min_score (similarità coseno minima, range search), group_by = 'document_id'
+     * con al più group_size chunk per documento, document_ids / exclude_document_ids (allow/deny list),
+     * output_fields (es. text, title, source_url, knowledge_base_id: tornano come chiavi degli hit).
+     *
+     * @param  array{min_score?: float, group_by?: string, group_size?: int, document_ids?: array<int>, exclude_document_ids?: array<int>, output_fields?: array<string>}  $options
+     */
+    public function searchTopKWithEmbedding(int $tenantId, array $queryEmbedding, int $k = 10, array $options = []): array
     {
-        $result = $this->executePythonOperation('search', [
+        $options = array_intersect_key($options, array_flip(['min_score', 'group_by', 'group_size', 'document_ids', 'exclude_document_ids', 'output_fields']));
+        foreach (['document_ids', 'exclude_document_ids'] as $key) {
+            if (isset($options[$key])) {
+                $options[$key] = array_values(array_map('intval', $options[$key]));
+            }
+        }
+
+        $result = $this->executePythonOperation('search', array_merge([
             'tenant_id' => $tenantId,
-            'query_vector' => array_map('floatval', $queryEmbedding),
             'limit' => max(1, $k),
-        ]);
+        ], $options, $this->vectorsParam('query_vector', [$queryEmbedding], true)));
 
         if (! $result['success']) {
             Log::error('milvus.search_failed', [
@@ -141,22 +422,185 @@ public function searchTopKWithEmbedding(int $tenantId, array $queryEmbedding, in
             return [];
         }
 
-        // Converti formato Python in formato atteso da Laravel
+        return $this->mapHits($result['hits'] ?? []);
+    }
+
+    /**
+     * 🔀 Ricerca multi-query in un solo round trip (search_batch, nq > 1)
+     *
+     * @param  array<int, array<float>>  $queryEmbeddings
+     * @param  int|array<int, int>  $k  limite unico o un limite per query
+     * @return array{results: array<int, array>, fused: array}
+     */
+    public function searchTopKBatchWithEmbedding(int $tenantId, array $queryEmbeddings, int|array $k = 10, bool $fuse = false, int $rrfK = 60): array
+    {
+        if (empty($queryEmbeddings)) {
+            return ['results' => [], 'fused' => []];
+        }
+
+        $params = array_merge([
+            'tenant_id' => $tenantId,
+            'fuse' => $fuse,
+            'rrf_k' => $rrfK,
+        ], $this->vectorsParam('query_vectors', array_values($queryEmbeddings)));
+
+        if (is_array($k)) {
+            $params['limits'] = array_map(static fn ($limit) => max(1, (int) $limit), array_values($k));
+        } else {
+            $params['limit'] = max(1, $k);
+        }
+
+        $result = $this->executePythonOperation('search_batch', $params);
+
+        if (! $result['success']) {
+            Log::error('milvus.search_batch_failed', [
+                'tenant_id' => $tenantId,
+                'nq' => count($queryEmbeddings),
+                'error' => $result['error'] ?? 'Unknown error',
+            ]);
+
+            return ['results' => array_fill(0, count($queryEmbeddings), []), 'fused' => []];
+        }
+
+        return [
+            'results' => array_map(fn (array $hits) => $this->mapHits($hits), $result['results'] ?? []),
+            'fused' => $result['fused'] ?? [],
+        ];
+    }
+
+    /**
+     * 🔀 Ricerca ibrida densa + sparsa fusa da Milvus (hybrid_search)
+     *
+     * Una sola chiamata al posto di Milvus + BM25 SQL: il testo della query
+     * diventa il vettore sparso, Milvus fonde i due rami con RRF o media pesata.
+     * Gli hit hanno lo stesso formato di searchTopKWithEmbedding, con `score` = score fuso.
+     *
+     * @param  array{0: float, 1: float}  $weights  pesi denso/sparso per il ranker weighted
+     * @return array|null hit fusi, null se l'operazione fallisce (es. campo sparso assente o Milvus giù)
+     */
+    public function hybridSearchWithEmbedding(int $tenantId, array $queryEmbedding, string $queryText, int $k = 10, string $ranker = 'rrf', int $rrfK = 60, array $weights = [0.5, 0.5]): ?array
+    {
+        $result = $this->executePythonOperation('hybrid_search', array_merge([
+            'tenant_id' => $tenantId,
+            'limit' => max(1, $k),
+            'query_text' => $queryText,
+            'ranker' => $ranker,
+            'rrf_k' => $rrfK,
+            'weights' => array_map('floatval', array_values($weights)),
+        ], $this->vectorsParam('query_vector', [$queryEmbedding], true)));
+
+        if (! $result['success']) {
+            Log::error('milvus.hybrid_search_failed', [
+                'tenant_id' => $tenantId,
+                'error' => $result['error'] ?? 'Unknown error',
+            ]);
+
+            return null;
+        }
+
+        return $this->mapHits($result['hits'] ?? []);
+    }
+
+    /**
+     * 🎯 Selezione MMR lato server (search_mmr) sui vettori salvati dei candidati
+     *
+     * @param  array<int, int>  $primaryIds  candidati in ordine di rilevanza (document_id * 100000 + chunk_index)
+     * @return array<int, int>|null primary_id selezionati in ordine, null se l'operazione fallisce
+     */
+    public function mmrSelect(int $tenantId, array $queryEmbedding, array $primaryIds, int $k, float $lambda): ?array
+    {
+        $result = $this->executePythonOperation('search_mmr', array_merge([
+            'tenant_id' => $tenantId,
+            'candidate_ids' => array_values(array_map('intval', $primaryIds)),
+            'k' => max(1, $k),
+            'mmr_lambda' => max(0.0, min(1.0, $lambda)),
+        ], $this->vectorsParam('query_vector', [$queryEmbedding], true)));
+
+        if (! $result['success']) {
+            Log::error('milvus.search_mmr_failed', [
+                'tenant_id' => $tenantId,
+                'candidates' => count($primaryIds),
+                'error' => $result['error'] ?? 'Unknown error',
+            ]);
+
+            return null;
+        }
+
+        return array_map(static fn (array $hit) => (int) $hit['id'], $result['hits'] ?? []);
+    }
+
+    /**
+     * 📝 Testo dei chunk e metadati del documento
+     *
+     * Il testo serve al campo sparso (pesi dei termini calcolati in Python) e, con i
+     * campi dinamici, viene salvato in Milvus insieme a title, source_url e knowledge_base_id.
+     */
+    private function chunksParam(array $chunks, array $metadata = []): array
+    {
+        $params = [];
+        if (($this->sparse || $this->payload) && ! empty($chunks)) {
+            $params['chunks'] = array_map(static fn ($chunk) => (string) $chunk, array_values($chunks));
+        }
+        $metadata = array_filter(
+            array_intersect_key($metadata, array_flip(['title', 'source_url', 'knowledge_base_id'])),
+            static fn ($value) => $value !== null
+        );
+        if ($this->payload && ! empty($metadata)) {
+            $params['metadata'] = $metadata;
+        }
+
+        return $params;
+    }
+
+    /**
+     * 📦 Parametri vettori per lo script Python
+     *
+     * In modalità binaria i vettori viaggiano come base64 di float32 little-endian
+     * (`<key>_b64` + `dim`), circa 4 volte più compatti della lista JSON e senza
+     * parsing di float lato Python. Altrimenti usa il formato JSON legacy.
+     *
+     * @param  array<int, array<float>>  $vectors
+     */
+    private function vectorsParam(string $key, array $vectors, bool $single = false): array
+    {
+        if (! $this->binaryVectors) {
+            $lists = array_map(static fn (array $vector) => array_map('floatval', $vector), $vectors);
+
+            return [$key => $single ? $lists[0] : $lists];
+        }
+
+        $binary = '';
+        foreach ($vectors as $vector) {
+            $binary .= pack('g*', ...array_map('floatval', array_values($vector)));
+        }
+
+        return [
+            $key.'_b64' => base64_encode($binary),
+            'dim' => count($vectors[0] ?? []),
+        ];
+    }
+
+    /**
+     * Converti formato Python in formato atteso da Laravel
+     */
+    private function mapHits(array $rawHits): array
+    {
         $hits = [];
-        foreach ($result['hits'] ?? [] as $hit) {
+        foreach ($rawHits as $hit) {
             $primaryId = (int) $hit['id'];
 
             // Inverti la formula: primary_id = (document_id * 100000) + chunk_index
             $documentId = intval($primaryId / 100000);
             $chunkIndex = $primaryId % 100000;
 
+            // Campi richiesti con output_fields (testo e metadati del chunk), senza sovrascrivere quelli calcolati
             $hits[] = [
                 'primary_id' => $primaryId,
                 'document_id' => $documentId,
                 'chunk_index' => $chunkIndex,
                 'distance' => (float) $hit['distance'],
                 'score' => (float) $hit['score'],
-            ];
+            ] + (array) ($hit['fields'] ?? []);
         }
 
         return $hits;
@@ -185,6 +629,20 @@ public function health(): array
         ];
     }
 
+    /**
+     * 📈 Istogrammi per fase del worker persistente in formato OpenMetrics (null senza worker)
+     */
+    public function workerMetrics(): ?string
+    {
+        if ($this->workerSocket === null) {
+            return null;
+        }
+
+        $result = $this->executeViaWorker(['operation' => 'metrics']);
+
+        return ($result['success'] ?? false) ? (string) $result['metrics'] : null;
+    }
+
     public function countByTenant(int $tenantId): int
     {
         $result = $this->executePythonOperation('count_by_tenant', [
@@ -203,6 +661,33 @@ public function countByTenant(int $tenantId): int
         return (int) ($result['count'] ?? 0);
     }
 
+    /**
+     * 📊 Chunk per documento di un tenant (count e max chunk_index) in una sola chiamata
+     *
+     * @return array{count: int, document_count: int, documents: array<int, array{document_id: int, count: int, max_chunk_index: int}>}|null null se l'operazione fallisce
+     */
+    public function statsByTenant(int $tenantId): ?array
+    {
+        $result = $this->executePythonOperation('stats_by_tenant', [
+            'tenant_id' => $tenantId,
+        ]);
+
+        if (! $result['success']) {
+            Log::error('milvus.stats_by_tenant_failed', [
+                'tenant_id' => $tenantId,
+                'error' => $result['error'] ?? 'Unknown error',
+            ]);
+
+            return null;
+        }
+
+        return [
+            'count' => (int) ($result['count'] ?? 0),
+            'document_count' => (int) ($result['document_count'] ?? 0),
+            'documents' => $result['documents'] ?? [],
+        ];
+    }
+
     public function deleteByTenant(int $tenantId): bool
     {
         $result = $this->executePythonOperation('delete_by_tenant', [
@@ -225,15 +710,22 @@ public function deleteByTenant(int $tenantId): bool
         return true;
     }
 
-    public function deleteByPrimaryIds(array $primaryIds): void
+    /**
+     * @param  int|null  $tenantId  Tenant proprietario degli ID: limita l'invalidazione della cache di ricerca a quel tenant
+     * @return array{success: bool, deleted_count?: int, error?: string}
+     */
+    public function deleteByPrimaryIds(array $primaryIds, ?int $tenantId = null): array
     {
         if (empty($primaryIds)) {
-            return;
+            return ['success' => true, 'deleted_count' => 0];
         }
 
-        $result = $this->executePythonOperation('delete_by_ids', [
-            'primary_ids' => $primaryIds,
-        ]);
+        $params = ['primary_ids' => $primaryIds];
+        if ($tenantId !== null) {
+            $params['tenant_id'] = $tenantId;
+        }
+
+        $result = $this->executePythonOperation('delete_by_ids', $params);
 
         if (! $result['success']) {
             Log::error('milvus.delete_by_ids_failed', [
@@ -245,6 +737,52 @@ public function deleteByPrimaryIds(array $primaryIds): void
                 'deleted_count' => $result['deleted_count'] ?? 0,
             ]);
         }
+
+        return $result;
+    }
+
+    /**
+     * 🧹 Compaction manuale se le righe cancellate superano la soglia (operazione `compaction`)
+     *
+     * Una compaction che non termina entro l'attesa prosegue in Milvus: la chiamata successiva
+     * la segue invece di avviarne un'altra. Con il worker l'attesa resta sotto il suo timeout.
+     * `flush_before` (default true) esegue un flush prima della compaction, così i segmenti
+     * growing vengono sigillati e inclusi; non va confuso con la modalità `flush` delle scritture.
+     *
+     * @param  array{delete_ratio?: float, min_deleted?: int, wait_seconds?: float, force?: bool, dry_run?: bool, flush_before?: bool}  $options
+     */
+    public function compact(array $options = []): array
+    {
+        $params = array_filter([
+            'delete_ratio' => isset($options['delete_ratio']) ? (float) $options['delete_ratio'] : null,
+            'min_deleted' => isset($options['min_deleted']) ? (int) $options['min_deleted'] : null,
+            'force' => (bool) ($options['force'] ?? false),
+            'dry_run' => (bool) ($options['dry_run'] ?? false),
+            'flush_before' => (bool) ($options['flush_before'] ?? true),
+        ], fn ($value) => $value !== null);
+
+        $wait = (float) ($options['wait_seconds'] ?? 60);
+        if ($this->workerSocket !== null) {
+            $wait = min($wait, max(1.0, $this->workerTimeout - 5));
+        }
+        $params['wait_seconds'] = $wait;
+
+        $result = $this->executePythonOperation('compaction', $params);
+
+        if (! $result['success']) {
+            Log::error('milvus.compaction_failed', [
+                'error' => $result['error'] ?? 'Unknown error',
+            ]);
+        } else {
+            Log::info('milvus.compaction', [
+                'triggered' => $result['triggered'] ?? false,
+                'reasons' => $result['reasons'] ?? [],
+                'state' => $result['compaction']['state'] ?? null,
+                'delete_ratio' => $result['before']['delete_ratio'] ?? null,
+            ]);
+        }
+
+        return $result;
     }
 
     public function listPrimaryIdsByTenant(int $tenantId): array
@@ -265,6 +803,23 @@ public function listPrimaryIdsByTenant(int $tenantId): array
         return array_map('intval', $result['ids'] ?? []);
     }
 
+    /**
+     * 🌊 Esporta in streaming id, document_id e chunk_index (ed eventualmente i vettori) di un tenant
+     *
+     * Ogni frame contiene le colonne `ids`, `document_ids`, `chunk_indices`
+     * (più `vectors_b64` e `dim` con $withVectors): la memoria resta costante
+     * e il chiamante può elaborare i dati mentre vengono letti da Milvus.
+     *
+     * @return \Generator<int, array>
+     */
+    public function exportTenant(int $tenantId, bool $withVectors = false): \Generator
+    {
+        yield from $this->streamPythonOperation('export_tenant', [
+            'tenant_id' => $tenantId,
+            'with_vectors' => $withVectors,
+        ]);
+    }
+
     public function createPartition(string $partitionName): void
     {
         $result = $this->executePythonOperation('create_partition', [
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+Benchmark riproducibile delle operazioni di milvus_search.py.
+
+Genera un corpus sintetico multi-tenant (vettori normalizzati, seed fisso),
+lo carica in una collection dedicata e misura latenza cold/warm
+(p50/p95/p99) e throughput di search, upsert, delete_by_ids,
+count_by_tenant e list_ids_by_tenant nelle modalità:
+
+- oneshot: un processo Python per chiamata, come lo shell_exec di Laravel
+- stdio:   worker persistente (--serve) su stdin/stdout
+- socket:  worker persistente su Unix domain socket, con --concurrency client
+
+Di default usa Milvus Lite su file locale (MILVUS_URI=./milvus_benchmark.db),
+quindi non serve un server. Il risultato è un file JSON; con --compare si
+confronta con un risultato precedente (es. di un altro commit).
+
+"cold" è la prima chiamata di ogni operazione in un processo nuovo (load
+della collection compreso), "warm" sono le chiamate successive.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+SEARCH_SCRIPT = os.path.join(SCRIPT_DIR, "milvus_search.py")
+
+MODES = ("oneshot", "stdio", "socket")
+OPERATIONS = ("search", "upsert", "delete_by_ids", "count_by_tenant", "list_ids_by_tenant")
+
+def log(message):
+    print(message, file=sys.stderr)
+
+def synthetic_vectors(rng, rows, dim):
+    """Vettori gaussiani normalizzati (distribuzione simile agli embedding OpenAI)"""
+    matrix = rng.standard_normal((rows, dim), dtype=np.float32)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+def b64(matrix):
+    import base64
+    return base64.b64encode(np.ascontiguousarray(matrix, dtype='<f4').tobytes()).decode('ascii')
+
+def populate(args):
+    """Crea la collection di benchmark e carica il corpus sintetico (in un processo a parte, vedi main)"""
+    sys.path.insert(0, SCRIPT_DIR)
+    import milvus_search
+    from pymilvus import utility
+    from create_milvus_collection import ensure_collection
+
+    milvus_search.connect_milvus()
+    if utility.has_collection(args.collection):
+        utility.drop_collection(args.collection)
+    ensure_collection(args.collection, args.dim, "COSINE", args.tenant_partitioning)
+
+    rng = np.random.default_rng(args.seed)
+    started = time.perf_counter()
+    for tenant_id in range(1, args.tenants + 1):
+        documents = []
+        for doc in range(args.docs):
+            document_id = tenant_id * 100000 + doc + 1
+            documents.append({
+                "tenant_id": tenant_id,
+                "document_id": document_id,
+                "vectors_b64": b64(synthetic_vectors(rng, args.chunks, args.dim)),
+                "dim": args.dim,
+            })
+        result = milvus_search.bulk_upsert(args.collection, documents, flush='none')
+        if not result.get("success"):
+            raise SystemExit(f"popolamento fallito: {result.get('error')}")
+
+    milvus_search.get_collection(args.collection).flush()
+    rows = args.tenants * args.docs * args.chunks
+    seconds = time.perf_counter() - started
+    log(f"corpus: {rows} chunk ({args.tenants} tenant × {args.docs} doc × {args.chunks} chunk) in {seconds:.1f}s")
+    return {"rows": rows, "seconds": round(seconds, 2)}
+
+def build_requests(operation, args, rng, count):
+    """Richieste di un'operazione; upsert e delete_by_ids lavorano su documenti nuovi, fuori dal corpus"""
+    tenants = [1 + i % args.tenants for i in range(count)]
+    base = {"collection": args.collection}
+    if operation == "search":
+        return [{**base, "operation": "search", "tenant_id": t, "limit": args.limit, "dim": args.dim, "cache": False,
+                 "query_vector_b64": b64(synthetic_vectors(rng, 1, args.dim))} for t in tenants]
+    if operation == "upsert":
+        return [{**base, "operation": "upsert", "tenant_id": t, "document_id": 90000000 + i, "dim": args.dim,
+                 "flush": args.flush, "vectors_b64": b64(synthetic_vectors(rng, args.chunks, args.dim))}
+                for i, t in enumerate(tenants)]
+    if operation == "delete_by_ids":
+        return [{**base, "operation": "delete_by_ids", "tenant_id": t, "flush": args.flush,
+                 "primary_ids": [(90000000 + i) * 100000 + c for c in range(args.chunks)]}
+                for i, t in enumerate(tenants)]
+    return [{**base, "operation": operation, "tenant_id": t} for t in tenants]
+
+class OneShotRunner:
+    """Un processo per chiamata: misura anche avvio dell'interprete, import e connessione"""
+
+    def __init__(self, env):
+        self.env = env
+        self.workdir = tempfile.mkdtemp(prefix="milvus_bench_")
+
+    def start(self):
+        pass
+
+    def call(self, request):
+        path = os.path.join(self.workdir, "request.json")
+        with open(path, "w") as f:
+            json.dump(request, f)
+        completed = subprocess.run([sys.executable, SEARCH_SCRIPT, f"@{path}"], env=self.env,
+                                   capture_output=True, text=True)
+        return json.loads(completed.stdout.strip().splitlines()[-1]) if completed.stdout.strip() else {
+            "success": False, "error": completed.stderr.strip()[-500:]}
+
+    def stop(self):
+        pass
+
+class StdioRunner:
+    """Worker persistente su stdin/stdout (una richiesta per volta)"""
+
+    def __init__(self, env):
+        self.env = env
+        self.process = None
+
+    def start(self):
+        self.process = subprocess.Popen([sys.executable, SEARCH_SCRIPT, "--serve"], env=self.env, text=True,
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+
+    def call(self, request):
+        self.process.stdin.write(json.dumps(request) + "\n")
+        self.process.stdin.flush()
+        return json.loads(self.process.stdout.readline())
+
+    def stop(self):
+        try:
+            self.process.stdin.write(json.dumps({"operation": "shutdown"}) + "\n")
+            self.process.stdin.flush()
+            self.process.wait(timeout=30)
+        except Exception:
+            self.process.kill()
+
+class SocketRunner:
+    """Worker persistente su Unix socket; ogni thread client usa la propria connessione"""
+
+    def __init__(self, env):
+        self.env = env
+        self.path = os.path.join(tempfile.mkdtemp(prefix="milvus_bench_"), "worker.sock")
+        self.process = None
+        self.local = threading.local()
+
+    def start(self):
+        self.process = subprocess.Popen([sys.executable, SEARCH_SCRIPT, "--serve", "--socket", self.path],
+                                        env=self.env, stderr=subprocess.DEVNULL)
+        deadline = time.monotonic() + 60
+        while not os.path.exists(self.path):
+            if time.monotonic() > deadline or self.process.poll() is not None:
+                raise RuntimeError("il worker non ha aperto il socket")
+            time.sleep(0.05)
+
+    def call(self, request):
+        stream = getattr(self.local, "stream", None)
+        if stream is None:
+            client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            client.connect(self.path)
+            stream = self.local.stream = client.makefile("rw", encoding="utf-8")
+        stream.write(json.dumps(request) + "\n")
+        stream.flush()
+        return json.loads(stream.readline())
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+RUNNERS = {"oneshot": OneShotRunner, "stdio": StdioRunner, "socket": SocketRunner}
+
+def percentiles(latencies):
+    if not latencies:
+        return {}
+    values = np.asarray(latencies)
+    return {
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+        "mean_ms": round(float(values.mean()), 2),
+    }
+
+def run_operation(mode, operation, requests, env, concurrency):
+    """Avvia un processo/worker nuovo, misura la prima chiamata (cold) e poi le altre (warm)"""
+    runner = RUNNERS[mode](env)
+    runner.start()
+    errors = []
+    try:
+        started = time.perf_counter()
+        first = runner.call(requests[0])
+        cold_ms = (time.perf_counter() - started) * 1000
+        if not first.get("success"):
+            errors.append(first.get("error"))
+
+        latencies = []
+        lock = threading.Lock()
+        pending = list(requests[1:])
+
+        def client():
+            while True:
+                with lock:
+                    if not pending:
+                        return
+                    request = pending.pop(0)
+                t0 = time.perf_counter()
+                result = runner.call(request)
+                elapsed = (time.perf_counter() - t0) * 1000
+                with lock:
+                    latencies.append(elapsed)
+                    if not result.get("success"):
+                        errors.append(result.get("error"))
+
+        threads = [threading.Thread(target=client) for _ in range(concurrency if mode == "socket" else 1)]
+        warm_started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        warm_seconds = time.perf_counter() - warm_started
+    finally:
+        runner.stop()
+
+    return {
+        "mode": mode,
+        "operation": operation,
+        "calls": len(requests),
+        "concurrency": len(threads),
+        "cold_ms": round(cold_ms, 2),
+        "warm": percentiles(latencies),
+        "throughput_ops": round(len(latencies) / warm_seconds, 2) if warm_seconds > 0 else None,
+        "errors": len(errors),
+        **({"first_error": errors[0]} if errors else {}),
+    }
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=SCRIPT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+def compare(current, baseline_path):
+    """Stampa la variazione di cold e p50/p95 warm rispetto a un risultato precedente"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {(r["mode"], r["operation"]): r for r in baseline.get("results", [])}
+    log(f"\nconfronto con {baseline_path} ({baseline.get('meta', {}).get('git_revision')})")
+    for result in current["results"]:
+        old = previous.get((result["mode"], result["operation"]))
+        if not old:
+            continue
+        deltas = []
+        for label, new_value, old_value in (
+            ("cold", result["cold_ms"], old["cold_ms"]),
+            ("p50", result["warm"].get("p50_ms"), old["warm"].get("p50_ms")),
+            ("p95", result["warm"].get("p95_ms"), old["warm"].get("p95_ms")),
+        ):
+            if new_value is not None and old_value:
+                deltas.append(f"{label} {old_value}→{new_value}ms ({(new_value - old_value) / old_value:+.0%})")
+        log(f"  {result['mode']:<8} {result['operation']:<20} " + "  ".join(deltas))
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark delle operazioni di milvus_search.py")
+    parser.add_argument("--uri", default=os.getenv("MILVUS_URI", os.path.join(os.getcwd(), "milvus_benchmark.db")),
+                        help="MILVUS_URI: file locale di Milvus Lite (default) o endpoint http(s)")
+    parser.add_argument("--collection", default="kb_benchmark")
+    parser.add_argument("--tenants", type=int, default=4)
+    parser.add_argument("--docs", type=int, default=25, help="Documenti per tenant")
+    parser.add_argument("--chunks", type=int, default=8, help="Chunk per documento")
+    parser.add_argument("--dim", type=int, default=3072)
+    parser.add_argument("--calls", type=int, default=30, help="Chiamate per operazione e modalità")
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--flush", default="sync", choices=["none", "async", "sync"])
+    parser.add_argument("--tenant-partitioning", default="none", choices=["none", "partition_key", "partitions"])
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--operations", default=",".join(OPERATIONS))
+    parser.add_argument("--concurrency", type=int, default=1, help="Client paralleli in modalità socket")
+    parser.add_argument("--skip-populate", action="store_true", help="Riusa la collection già caricata")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="")
+    parser.add_argument("--compare", default="", help="JSON di un benchmark precedente da confrontare")
+    args = parser.parse_args()
+
+    modes = [m for m in args.modes.split(",") if m]
+    operations = [o for o in args.operations.split(",") if o]
+    for value, allowed in ((modes, MODES), (operations, OPERATIONS)):
+        unknown = set(value) - set(allowed)
+        if unknown:
+            parser.error(f"valori non validi: {', '.join(sorted(unknown))}")
+    if "socket" in modes and not hasattr(socket, "AF_UNIX"):
+        parser.error("la modalità socket richiede Unix domain socket")
+
+    # Il processo principale e i processi misurati usano lo stesso Milvus
+    os.environ["MILVUS_URI"] = args.uri
+    env = dict(os.environ)
+
+    corpus = None
+    if not args.skip_populate:
+        # Milvus Lite tiene il file bloccato finché il processo che l'ha aperto resta vivo
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+            corpus = pool.submit(populate, args).result()
+
+    results = []
+    for mode in modes:
+        rng = np.random.default_rng(args.seed + 1)
+        for operation in operations:
+            requests = build_requests(operation, args, rng, args.calls)
+            result = run_operation(mode, operation, requests, env, args.concurrency)
+            warm = result["warm"]
+            log(f"{mode:<8} {operation:<20} cold={result['cold_ms']}ms p50={warm.get('p50_ms')}ms "
+                f"p95={warm.get('p95_ms')}ms p99={warm.get('p99_ms')}ms {result['throughput_ops']} op/s"
+                + (f" errori={result['errors']}" if result["errors"] else ""))
+            results.append(result)
+
+    revision = git_revision()
+    report = {
+        "meta": {
+            "git_revision": revision,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "uri": args.uri,
+            "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+            "corpus": corpus,
+        },
+        "results": results,
+    }
+
+    output = args.output or f"milvus_benchmark_{revision or 'local'}.json"
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    log(f"risultati scritti in {output}")
+
+    if args.compare:
+        compare(report, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -34,6 +34,28 @@
             'tls' => filter_var(env('MILVUS_TLS', false), FILTER_VALIDATE_BOOLEAN),
             'collection' => env('MILVUS_COLLECTION', 'kb_chunks_v1'),
             'python_path' => env('MILVUS_PYTHON_PATH', 'python'), // Percorso completo a python.exe per Windows
+            // Worker persistente: `python milvus_search.py --serve --socket <path>` (vuoto = processo one-shot)
+            'worker_socket' => env('MILVUS_WORKER_SOCKET'),
+            'worker_timeout' => (float) env('MILVUS_WORKER_TIMEOUT', 30),
+            // Vettori inviati come base64 float32 invece di liste JSON
+            'binary_vectors' => filter_var(env('MILVUS_BINARY_VECTORS', true), FILTER_VALIDATE_BOOLEAN),
+            // Tempi per fase (interprete, import, connect, load, rpc, serializzazione) in ogni risposta
+            'timings' => filter_var(env('MILVUS_TIMINGS', false), FILTER_VALIDATE_BOOLEAN),
+            // Campo sparse_vector nella collection: gli upsert inviano il testo dei chunk per i pesi dei termini
+            'sparse' => filter_var(env('MILVUS_SPARSE_FIELD', false), FILTER_VALIDATE_BOOLEAN),
+            // Ricerca ibrida denso + sparso fusa da Milvus (una chiamata) invece di Milvus + BM25 SQL con RRF in PHP
+            'native_hybrid' => filter_var(env('MILVUS_NATIVE_HYBRID', false), FILTER_VALIDATE_BOOLEAN),
+            // Collection con campi dinamici: testo e metadati dei chunk salvati in Milvus e restituiti dalle ricerche
+            'payload' => filter_var(env('MILVUS_DYNAMIC_FIELD', false), FILTER_VALIDATE_BOOLEAN),
+            // MMR calcolato nel worker con i vettori salvati in Milvus (search_mmr) invece che in PHP
+            'server_mmr' => filter_var(env('MILVUS_SERVER_MMR', false), FILTER_VALIDATE_BOOLEAN),
+            // Compaction manuale (milvus:compact, schedulato ogni notte) quando le righe cancellate superano la soglia
+            'compaction' => [
+                'schedule' => filter_var(env('MILVUS_COMPACTION_SCHEDULE', true), FILTER_VALIDATE_BOOLEAN),
+                'delete_ratio' => (float) env('MILVUS_COMPACTION_DELETE_RATIO', 0.2),
+                'min_deleted' => (int) env('MILVUS_COMPACTION_MIN_DELETED', 1000),
+                'wait_seconds' => (float) env('MILVUS_COMPACTION_WAIT', 60),
+            ],
             // Abilita/disabilita la creazione automatica di partizioni per tenant
             // Su Windows può causare problemi con grpcio, impostare a false se necessario
             'partitions_enabled' => filter_var(env('MILVUS_PARTITIONS_ENABLED', true), FILTER_VALIDATE_BOOLEAN),
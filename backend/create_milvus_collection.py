@@ -18,35 +18,137 @@ def connect():
     else:
         connections.connect(alias="default", host=host, port=port, secure=secure)
 
-def ensure_collection(name: str, dim: int, metric: str = "COSINE") -> Collection:
+# Proprietà della collection letta da milvus_search.py per instradare i tenant sulle proprie partizioni
+TENANT_LAYOUT_PROPERTY = "kb.tenant_partitioning"
+
+# Campo vettoriale compatto opzionale per la ricerca a due stadi di milvus_search.py
+COARSE_FIELD = "vector_coarse"
+COARSE_TYPES = {"float32": DataType.FLOAT_VECTOR, "float16": DataType.FLOAT16_VECTOR}
+# Campo sparso opzionale (pesi BM25/SPLADE) per hybrid_search
+SPARSE_FIELD = "sparse_vector"
+
+def build_schema(dim: int, tenant_partitioning: str = "none", description: str = "KB chunks vectors",
+                 enable_dynamic_field: bool = False, coarse_dim: int = 0,
+                 coarse_type: str = "float32", sparse: bool = False) -> CollectionSchema:
+    # partition_key: Milvus distribuisce i tenant su num_partitions partizioni in base a tenant_id
+    # partitions:    una partizione esplicita tenant_<id> per tenant (delete tenant = drop partizione)
+    # coarse_dim:    prime coarse_dim componenti rinormalizzate (Matryoshka), popolate da upsert_vectors
+    # sparse:        vettore sparso dei termini del chunk, per la ricerca ibrida denso + sparso
+    fields = [
+        FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=False),
+        FieldSchema(name="tenant_id", dtype=DataType.INT64,
+                    is_partition_key=(tenant_partitioning == "partition_key")),
+        FieldSchema(name="document_id", dtype=DataType.INT64),
+        FieldSchema(name="chunk_index", dtype=DataType.INT64),
+        FieldSchema(name="vector", dtype=DataType.FLOAT_VECTOR, dim=dim),
+    ]
+    if coarse_dim:
+        if not 0 < coarse_dim < dim:
+            raise ValueError(f"coarse_dim deve essere compreso tra 1 e {dim - 1}")
+        fields.append(FieldSchema(name=COARSE_FIELD, dtype=COARSE_TYPES[coarse_type], dim=coarse_dim))
+    if sparse:
+        fields.append(FieldSchema(name=SPARSE_FIELD, dtype=DataType.SPARSE_FLOAT_VECTOR))
+    return CollectionSchema(fields=fields, description=description, enable_dynamic_field=enable_dynamic_field)
+
+def mark_tenant_partitioning(coll: Collection, tenant_partitioning: str) -> None:
+    # Il partition key è visibile nello schema; le partizioni esplicite vanno dichiarate
+    if tenant_partitioning == "partitions":
+        coll.set_properties({TENANT_LAYOUT_PROPERTY: "partitions"})
+
+# Tipi di indice supportati: HNSW in memoria oppure varianti quantizzate/su disco per ridurre la RAM
+INDEX_TYPES = ("HNSW", "HNSW_SQ", "HNSW_PQ", "IVF_SQ8", "IVF_PQ", "DISKANN")
+
+def default_index_build_params(index_type: str) -> dict:
+    """Parametri di build di default per tipo di indice (sovrascrivibili con --index-param)"""
+    hnsw = {
+        "M": int(os.getenv("MILVUS_HNSW_M", "16")),
+        "efConstruction": int(os.getenv("MILVUS_HNSW_EF_CONSTRUCTION", "200")),
+    }
+    # PQ: m deve dividere dim; con 3072 dimensioni 96 sottovettori da 32 dimensioni (~384 byte per vettore)
+    pq_m = int(os.getenv("MILVUS_PQ_M", "96"))
+    nlist = int(os.getenv("MILVUS_IVF_NLIST", "1024"))
+    return {
+        "HNSW": hnsw,
+        "HNSW_SQ": {**hnsw, "sq_type": os.getenv("MILVUS_SQ_TYPE", "SQ8")},
+        "HNSW_PQ": {**hnsw, "m": pq_m, "nbits": 8},
+        "IVF_SQ8": {"nlist": nlist},
+        "IVF_PQ": {"nlist": nlist, "m": pq_m, "nbits": 8},
+        "DISKANN": {},
+    }[index_type]
+
+def vector_index_params(index_type: str = "HNSW", metric: str = "COSINE", overrides: dict = None) -> dict:
+    """index_params per il campo vector; `overrides` sostituisce i parametri di build di default"""
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"index_type non supportato: {index_type} (validi: {', '.join(INDEX_TYPES)})")
+    return {
+        "index_type": index_type,
+        "metric_type": metric,              # COSINE | L2 | IP
+        "params": {**default_index_build_params(index_type), **(overrides or {})},
+    }
+
+def sparse_index_params() -> dict:
+    """Indice invertito sul campo sparso; il prodotto scalare (IP) dà lo score BM25/SPLADE"""
+    return {"index_type": "SPARSE_INVERTED_INDEX", "metric_type": "IP", "params": {"drop_ratio_build": 0.0}}
+
+def create_optional_indexes(coll: Collection, metric: str = "COSINE") -> None:
+    """Indici dei campi opzionali vector_coarse e sparse_vector, se presenti nello schema"""
+    names = {f.name for f in coll.schema.fields}
+    if COARSE_FIELD in names:
+        # Il campo compatto è piccolo: HNSW in memoria anche quando il vettore completo usa un indice su disco
+        coll.create_index(field_name=COARSE_FIELD, index_params=vector_index_params("HNSW", metric))
+    if SPARSE_FIELD in names:
+        coll.create_index(field_name=SPARSE_FIELD, index_params=sparse_index_params())
+
+def hnsw_index_params(metric: str = "COSINE") -> dict:
+    """Parametri HNSW comuni a create/recreate (M ed efConstruction tarabili con tune_milvus_search.py --build-params)"""
+    return vector_index_params("HNSW", metric)
+
+def parse_index_params(values) -> dict:
+    """['nlist=2048', 'sq_type=SQ6'] -> {'nlist': 2048, 'sq_type': 'SQ6'}"""
+    params = {}
+    for item in values or []:
+        key, _, value = item.partition("=")
+        if not key or not value:
+            raise ValueError(f"--index-param deve essere chiave=valore: {item}")
+        try:
+            params[key] = int(value)
+        except ValueError:
+            try:
+                params[key] = float(value)
+            except ValueError:
+                params[key] = value
+    return params
+
+def ensure_collection(name: str, dim: int, metric: str = "COSINE", tenant_partitioning: str = "none",
+                      num_partitions: int = 64, index_type: str = "HNSW", index_overrides: dict = None,
+                      coarse_dim: int = 0, coarse_type: str = "float32", sparse: bool = False,
+                      enable_dynamic_field: bool = False) -> Collection:
     if utility.has_collection(name):
         coll = Collection(name)
     else:
-        fields = [
-            FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=False),
-            FieldSchema(name="tenant_id", dtype=DataType.INT64),
-            FieldSchema(name="document_id", dtype=DataType.INT64),
-            FieldSchema(name="chunk_index", dtype=DataType.INT64),
-            FieldSchema(name="vector", dtype=DataType.FLOAT_VECTOR, dim=dim),
-        ]
-        schema = CollectionSchema(fields=fields, description="KB chunks vectors")
-        coll = Collection(name=name, schema=schema, shards_num=2)
-
-    index_params = {
-        "index_type": "HNSW",
-        "metric_type": metric,              # COSINE | L2 | IP
-        "params": {"M": 16, "efConstruction": 200},
-    }
+        schema = build_schema(dim, tenant_partitioning, enable_dynamic_field=enable_dynamic_field,
+                              coarse_dim=coarse_dim, coarse_type=coarse_type, sparse=sparse)
+        extra = {"num_partitions": num_partitions} if tenant_partitioning == "partition_key" else {}
+        coll = Collection(name=name, schema=schema, shards_num=2, **extra)
+        mark_tenant_partitioning(coll, tenant_partitioning)
+
+    index_params = vector_index_params(index_type, metric, index_overrides)
     try:
         coll.create_index(field_name="vector", index_params=index_params)
     except Exception:
         pass
-
     try:
-        coll.load()
+        create_optional_indexes(coll, metric)
     except Exception:
         pass
 
+    # Con una partizione per tenant il worker carica solo le partizioni dei tenant attivi
+    if tenant_partitioning != "partitions":
+        try:
+            coll.load()
+        except Exception:
+            pass
+
     return coll
 
 def main():
@@ -55,11 +157,35 @@ def main():
     parser.add_argument("--dim", type=int, default=int(os.getenv("OPENAI_EMBEDDING_DIM", "3072")))
     parser.add_argument("--metric", default=os.getenv("RAG_VECTOR_METRIC", "COSINE").upper(),
                         choices=["COSINE", "L2", "IP"])
+    parser.add_argument("--tenant-partitioning", default="none",
+                        choices=["none", "partition_key", "partitions"])
+    parser.add_argument("--num-partitions", type=int, default=int(os.getenv("MILVUS_NUM_PARTITIONS", "64")))
+    parser.add_argument("--index-type", default=os.getenv("MILVUS_INDEX_TYPE", "HNSW").upper(), choices=INDEX_TYPES)
+    parser.add_argument("--index-param", action="append", default=[],
+                        help="Parametro di build chiave=valore (ripetibile, es. nlist=2048, sq_type=SQ8)")
+    parser.add_argument("--coarse-dim", type=int, default=int(os.getenv("MILVUS_COARSE_DIM", "0")),
+                        help="Aggiunge il campo vector_coarse con le prime N dimensioni (es. 256 o 512; 0 = nessuno)")
+    parser.add_argument("--coarse-type", default=os.getenv("MILVUS_COARSE_TYPE", "float32"), choices=list(COARSE_TYPES))
+    parser.add_argument("--sparse", action="store_true",
+                        default=os.getenv("MILVUS_SPARSE_FIELD", "false").lower() == "true",
+                        help="Aggiunge il campo sparse_vector per hybrid_search (denso + sparso)")
+    parser.add_argument("--dynamic-field", action="store_true",
+                        default=os.getenv("MILVUS_DYNAMIC_FIELD", "false").lower() == "true",
+                        help="Abilita i campi dinamici: testo e metadati dei chunk restituiti dalle ricerche")
     args = parser.parse_args()
 
+    try:
+        overrides = parse_index_params(args.index_param)
+    except ValueError as e:
+        parser.error(str(e))
+
     connect()
-    coll = ensure_collection(args.name, args.dim, args.metric)
-    print(f"Collection pronta: {coll.name} | dim={args.dim} | metric={args.metric}")
+    coll = ensure_collection(args.name, args.dim, args.metric, args.tenant_partitioning, args.num_partitions,
+                             args.index_type, overrides, args.coarse_dim, args.coarse_type, args.sparse,
+                             args.dynamic_field)
+    print(f"Collection pronta: {coll.name} | dim={args.dim} | metric={args.metric} | tenants={args.tenant_partitioning}"
+          f" | index={args.index_type}" + (f" | coarse={args.coarse_dim} {args.coarse_type}" if args.coarse_dim else "")
+          + (" | sparse" if args.sparse else "") + (" | dynamic" if args.dynamic_field else ""))
 
 if __name__ == "__main__":
     main()
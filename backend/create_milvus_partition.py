@@ -36,8 +36,10 @@ def ensure_partition(collection_name: str, partition_name: str):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--collection", default=os.getenv("MILVUS_COLLECTION", "kb_chunks_v1"))
-    parser.add_argument("--partition", default="tenant_2")
+    group = parser.add_mutually_exclusive_group(required=True)
+    group.add_argument("--tenant", type=int, help="ID tenant: crea la partizione tenant_<id>")
+    group.add_argument("--partition", help="Nome esplicito della partizione")
     args = parser.parse_args()
 
     connect()
-    ensure_partition(args.collection, args.partition)
+    ensure_partition(args.collection, args.partition or f"tenant_{args.tenant}")
@@ -6,73 +6,1992 @@ Interfaccia completa Python per Laravel per tutte le operazioni Milvus
 import sys
 import json
 import os
+import base64
+import hashlib
+import re
+import shutil
+import signal
+import tempfile
+import time
+import socket
+import socketserver
+import threading
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+import logging
 import warnings
+try:
+    import fcntl
+except ImportError:  # Windows: il tier locale usa solo lock tra thread
+    fcntl = None
 
 # Sopprimi warning protobuf per output JSON pulito
 warnings.filterwarnings("ignore", category=UserWarning)
+# pymilvus >= 3 segnala come deprecate (FutureWarning) le API ORM usate qui
+warnings.filterwarnings("ignore", category=FutureWarning)
+# I log di pymilvus (es. query iterator) finirebbero nell'output catturato da Laravel
+logging.getLogger("pymilvus").setLevel(logging.CRITICAL)
 
-from pymilvus import connections, Collection, utility
+# pymilvus valida MILVUS_URI già all'import e rifiuta i path locali di Milvus Lite (es. ./milvus.db):
+# lo si toglie dall'ambiente e lo si passa esplicitamente a connections.connect
+MILVUS_URI = os.getenv('MILVUS_URI', '').strip()
+if MILVUS_URI and '://' not in MILVUS_URI:
+    del os.environ['MILVUS_URI']
+
+# Inizio del caricamento del modulo: il tempo fino a qui è avvio dell'interprete, da qui in poi import
+_MODULE_STARTED_AT = time.time()
+_IMPORT_STARTED = time.perf_counter()
+from pymilvus import connections, AnnSearchRequest, Collection, DataType, MilvusClient, RRFRanker, WeightedRanker, utility
+from pymilvus.grpc_gen import common_pb2
 import numpy as np
+_IMPORT_MS = (time.perf_counter() - _IMPORT_STARTED) * 1000
+
+# Handle riusati tra richieste quando lo script gira come worker persistente
+_collections = {}
+_loaded_collections = set()
+_tenant_layouts = {}
+_known_partitions = {}
+_state_lock = threading.RLock()
+
+class InvalidParams(ValueError):
+    """Parametri mancanti o non validi per un'operazione"""
+
+def bool_param(params, key, default):
+    """Legge un parametro booleano senza convertire stringhe come "none" o "false" in True"""
+    value = params.get(key, default)
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, int) and value in (0, 1):
+        return bool(value)
+    if isinstance(value, str) and value.lower() in ('true', 'false', '1', '0'):
+        return value.lower() in ('true', '1')
+    raise InvalidParams(f"{key} must be a boolean")
+
+# ---------------------------------------------------------------------------
+# Tempi per fase di ogni richiesta (timings nella risposta, log lenti, metriche)
+# ---------------------------------------------------------------------------
+
+TIMING_PHASES = ('interpreter', 'import', 'connect', 'load', 'batch_wait', 'rpc', 'serialize')
+TIMINGS_DEFAULT = os.getenv('MILVUS_TIMINGS', 'false').lower() == 'true'
+SLOW_CALL_MS = float(os.getenv('MILVUS_SLOW_MS', '1000'))
+
+_request_timings = threading.local()
+
+class RequestTimings:
+    """
+    Millisecondi spesi da una richiesta in ciascuna fase.
+
+    connect/load/serialize sono misurati dove avvengono (tempo esclusivo:
+    una fase annidata non viene contata due volte); batch_wait è l'attesa
+    di una search accodata dal micro-batching; `rpc` è il resto del
+    tempo della richiesta, cioè chiamate a Milvus ed elaborazione dei
+    risultati. interpreter/import valgono solo per il processo one-shot.
+    """
+
+    def __init__(self, operation, include=False):
+        self.operation = operation
+        self.include = include
+        self.phases = dict.fromkeys(TIMING_PHASES, 0.0)
+        self._started = time.perf_counter()
+        self._stack = []
+
+    def enter(self):
+        self._stack.append([time.perf_counter(), 0.0])
+
+    def exit(self, phase):
+        started, nested = self._stack.pop()
+        elapsed = (time.perf_counter() - started) * 1000
+        self.phases[phase] += elapsed - nested
+        if self._stack:
+            self._stack[-1][1] += elapsed
+
+    def total_ms(self):
+        return (time.perf_counter() - self._started) * 1000
+
+    def as_dict(self):
+        total = self.total_ms()
+        phases = dict(self.phases)
+        measured = phases['connect'] + phases['load'] + phases['batch_wait'] + phases['serialize']
+        phases['rpc'] = max(0.0, total - measured)
+        result = {phase: round(ms, 2) for phase, ms in phases.items()}
+        result['total'] = round(total + phases['interpreter'] + phases['import'], 2)
+        return result
+
+@contextmanager
+def timed_phase(phase):
+    """Attribuisce il tempo del blocco a una fase della richiesta corrente (se misurata)"""
+    timings = getattr(_request_timings, 'current', None)
+    if timings is None:
+        yield
+        return
+    timings.enter()
+    try:
+        yield
+    finally:
+        timings.exit(phase)
+
+def begin_timings(params, one_shot=False):
+    """Inizia la misura di una richiesta nel thread corrente"""
+    timings = RequestTimings(params.get('operation', 'search'), bool(params.get('timings', TIMINGS_DEFAULT)))
+    if one_shot:
+        timings.phases['import'] = _IMPORT_MS
+        # `sent_at` (epoch del client) comprende anche l'avvio del processo da parte di PHP
+        started_at = params.get('sent_at')
+        if started_at is None:
+            started_at = process_started_at()
+        if started_at:
+            timings.phases['interpreter'] = max(0.0, (_MODULE_STARTED_AT - float(started_at)) * 1000)
+    _request_timings.current = timings
+    return timings
+
+def end_timings(timings):
+    """Chiude la misura: log su stderr delle chiamate lente e aggiornamento degli istogrammi"""
+    _request_timings.current = None
+    phases = timings.as_dict()
+    # La soglia riguarda il lavoro della richiesta: avvio dell'interprete e import del
+    # processo one-shot superano da soli il secondo e segnalerebbero ogni chiamata
+    operation_ms = round(phases['total'] - phases['interpreter'] - phases['import'], 2)
+    if SLOW_CALL_MS and operation_ms >= SLOW_CALL_MS:
+        detail = " ".join(f"{phase}={phases[phase]}ms" for phase in TIMING_PHASES if phases[phase])
+        print(f"milvus slow call: operation={timings.operation} operation_ms={operation_ms} "
+              f"total={phases['total']}ms {detail}", file=sys.stderr)
+    if _metrics is not None:
+        _metrics.observe(timings.operation, phases)
+
+def process_started_at():
+    """Istante di avvio del processo (Linux, da /proc), None se non disponibile"""
+    try:
+        with open('/proc/self/stat') as f:
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/stat') as f:
+            boot_time = next(int(line.split()[1]) for line in f if line.startswith('btime'))
+        return boot_time + start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError, StopIteration, AttributeError):
+        return None
+
+class PhaseHistograms:
+    """Istogrammi cumulativi per operazione e fase, esposti in formato OpenMetrics dal worker"""
+
+    BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {}   # (operation, phase) -> [conteggi per bucket, somma, count]
+
+    def observe(self, operation, phases):
+        with self._lock:
+            for phase in TIMING_PHASES + ('total',):
+                seconds = phases.get(phase, 0.0) / 1000
+                if phase in ('interpreter', 'import', 'batch_wait') and not seconds:
+                    continue
+                series = self._series.setdefault((operation, phase), [[0] * len(self.BUCKETS), 0.0, 0])
+                for i, bound in enumerate(self.BUCKETS):
+                    if seconds <= bound:
+                        series[0][i] += 1
+                series[1] += seconds
+                series[2] += 1
+
+    def render(self):
+        name = "milvus_worker_request_phase_seconds"
+        lines = [
+            f"# HELP {name} Time spent by milvus_search.py requests in each phase.",
+            f"# TYPE {name} histogram",
+            f"# UNIT {name} seconds",
+        ]
+        with self._lock:
+            for (operation, phase), (buckets, total, count) in sorted(self._series.items()):
+                labels = f'operation="{operation}",phase="{phase}"'
+                for bound, value in zip(self.BUCKETS, buckets):
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {value}')
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {count}')
+                lines.append(f'{name}_count{{{labels}}} {count}')
+                lines.append(f'{name}_sum{{{labels}}} {total:.6f}')
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+OPENMETRICS_CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+# Istogrammi attivi solo nel worker persistente (vedi serve)
+_metrics = None
 
 def connect_milvus():
-    """Connessione standard a Milvus usando variabili d'ambiente"""
-    host = os.getenv('MILVUS_HOST', '127.0.0.1')
-    port = int(os.getenv('MILVUS_PORT', '19530'))
-    
-    connections.connect(
-        alias="default",
-        host=host,
-        port=port
-    )
+    """Connessione standard a Milvus usando variabili d'ambiente (riusata se già attiva)"""
+    with _state_lock:
+        if connections.has_connection("default"):
+            return
 
-def search_vectors(collection_name, query_vector, tenant_id, limit=10):
-    """Esegue una ricerca vettoriale su Milvus"""
+        with timed_phase('connect'):
+            # MILVUS_URI: endpoint completo (es. Zilliz/TLS) oppure file locale di Milvus Lite
+            if MILVUS_URI:
+                connections.connect(
+                    alias="default",
+                    uri=MILVUS_URI,
+                    token=os.getenv('MILVUS_TOKEN', '').strip(),
+                    secure=os.getenv('MILVUS_TLS', 'false').lower() == 'true'
+                )
+                return
+
+            host = os.getenv('MILVUS_HOST', '127.0.0.1')
+            port = int(os.getenv('MILVUS_PORT', '19530'))
+
+            connections.connect(
+                alias="default",
+                host=host,
+                port=port
+            )
+
+def reset_connection():
+    """Chiude la connessione e invalida gli handle in cache (usato per la riconnessione)"""
+    with _state_lock:
+        _collections.clear()
+        _loaded_collections.clear()
+        _tenant_layouts.clear()
+        _known_partitions.clear()
+        _search_ef.clear()
+        _vector_indexes.clear()
+        _vector_fields.clear()
+        _dual_write_targets.clear()
+        _resolved_names.clear()
+        try:
+            connections.disconnect("default")
+        except Exception:
+            pass
+
+def is_loaded(collection_name, partition_names=None):
+    """Chiede a Milvus se la collection (o le partizioni indicate) è già caricata in memoria"""
     try:
+        state = utility.load_state(collection_name, partition_names=partition_names)
+    except Exception:
+        return False
+    return getattr(state, 'name', str(state)) == 'Loaded'
+
+# Un alias (es. kb_chunks -> kb_chunks_hnsw_20250101) viene risolto e ricontrollato ogni MILVUS_ALIAS_REFRESH
+# secondi: dopo lo switch fatto da rebuild_milvus_index.py i worker passano alla nuova collection
+ALIAS_REFRESH_SECONDS = float(os.getenv('MILVUS_ALIAS_REFRESH', '30'))
+_resolved_names = {}
+
+def resolve_collection_name(collection_name):
+    """Nome reale della collection puntata da un alias (il nome stesso se non è un alias)"""
+    with _state_lock:
+        cached = _resolved_names.get(collection_name)
+        if cached is not None and time.monotonic() - cached[0] < ALIAS_REFRESH_SECONDS:
+            return cached[1]
+
         connect_milvus()
-        
-        # Carica la collection
-        collection = Collection(collection_name)
-        collection.load()
-        
-        # Parametri di ricerca - ef deve essere >= limit per HNSW
-        ef_value = max(96, limit + 10)  # Ensure ef >= limit with some buffer
-        search_params = {
-            "metric_type": "COSINE",
-            "params": {"ef": ef_value}
+        with timed_phase('load'):
+            real_name = Collection(collection_name).describe().get('collection_name') or collection_name
+        _resolved_names[collection_name] = (time.monotonic(), real_name)
+        return real_name
+
+def get_collection(collection_name, load=False):
+    """Ritorna l'handle della collection, caricandola una sola volta per processo"""
+    with _state_lock:
+        connect_milvus()
+        # Handle, stato di load e cache sono legati al nome reale, non all'alias
+        collection_name = resolve_collection_name(collection_name)
+
+        collection = _collections.get(collection_name)
+        if collection is None:
+            with timed_phase('load'):
+                collection = Collection(collection_name)
+            _collections[collection_name] = collection
+
+        if load and collection_name not in _loaded_collections:
+            with timed_phase('load'):
+                # Un altro processo (o un worker precedente) può averla già caricata
+                if not is_loaded(collection_name):
+                    collection.load()
+            _loaded_collections.add(collection_name)
+
+        return collection
+
+def invalidate_collection(collection_name):
+    """Dimentica handle e stato di load di una collection (es. dopo un errore)"""
+    with _state_lock:
+        # Un alias potrebbe essere stato spostato: alla prossima richiesta viene risolto di nuovo
+        resolved = _resolved_names.pop(collection_name, None)
+        if resolved is not None and resolved[1] != collection_name:
+            invalidate_collection(resolved[1])
+        _collections.pop(collection_name, None)
+        _loaded_collections.discard(collection_name)
+        _tenant_layouts.pop(collection_name, None)
+        _known_partitions.pop(collection_name, None)
+        _search_ef.pop(collection_name, None)
+        _vector_indexes.pop(collection_name, None)
+        _vector_fields.pop(collection_name, None)
+        _dual_write_targets.pop(collection_name, None)
+        _partition_loader.forget(collection_name)
+
+# ---------------------------------------------------------------------------
+# Caricamento parziale: solo le partizioni dei tenant attivi, con budget di memoria
+# ---------------------------------------------------------------------------
+
+# Stima dei byte per riga in memoria: vettore float32 + grafo HNSW (M=16) + campi scalari
+HNSW_GRAPH_BYTES_PER_ROW = 2 * 16 * 4
+SCALAR_BYTES_PER_ROW = 32
+
+class PartitionLoadManager:
+    """
+    Tiene caricate solo le partizioni dei tenant usati di recente.
+
+    Ogni partizione caricata ha un costo stimato (righe × byte per riga);
+    quando la somma supera il budget vengono rilasciate le partizioni usate
+    meno di recente (LRU). Con `idle_seconds` si rilasciano anche quelle
+    inutilizzate da troppo tempo. Budget 0 = nessun limite.
+
+    Se il server non supporta load/release per partizione (es. Milvus Lite)
+    la collection viene caricata per intero e il caricamento parziale
+    resta disattivato per quella collection.
+    """
+
+    def __init__(self, budget_bytes=0, idle_seconds=0):
+        self.budget_bytes = budget_bytes
+        self.idle_seconds = idle_seconds
+        self._entries = OrderedDict()   # (collection, partition) -> [bytes stimati, ultimo uso]
+        self._unsupported = set()
+        self._lock = threading.RLock()
+        self.loads = 0
+        self.releases = 0
+        self.hits = 0
+
+    def used_bytes(self):
+        return sum(entry[0] for entry in self._entries.values())
+
+    def estimate_bytes(self, collection, partition_name):
+        """Costo in memoria di una partizione stimato da numero di righe e dimensione del vettore"""
+        dim = next((f.params.get('dim', 0) for f in collection.schema.fields if f.name == 'vector'), 0)
+        try:
+            rows = collection.partition(partition_name).num_entities
+        except Exception:
+            rows = 0
+        return rows * (int(dim) * 4 + HNSW_GRAPH_BYTES_PER_ROW + SCALAR_BYTES_PER_ROW)
+
+    def ensure_loaded(self, collection, partition_name):
+        """Carica la partizione se serve, aggiorna l'LRU e applica il budget"""
+        key = (collection.name, partition_name)
+        with self._lock, timed_phase('load'):
+            if collection.name in self._unsupported:
+                get_collection(collection.name, load=True)
+                return
+
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry[1] = time.monotonic()
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return
+
+            size = self.estimate_bytes(collection, partition_name)
+            self._evict(reserve=size, keep=key)
+            try:
+                if not is_loaded(collection.name, [partition_name]):
+                    collection.load(partition_names=[partition_name])
+                    self.loads += 1
+            except Exception as e:
+                message = str(e).lower()
+                if 'unimplemented' not in message and 'not support' not in message:
+                    raise
+                # Load per partizione non supportato: si ripiega sul load dell'intera collection
+                self._unsupported.add(collection.name)
+                self.forget(collection.name)
+                get_collection(collection.name, load=True)
+                return
+
+            self._entries[key] = [size, time.monotonic()]
+
+    def _evict(self, reserve=0, keep=None):
+        """Rilascia le partizioni LRU finché quelle caricate più `reserve` stanno nel budget"""
+        now = time.monotonic()
+        for key in list(self._entries):
+            if key == keep:
+                continue
+            size, last_used = self._entries[key]
+            over_budget = self.budget_bytes and self.used_bytes() + reserve > self.budget_bytes
+            idle = self.idle_seconds and now - last_used > self.idle_seconds
+            if not over_budget and not idle:
+                continue
+            self.release(*key)
+
+    def release(self, collection_name, partition_name):
+        """Rilascia una partizione dalla memoria dei query node"""
+        with self._lock:
+            self._entries.pop((collection_name, partition_name), None)
+            try:
+                get_collection(collection_name).partition(partition_name).release()
+                self.releases += 1
+            except Exception as e:
+                print(f"release {collection_name}/{partition_name} fallito: {e}", file=sys.stderr)
+
+    def release_idle(self):
+        """Applica budget e timeout di inattività senza caricare nulla (chiamato periodicamente dal worker)"""
+        with self._lock:
+            self._evict()
+
+    def forget(self, collection_name, partition_name=None):
+        """Dimentica lo stato di load tracciato (dopo un errore o il drop della partizione)"""
+        with self._lock:
+            for key in list(self._entries):
+                if key[0] == collection_name and partition_name in (None, key[1]):
+                    del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "budget_mb": round(self.budget_bytes / (1024 * 1024), 1),
+                "used_mb": round(self.used_bytes() / (1024 * 1024), 1),
+                "loaded_partitions": [f"{c}/{p}" for c, p in self._entries],
+                "partial_load_unsupported": sorted(self._unsupported),
+                "loads": self.loads,
+                "releases": self.releases,
+                "hits": self.hits,
+            }
+
+_partition_loader = PartitionLoadManager(
+    budget_bytes=int(float(os.getenv('MILVUS_LOAD_BUDGET_MB', '0')) * 1024 * 1024),
+    idle_seconds=float(os.getenv('MILVUS_PARTITION_IDLE_SECONDS', '0'))
+)
+
+# ---------------------------------------------------------------------------
+# Multi-tenancy: partition key oppure una partizione per tenant
+# ---------------------------------------------------------------------------
+
+# Proprietà impostata da create_milvus_collection.py sulle collection con una partizione per tenant
+TENANT_LAYOUT_PROPERTY = "kb.tenant_partitioning"
+
+def tenant_partition_name(tenant_id):
+    """Nome della partizione di un tenant (stesso schema di CreateMilvusPartitionJob)"""
+    return f"tenant_{tenant_id}"
+
+def tenant_layout(collection):
+    """
+    Layout multi-tenant della collection:
+    - partition_key: tenant_id è partition key, Milvus instrada da solo letture e scritture
+    - partitions: una partizione `tenant_<id>` per tenant (proprietà kb.tenant_partitioning)
+    - none: un'unica partizione filtrata con l'espressione tenant_id
+    MILVUS_TENANT_PARTITIONING forza il layout invece di rilevarlo dallo schema.
+    """
+    with _state_lock:
+        layout = _tenant_layouts.get(collection.name)
+        if layout is None:
+            layout = os.getenv('MILVUS_TENANT_PARTITIONING', 'auto')
+            if layout == 'auto':
+                if any(getattr(f, 'is_partition_key', False) for f in collection.schema.fields):
+                    layout = 'partition_key'
+                elif collection.describe().get('properties', {}).get(TENANT_LAYOUT_PROPERTY) == 'partitions':
+                    layout = 'partitions'
+                else:
+                    layout = 'none'
+            _tenant_layouts[collection.name] = layout
+        return layout
+
+def tenant_partitions(collection, tenant_id, create=False):
+    """
+    Partizioni da passare a search/query/insert per un tenant.
+
+    None = nessun instradamento (tutta la collection); [] = il tenant non ha
+    ancora una partizione, quindi non ha dati.
+    """
+    if tenant_layout(collection) != 'partitions':
+        return None
+
+    name = tenant_partition_name(tenant_id)
+    with _state_lock:
+        known = _known_partitions.setdefault(collection.name, set())
+        if name in known:
+            return [name]
+        if not collection.has_partition(name):
+            if not create:
+                return []
+            collection.create_partition(name)
+        known.add(name)
+        return [name]
+
+def forget_partition(collection_name, partition_name):
+    """Rimuove una partizione dalla cache (dopo un drop)"""
+    with _state_lock:
+        _known_partitions.get(collection_name, set()).discard(partition_name)
+        _partition_loader.forget(collection_name, partition_name)
+
+# ef scelto da tune_milvus_search.py, salvato come proprietà della collection (per tenant o default)
+# insieme al tipo di indice su cui è stato tarato: "<ef>@<index_type>" (i valori senza tipo sono HNSW)
+SEARCH_EF_PROPERTY = "kb.search_ef"
+SEARCH_EF_REFRESH_SECONDS = float(os.getenv('MILVUS_SEARCH_EF_REFRESH', '300'))
+_search_ef = {}
+
+def format_tuned_ef(ef, index_type):
+    """Valore della proprietà kb.search_ef.<tenant>"""
+    return f"{int(ef)}@{index_type}"
+
+def parse_tuned_ef(value):
+    """(ef, tipo di indice) da un valore di kb.search_ef"""
+    ef, _, index_type = str(value).partition("@")
+    return int(ef), index_type or "HNSW"
+
+def tuned_ef(collection, tenant_id):
+    """
+    ef tarato per il tenant (o il default della collection); None se mai tarato.
+
+    Un valore tarato su un altro tipo di indice (es. prima di un rebuild, che copia
+    le proprietà kb.*) viene ignorato.
+    """
+    index_type = vector_index_type(collection)
+    with _state_lock:
+        cached = _search_ef.get(collection.name)
+        if cached is None or time.monotonic() - cached[0] > SEARCH_EF_REFRESH_SECONDS:
+            properties = collection.describe().get('properties', {})
+            values = {}
+            for key, value in properties.items():
+                if key == SEARCH_EF_PROPERTY:
+                    values[None] = parse_tuned_ef(value)
+                elif key.startswith(SEARCH_EF_PROPERTY + "."):
+                    values[int(key.rsplit(".", 1)[1])] = parse_tuned_ef(value)
+            cached = (time.monotonic(), values)
+            _search_ef[collection.name] = cached
+        for key in (tenant_id, None):
+            tuned = cached[1].get(key)
+            if tuned is not None and tuned[1] == index_type:
+                return tuned[0]
+        return None
+
+def search_ef(collection, tenant_id, limit):
+    """ef per una ricerca HNSW: il valore tarato se presente, sempre >= limit"""
+    ef = tuned_ef(collection, tenant_id)
+    if ef is None:
+        return max(96, limit + 10)  # Ensure ef >= limit with some buffer
+    return max(ef, limit)
+
+# Parametri di ricerca per gli indici non HNSW (vedi create_milvus_collection.py --index-type)
+SEARCH_NPROBE = int(os.getenv('MILVUS_SEARCH_NPROBE', '32'))
+SEARCH_LIST = int(os.getenv('MILVUS_SEARCH_LIST', '100'))
+_vector_indexes = {}
+
+def vector_index_type(collection, field='vector'):
+    """Tipo di indice di un campo vettoriale (HNSW, IVF_SQ8, DISKANN, ...), letto una volta per collection"""
+    with _state_lock:
+        indexes = _vector_indexes.setdefault(collection.name, {})
+        index_type = indexes.get(field)
+        if index_type is None:
+            index_type = next((index.params.get('index_type', 'HNSW') for index in collection.indexes
+                               if index.field_name == field), 'HNSW')
+            indexes[field] = index_type
+        return index_type
+
+def search_params(collection, tenant_id, limit, field='vector'):
+    """Parametri di search adatti all'indice del campo (vector o vector_coarse)"""
+    index_type = vector_index_type(collection, field)
+    if index_type.startswith('IVF'):
+        params = {"nprobe": SEARCH_NPROBE}
+    elif index_type == 'DISKANN':
+        params = {"search_list": max(SEARCH_LIST, limit)}
+    else:
+        # HNSW e varianti quantizzate (HNSW_SQ, HNSW_PQ)
+        params = {"ef": search_ef(collection, tenant_id, limit)}
+    return {"metric_type": "COSINE", "params": params}
+
+def get_tenant_collection(collection_name, tenant_id, create=False):
+    """
+    Handle e partizioni di un tenant, pronti per search/query.
+
+    Con una partizione per tenant viene caricata solo quella del tenant
+    (LRU con budget di memoria); altrimenti si carica l'intera collection.
+    Un tenant senza partizione non richiede alcun load.
+    """
+    collection = get_collection(collection_name)
+    partitions = tenant_partitions(collection, tenant_id, create=create)
+    if partitions is None:
+        get_collection(collection_name, load=True)
+    elif partitions:
+        _partition_loader.ensure_loaded(collection, partitions[0])
+    return collection, partitions
+
+# ---------------------------------------------------------------------------
+# Ricerca a due stadi: ANN sul campo compatto, rescoring esatto sui vettori completi
+# ---------------------------------------------------------------------------
+
+# Campo opzionale creato da create_milvus_collection.py --coarse-dim
+COARSE_FIELD = "vector_coarse"
+TWO_STAGE_DEFAULT = os.getenv('MILVUS_TWO_STAGE', 'false').lower() == 'true'
+TWO_STAGE_OVERSAMPLE = int(os.getenv('MILVUS_TWO_STAGE_OVERSAMPLE', '4'))
+_vector_fields = {}
+
+def vector_fields(collection):
+    """Campi vettoriali dello schema {nome: (DataType, params)}, letti una volta per collection"""
+    with _state_lock:
+        fields = _vector_fields.get(collection.name)
+        if fields is None:
+            fields = {f.name: (f.dtype, dict(f.params or {})) for f in collection.schema.fields
+                      if f.dtype in (DataType.FLOAT_VECTOR, DataType.FLOAT16_VECTOR, DataType.SPARSE_FLOAT_VECTOR)}
+            _vector_fields[collection.name] = fields
+        return fields
+
+def coarse_field(collection):
+    """(dim, dtype numpy) del campo compatto, (0, None) se la collection non lo ha"""
+    field = vector_fields(collection).get(COARSE_FIELD)
+    if field is None:
+        return 0, None
+    return int(field[1]['dim']), np.float16 if field[0] == DataType.FLOAT16_VECTOR else np.float32
+
+def coarse_vectors(vectors, dim, dtype=np.float32):
+    """
+    Proiezione compatta: prime `dim` componenti rinormalizzate.
+
+    Gli embedding OpenAI text-embedding-3 sono addestrati Matryoshka: il
+    prefisso rinormalizzato conserva gran parte della qualità del vettore
+    completo. Ritorna una riga per vettore nel dtype del campo.
+    """
+    matrix = np.asarray(vectors, dtype=np.float32).reshape(len(vectors), -1)[:, :dim]
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return list((matrix / norms).astype(dtype))
+
+def rescore_exact(collection, partitions, query_vector, candidate_ids, limit, output_fields=None):
+    """Legge i vettori completi dei candidati e li riordina per coseno esatto"""
+    if not candidate_ids:
+        return []
+    rows = collection.query(expr=f"id in {candidate_ids}", output_fields=["id", "vector"] + list(output_fields or []),
+                            partition_names=partitions)
+    if not rows:
+        return []
+
+    ids = np.array([int(r["id"]) for r in rows], dtype=np.int64)
+    matrix = np.asarray([r["vector"] for r in rows], dtype=np.float32)
+    query = np.asarray(query_vector, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query) or 1.0)
+    norms[norms == 0] = 1.0
+    similarities = (matrix @ query) / norms
+
+    order = np.argsort(-similarities, kind='stable')[:limit]
+    # Stessa convenzione di format_hits: distance = similarità coseno restituita da Milvus
+    hits = [{"id": int(ids[i]), "distance": float(similarities[i]), "score": 1.0 - float(similarities[i])}
+            for i in order]
+    if output_fields:
+        for hit, i in zip(hits, order):
+            hit["fields"] = {f: rows[i][f] for f in output_fields if f in rows[i]}
+    return hits
+
+def two_stage_search(collection, partitions, query_vector, tenant_id, limit, oversample=TWO_STAGE_OVERSAMPLE,
+                     expr=None, min_score=None, group_size=None, output_fields=None):
+    """
+    ANN sul campo compatto per limit × oversample candidati, poi rescoring esatto con NumPy.
+
+    Soglia e raggruppamento per documento sono applicati dopo il rescoring,
+    sulle similarità esatte.
+    """
+    dim, dtype = coarse_field(collection)
+    candidates = limit * max(1, oversample) * (group_size or 1)
+    results = collection.search(
+        data=coarse_vectors([query_vector], dim, dtype),
+        anns_field=COARSE_FIELD,
+        param=search_params(collection, tenant_id, candidates, field=COARSE_FIELD),
+        limit=candidates,
+        expr=expr or f"tenant_id == {tenant_id}",
+        partition_names=partitions
+    )
+    candidate_ids = [int(hit.id) for hit in results[0]]
+    hits = rescore_exact(collection, partitions, query_vector, candidate_ids, len(candidate_ids), output_fields)
+    if min_score is not None:
+        hits = [h for h in hits if h["distance"] > min_score]
+    hits = group_hits(hits, limit, group_size) if group_size else hits[:limit]
+    return hits, len(candidate_ids)
+
+# ---------------------------------------------------------------------------
+# Vettori sparsi (BM25/SPLADE) e ricerca ibrida con fusione lato server
+# ---------------------------------------------------------------------------
+
+# Campo opzionale creato da create_milvus_collection.py --sparse
+SPARSE_FIELD = "sparse_vector"
+HYBRID_RANKERS = ('rrf', 'weighted')
+# Pesi BM25 calcolati dal testo quando il client non invia pesi propri
+SPARSE_K1 = float(os.getenv('MILVUS_SPARSE_K1', '1.2'))
+SPARSE_B = float(os.getenv('MILVUS_SPARSE_B', '0.75'))
+SPARSE_AVG_TOKENS = float(os.getenv('MILVUS_SPARSE_AVG_TOKENS', '150'))
+SPARSE_DROP_RATIO = float(os.getenv('MILVUS_SPARSE_DROP_RATIO', '0.0'))
+HYBRID_CANDIDATES = int(os.getenv('MILVUS_HYBRID_CANDIDATES', '100'))
+# Milvus rifiuta i vettori sparsi vuoti: il termine 0 non è mai prodotto da sparse_term_id
+SPARSE_EMPTY = {0: 1e-6}
+_TOKEN_PATTERN = re.compile(r"\w{2,}", re.UNICODE)
+
+def has_sparse_field(collection):
+    return SPARSE_FIELD in vector_fields(collection)
+
+def sparse_term_id(term):
+    """Id stabile di un termine (hash a 31 bit, mai 0)"""
+    value = int.from_bytes(hashlib.blake2b(term.encode('utf-8'), digest_size=4).digest(), 'little') & 0x7fffffff
+    return value or 1
+
+def sparse_from_text(text, query=False):
+    """
+    Vettore sparso di un testo con termini hashati.
+
+    Documenti: saturazione BM25 della frequenza (k1, b, lunghezza media
+    MILVUS_SPARSE_AVG_TOKENS); query: peso 1 per termine. Il prodotto
+    scalare (metrica IP) dà quindi lo score BM25 senza IDF; pesi migliori
+    (IDF, SPLADE) vanno calcolati dal client e inviati in `sparse_vectors`.
+    """
+    tokens = _TOKEN_PATTERN.findall((text or '').lower())
+    counts = Counter(sparse_term_id(token) for token in tokens)
+    if not counts:
+        return dict(SPARSE_EMPTY)
+    if query:
+        return {term: 1.0 for term in counts}
+    norm = SPARSE_K1 * (1 - SPARSE_B + SPARSE_B * len(tokens) / SPARSE_AVG_TOKENS)
+    return {term: tf * (SPARSE_K1 + 1) / (tf + norm) for term, tf in counts.items()}
+
+def decode_sparse(values):
+    """Pesi sparsi dal JSON, uno per vettore: {"<term id>": peso} oppure {"indices": [...], "values": [...]}"""
+    rows = []
+    try:
+        for value in values:
+            if isinstance(value, dict) and 'indices' in value:
+                value = dict(zip(value['indices'], value.get('values', [])))
+            row = {int(term): float(weight) for term, weight in (value or {}).items() if float(weight) != 0.0}
+            rows.append(row or dict(SPARSE_EMPTY))
+    except (TypeError, ValueError, AttributeError) as e:
+        raise InvalidParams(f"invalid sparse vector: {e}")
+    return rows
+
+def sparse_rows(collection, count, sparse_vectors=None, chunks=None):
+    """Valori del campo sparso per `count` righe (None se la collection non lo ha): pesi espliciti o dal testo"""
+    if not has_sparse_field(collection):
+        return None
+    if sparse_vectors is not None:
+        if len(sparse_vectors) != count:
+            raise InvalidParams("sparse_vectors must contain one entry per vector")
+        return sparse_vectors
+    if chunks and len(chunks) == count:
+        return [sparse_from_text(chunk) for chunk in chunks]
+    return [dict(SPARSE_EMPTY) for _ in range(count)]
+
+def optional_columns(collection, vectors, sparse):
+    """Colonne dei campi opzionali (vector_coarse, sparse_vector) nell'ordine dello schema"""
+    columns = {}
+    coarse_dim, coarse_dtype = coarse_field(collection)
+    if coarse_dim:
+        columns[COARSE_FIELD] = coarse_vectors(vectors, coarse_dim, coarse_dtype)
+    if sparse is not None:
+        columns[SPARSE_FIELD] = sparse
+    return [columns[name] for name in vector_fields(collection) if name in columns]
+
+# ---------------------------------------------------------------------------
+# Payload dei chunk (testo e metadati) nei campi dinamici
+# ---------------------------------------------------------------------------
+
+# Salvati solo se la collection ha enable_dynamic_field (create --dynamic-field, recreate)
+CHUNK_TEXT_FIELD = "text"
+PAYLOAD_METADATA_FIELDS = ("title", "source_url", "knowledge_base_id")
+PAYLOAD_FIELDS = (CHUNK_TEXT_FIELD,) + PAYLOAD_METADATA_FIELDS
+# Campi richiedibili con output_fields nelle ricerche
+SEARCH_OUTPUT_FIELDS = ("tenant_id", "document_id", "chunk_index") + PAYLOAD_FIELDS
+# Il JSON dei campi dinamici ha un limite per riga: il testo oltre questa soglia viene troncato
+PAYLOAD_TEXT_MAX_CHARS = int(os.getenv('MILVUS_PAYLOAD_TEXT_MAX_CHARS', '16000'))
+
+def has_dynamic_fields(collection):
+    return bool(getattr(collection.schema, 'enable_dynamic_field', False))
+
+def chunk_payloads(collection, count, chunks=None, metadata=None):
+    """
+    Campi dinamici di ogni riga: testo del chunk e metadati del documento.
+
+    None se non c'è nulla da salvare o la collection non ha campi dinamici.
+    """
+    if not has_dynamic_fields(collection) or not (chunks or metadata):
+        return None
+    metadata = {k: metadata[k] for k in PAYLOAD_METADATA_FIELDS if (metadata or {}).get(k) is not None}
+    payloads = [dict(metadata) for _ in range(count)]
+    for payload, text in zip(payloads, chunks or []):
+        if text is not None:
+            payload[CHUNK_TEXT_FIELD] = str(text)[:PAYLOAD_TEXT_MAX_CHARS]
+    return payloads
+
+def insert_columns(collection, data, payloads=None, partition_name=None):
+    """Insert a colonne; con il payload le righe diventano dict per includere i campi dinamici"""
+    if payloads is None:
+        return collection.insert(data, partition_name=partition_name)
+    names = [f.name for f in collection.schema.fields]
+    rows = [{**dict(zip(names, values)), **payload} for values, payload in zip(zip(*data), payloads)]
+    return collection.insert(rows, partition_name=partition_name)
+
+def search_output_fields(collection, output_fields):
+    """Campi richiesti disponibili nella collection (il payload solo con i campi dinamici)"""
+    if not output_fields:
+        return []
+    dynamic = has_dynamic_fields(collection)
+    return [f for f in dict.fromkeys(output_fields) if dynamic or f not in PAYLOAD_FIELDS]
+
+RESULT_FORMATS = ('json', 'columnar', 'binary')
+
+def decode_vectors(params, key, dim=None, single=False):
+    """
+    Legge i vettori di `key` come matrice float32 (una riga per vettore).
+
+    Formati accettati, in ordine di precedenza:
+    - `<key>_b64`: base64 di float32 little-endian (decodifica zero-copy con np.frombuffer)
+    - `<key>_file`: file sidecar `.npy` o `.f32` raw, letto in memory-map
+    - `<key>`: lista JSON (formato legacy)
+    Un buffer piatto viene diviso in righe da `dim`, obbligatorio salvo per le chiavi
+    a vettore singolo (`single`, es. query_vector): senza, N vettori diventerebbero
+    in silenzio un solo vettore di N×dim componenti.
+    """
+    try:
+        if params.get(f"{key}_b64"):
+            raw = base64.b64decode(params[f"{key}_b64"])
+            if len(raw) % 4:
+                raise InvalidParams(f"{key}_b64 is not a float32 buffer")
+            matrix = np.frombuffer(raw, dtype='<f4')
+        elif params.get(f"{key}_file"):
+            path = params[f"{key}_file"]
+            if path.endswith('.npy'):
+                matrix = np.load(path, mmap_mode='r')
+            else:
+                matrix = np.memmap(path, dtype='<f4', mode='r')
+        else:
+            value = params.get(key)
+            if value is None or len(value) == 0:
+                return None
+            matrix = np.asarray(value, dtype=np.float32)
+    except (ValueError, TypeError, OSError) as e:
+        raise InvalidParams(f"invalid {key}: {e}")
+
+    if matrix.dtype != np.float32:
+        matrix = matrix.astype(np.float32)
+
+    if matrix.ndim == 1:
+        if dim:
+            if matrix.size % dim:
+                raise InvalidParams(f"{key} size {matrix.size} is not a multiple of dim {dim}")
+            matrix = matrix.reshape(-1, dim)
+        elif single:
+            matrix = matrix.reshape(1, -1)
+        else:
+            raise InvalidParams(f"dim is required to split {key} into rows")
+
+    if matrix.ndim != 2 or matrix.shape[0] == 0:
+        raise InvalidParams(f"{key} must be a non-empty list of vectors")
+
+    return matrix
+
+def encode_hits(hits, result_format='json'):
+    """Serializza gli hit nel formato richiesto dal client"""
+    # Il payload non ha un formato compatto: resta una lista JSON parallela agli id
+    fields = {"fields": [h.get("fields", {}) for h in hits]} if any("fields" in h for h in hits) else {}
+    if result_format == 'columnar':
+        return {
+            "ids": [h["id"] for h in hits],
+            "distances": [h["distance"] for h in hits],
+            **fields,
+        }
+    if result_format == 'binary':
+        # score = 1 - distance: il client lo ricava senza trasferirlo
+        return {
+            "count": len(hits),
+            "ids_b64": base64.b64encode(np.array([h["id"] for h in hits], dtype='<i8').tobytes()).decode('ascii'),
+            "distances_b64": base64.b64encode(np.array([h["distance"] for h in hits], dtype='<f4').tobytes()).decode('ascii'),
+            **fields,
         }
+    return hits
+
+def format_hits(raw_hits, output_fields=None):
+    """Formatta gli hit di Milvus per Laravel (con `fields` se sono stati richiesti output_fields)"""
+    hits = []
+    for hit in raw_hits:
+        formatted = {
+            "id": int(hit.id),
+            "distance": float(hit.distance),
+            "score": 1.0 - float(hit.distance)  # Converti distance in score
+        }
+        if output_fields:
+            formatted["fields"] = {f: hit.fields.get(f) for f in output_fields if f in hit.fields}
+        hits.append(formatted)
+    return hits
+
+# Campi ammessi per group_by (chiave primaria = document_id * 100000 + chunk_index)
+GROUP_BY_FIELDS = ('document_id',)
+
+def attach_fields(collection, partitions, hits, output_fields):
+    """Aggiunge agli hit (`fields`) i campi richiesti, letti per chiave primaria"""
+    rows = collection.query(expr=f"id in {[h['id'] for h in hits]}", output_fields=["id"] + list(output_fields),
+                            partition_names=partitions)
+    by_id = {int(r["id"]): r for r in rows}
+    for hit in hits:
+        row = by_id.get(hit["id"], {})
+        hit["fields"] = {f: row[f] for f in output_fields if f in row}
+    return hits
+
+def decode_metadata(params):
+    """Metadati del documento (title, source_url, knowledge_base_id) salvati con i chunk"""
+    metadata = params.get('metadata')
+    if metadata is not None and not isinstance(metadata, dict):
+        raise InvalidParams("metadata must be an object")
+    return metadata or None
+
+def search_expr(tenant_id, document_ids=None, exclude_document_ids=None):
+    """Filtro tenant con lista opzionale di documenti ammessi (allow) ed esclusi (deny)"""
+    expr = f"tenant_id == {tenant_id}"
+    if document_ids is not None:
+        expr += f" && document_id in {sorted({int(d) for d in document_ids})}"
+    if exclude_document_ids:
+        expr += f" && document_id not in {sorted({int(d) for d in exclude_document_ids})}"
+    return expr
+
+def range_params(params, min_score):
+    """
+    Range search: solo hit con similarità > min_score.
+
+    Con COSINE/IP Milvus usa `radius` come limite inferiore della similarità
+    (il campo `distance` degli hit); con L2 la soglia non ha lo stesso senso.
+    """
+    if min_score is None:
+        return params
+    if params.get("metric_type", "COSINE") not in ("COSINE", "IP"):
+        raise ValueError(f"min_score requires a COSINE or IP index, not {params.get('metric_type')}")
+    return {**params, "params": {**params.get("params", {}), "radius": float(min_score)}}
+
+def group_hits(hits, limit, group_size):
+    """Al più `group_size` hit per documento e `limit` documenti, nell'ordine di rilevanza"""
+    grouped = []
+    per_document = Counter()
+    for hit in hits:
+        document_id = hit["id"] // 100000
+        if per_document[document_id] >= group_size:
+            continue
+        if document_id not in per_document and len(per_document) >= limit:
+            continue
+        per_document[document_id] += 1
+        grouped.append(hit)
+    return grouped
+
+def rrf_fuse(hit_lists, k=60, limit=None):
+    """Reciprocal Rank Fusion degli hit di più query (stesso schema di KbSearchService)"""
+    fused = {}
+    for hits in hit_lists:
+        for rank, hit in enumerate(hits, start=1):
+            entry = fused.setdefault(hit["id"], {"id": hit["id"], "rrf_score": 0.0, "best_distance": hit["distance"]})
+            entry["rrf_score"] += 1.0 / (k + rank)
+            entry["best_distance"] = max(entry["best_distance"], hit["distance"])
+
+    ordered = sorted(fused.values(), key=lambda e: e["rrf_score"], reverse=True)
+    return ordered[:limit] if limit else ordered
+
+# ---------------------------------------------------------------------------
+# Cache dei risultati di ricerca (per tenant, invalidata dalle scritture)
+# ---------------------------------------------------------------------------
+
+class SearchResultCache:
+    """
+    Cache LRU con TTL dei risultati di search_vectors.
+
+    La chiave comprende collection, tenant, hash del vettore quantizzato
+    (domande quasi identiche producono lo stesso hash), limit e parametri
+    di ricerca. Ogni scrittura su un tenant incrementa la sua generazione:
+    le voci vecchie non vengono più trovate e sono rimosse subito.
+    Le scritture fatte da altri processi non sono visibili: il TTL limita
+    quanto a lungo un risultato può restare obsoleto.
+    """
+
+    def __init__(self, max_entries=1024, ttl=300.0, quantum=1e-3):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.quantum = quantum
+        self._entries = OrderedDict()   # chiave -> (scadenza, hits)
+        self._generations = {}          # (collection, tenant) -> generazione
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def key(self, collection_name, tenant_id, vector, limit, params):
+        quantized = np.round(np.asarray(vector, dtype=np.float32) / self.quantum).astype('<i4')
+        digest = hashlib.blake2b(quantized.tobytes(), digest_size=16).hexdigest()
+        with self._lock:
+            generation = self._generation(collection_name, tenant_id)
+        return (collection_name, tenant_id, generation, digest, limit, json.dumps(params, sort_keys=True))
+
+    def _generation(self, collection_name, tenant_id):
+        # Generazione della collection (delete senza tenant) e del tenant
+        return (self._generations.get((collection_name, None), 0), self._generations.get((collection_name, tenant_id), 0))
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, hits):
+        with self._lock:
+            # Una scrittura avvenuta durante la ricerca ha già cambiato generazione
+            if key[2] != self._generation(key[0], key[1]):
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, hits)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, collection_name, tenant_id=None):
+        """Invalida le voci di un tenant (o dell'intera collection se il tenant non è noto)"""
+        with self._lock:
+            generation_key = (collection_name, tenant_id)
+            self._generations[generation_key] = self._generations.get(generation_key, 0) + 1
+            stale = [k for k in self._entries if k[0] == collection_name and tenant_id in (None, k[1])]
+            for key in stale:
+                del self._entries[key]
+
+    def counters(self, hit):
+        with self._lock:
+            return {"hit": hit, "hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+_search_cache = SearchResultCache(
+    max_entries=int(os.getenv('MILVUS_SEARCH_CACHE_SIZE', '1024')),
+    ttl=float(os.getenv('MILVUS_SEARCH_CACHE_TTL', '300')),
+    quantum=float(os.getenv('MILVUS_SEARCH_CACHE_QUANTUM', '0.001'))
+)
+
+# ---------------------------------------------------------------------------
+# Micro-batching delle search concorrenti (worker su socket)
+# ---------------------------------------------------------------------------
+
+class _PendingBatch:
+    def __init__(self):
+        self.queries = []
+        self.limits = []
+        self.full = threading.Event()
+        self.done = threading.Event()
+        self.started = None
+        self.results = None
+        self.error = None
+
+class SearchBatcher:
+    """
+    Accorpa le search concorrenti compatibili in una sola collection.search (nq > 1).
+
+    La prima richiesta di un gruppo (stessa collection, filtro tenant, soglia,
+    partizioni e output_fields: Milvus applica un solo expr a tutte le query)
+    diventa leader: attende al più `window` secondi o `max_batch` richieste,
+    esegue la search con il limit massimo e distribuisce i risultati troncati
+    a ciascun limit. Le altre attendono nel proprio thread. Se non ci sono
+    search in corso il leader non aspetta: a worker scarico la latenza
+    aggiunta è zero. L'attesa di ogni richiesta è la fase `batch_wait`.
+    """
+
+    def __init__(self, window_ms=0.0, max_batch=16):
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._groups = {}   # chiave -> batch aperto
+        self._inflight = 0  # batch in esecuzione su Milvus
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.queries = 0
+        self.max_size = 0
+
+    @property
+    def enabled(self):
+        return self.window > 0 and self.max_batch > 1
+
+    def search(self, key, query_vector, limit, execute):
+        """
+        Accoda una query e ritorna (hit, dimensione del batch, ms di attesa).
+
+        `execute(query_vectors, max_limit)` viene chiamata dal leader e deve
+        ritornare una lista di hit per query.
+        """
+        arrived = time.perf_counter()
+        with self._lock:
+            batch = self._groups.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._groups[key] = _PendingBatch()
+                wait = self._inflight > 0
+            slot = len(batch.queries)
+            batch.queries.append(query_vector)
+            batch.limits.append(limit)
+            if len(batch.queries) >= self.max_batch:
+                # Batch pieno: le richieste successive ne aprono uno nuovo
+                del self._groups[key]
+                batch.full.set()
+
+        if leader:
+            if wait:
+                batch.full.wait(self.window)
+            with self._lock:
+                if self._groups.get(key) is batch:
+                    del self._groups[key]
+                self._inflight += 1
+                self.batches += 1
+                self.queries += len(batch.queries)
+                self.max_size = max(self.max_size, len(batch.queries))
+            batch.started = time.perf_counter()
+            try:
+                batch.results = execute(batch.queries, max(batch.limits))
+            except Exception as e:
+                batch.error = e
+            finally:
+                with self._lock:
+                    self._inflight -= 1
+                batch.done.set()
+        else:
+            batch.done.wait()
+
+        wait_ms = (batch.started - arrived) * 1000
+        timings = getattr(_request_timings, 'current', None)
+        if timings is not None:
+            timings.phases['batch_wait'] += wait_ms
+        if batch.error is not None:
+            raise batch.error
+        return batch.results[slot][:limit], len(batch.queries), wait_ms
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "window_ms": round(self.window * 1000, 3),
+                "max_batch": self.max_batch,
+                "batches": self.batches,
+                "queries": self.queries,
+                "avg_size": round(self.queries / self.batches, 2) if self.batches else 0.0,
+                "max_size": self.max_size,
+            }
+
+# Attivato da serve() in modalità socket (--batch-window-ms)
+_search_batcher = SearchBatcher()
+
+# ---------------------------------------------------------------------------
+# Tier locale: ricerca esatta con NumPy per i tenant piccoli
+# ---------------------------------------------------------------------------
+
+# Directory dei file per tenant (vuota = tier disattivato)
+LOCAL_TIER_DIR = os.getenv('MILVUS_LOCAL_TIER_DIR', '').strip()
+# Oltre questa soglia di chunk il tenant resta su Milvus
+LOCAL_TIER_MAX_ROWS = int(os.getenv('MILVUS_LOCAL_TIER_MAX_ROWS', '20000'))
+# Età massima di una copia: le scritture fatte da altri nodi diventano visibili al refresh
+LOCAL_TIER_MAX_AGE = float(os.getenv('MILVUS_LOCAL_TIER_MAX_AGE', '900'))
+LOCAL_TIER_BLOCK_ROWS = int(os.getenv('MILVUS_LOCAL_TIER_BLOCK_ROWS', '8192'))
+
+class LocalTenantIndex:
+    """
+    Vettori normalizzati di un tenant su disco locale.
+
+    `vectors.npy` (float32, memory-mapped) e `ids.npy` hanno capacità libera
+    in coda: gli append scrivono sul posto e una cancellazione sposta l'ultima
+    riga nel buco. `meta.json` tiene righe valide, dimensione ed età della
+    copia. Le scritture (anche da altri processi) prendono un flock esclusivo,
+    le ricerche uno condiviso; chi legge riapre i file se meta.json cambia.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.rows = 0
+        self.dim = 0
+        self.synced_at = 0.0
+        self._vectors = None
+        self._ids = None
+        self._stamp = None
+        self._thread_lock = threading.RLock()
+
+    @staticmethod
+    def exists(path):
+        return os.path.exists(os.path.join(path, "meta.json"))
+
+    @classmethod
+    def create(cls, path, ids, matrix):
+        """Scrive una copia completa in una directory temporanea e la sostituisce a quella esistente"""
+        matrix = np.asarray(matrix, dtype=np.float32)
+        parent, name = os.path.split(path)
+        os.makedirs(parent, exist_ok=True)
+        tmp_path = os.path.join(parent, f".{name}.{os.getpid()}.{threading.get_ident()}")
+        os.makedirs(tmp_path)
+        capacity = max(64, int(len(ids) * 1.25))
+        vectors = np.lib.format.open_memmap(os.path.join(tmp_path, "vectors.npy"), mode='w+', dtype=np.float32,
+                                            shape=(capacity, matrix.shape[1]))
+        vectors[:len(ids)] = normalize_rows(matrix)
+        vectors.flush()
+        stored_ids = np.lib.format.open_memmap(os.path.join(tmp_path, "ids.npy"), mode='w+', dtype=np.int64,
+                                               shape=(capacity,))
+        stored_ids[:len(ids)] = np.asarray(ids, dtype=np.int64)
+        stored_ids.flush()
+        del vectors, stored_ids
+        cls._write_meta(tmp_path, len(ids), matrix.shape[1], time.time())
+
+        index = cls(path)
+        with index._locked(exclusive=True):
+            trash = None
+            if os.path.exists(path):
+                trash = f"{tmp_path}.old"
+                os.replace(path, trash)
+            os.replace(tmp_path, path)
+        if trash:
+            shutil.rmtree(trash, ignore_errors=True)
+        return index
+
+    @staticmethod
+    def _write_meta(path, rows, dim, synced_at):
+        tmp = os.path.join(path, "meta.json.tmp")
+        with open(tmp, "w") as f:
+            json.dump({"rows": rows, "dim": dim, "synced_at": synced_at}, f)
+        os.replace(tmp, os.path.join(path, "meta.json"))
+
+    @contextmanager
+    def _locked(self, exclusive=False):
+        # Il lock file sta accanto alla directory: sopravvive alla sostituzione fatta da create().
+        # Senza fcntl (Windows) resta solo il lock tra i thread del processo
+        with self._thread_lock:
+            if fcntl is None:
+                yield
+                return
+            with open(f"{self.path}.lock", "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _refresh(self):
+        """Riapre i file se un'altra scrittura (o un rebuild) ha cambiato meta.json"""
+        meta_path = os.path.join(self.path, "meta.json")
+        stat = os.stat(meta_path)
+        stamp = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if stamp == self._stamp:
+            return
+        with open(meta_path) as f:
+            meta = json.load(f)
+        self._vectors = np.load(os.path.join(self.path, "vectors.npy"), mmap_mode='r+')
+        self._ids = np.load(os.path.join(self.path, "ids.npy"), mmap_mode='r+')
+        self.rows, self.dim, self.synced_at = int(meta["rows"]), int(meta["dim"]), float(meta["synced_at"])
+        self._stamp = stamp
+
+    def scores(self, query_vector, block_rows=LOCAL_TIER_BLOCK_ROWS):
+        """Similarità coseno con tutte le righe: prodotto matrice-vettore a blocchi sul memmap"""
+        with self._locked():
+            self._refresh()
+            query = np.asarray(query_vector, dtype=np.float32)
+            if query.shape[0] != self.dim:
+                raise ValueError(f"query dim {query.shape[0]} != local tier dim {self.dim}")
+            query = query / (np.linalg.norm(query) or 1.0)
+            scores = np.empty(self.rows, dtype=np.float32)
+            for start in range(0, self.rows, block_rows):
+                end = min(start + block_rows, self.rows)
+                np.dot(self._vectors[start:end], query, out=scores[start:end])
+            return np.array(self._ids[:self.rows]), scores
+
+    def count(self):
+        with self._locked():
+            self._refresh()
+            return self.rows
+
+    def replace_documents(self, documents):
+        """Sostituisce le righe dei documenti {document_id: vettori} (vettori vuoti = documento eliminato)"""
+        with self._locked(exclusive=True):
+            self._refresh()
+            self._remove(np.isin(np.asarray(self._ids[:self.rows]) // 100000, list(documents)))
+            for document_id, vectors in documents.items():
+                if len(vectors):
+                    ids = document_id * 100000 + np.arange(len(vectors), dtype=np.int64)
+                    self._append(ids, normalize_rows(np.asarray(vectors, dtype=np.float32)))
+            self._commit()
+            return self.rows
+
+    def remove_ids(self, ids):
+        with self._locked(exclusive=True):
+            self._refresh()
+            self._remove(np.isin(np.asarray(self._ids[:self.rows]), np.asarray(ids, dtype=np.int64)))
+            self._commit()
+            return self.rows
+
+    def _remove(self, mask):
+        # Le righe tenute in coda riempiono i buchi: costo proporzionale alle righe rimosse
+        removed = np.flatnonzero(mask)
+        if not len(removed):
+            return
+        rows = self.rows - len(removed)
+        holes = removed[removed < rows]
+        movers = np.flatnonzero(~mask[rows:]) + rows
+        self._vectors[holes] = self._vectors[movers]
+        self._ids[holes] = self._ids[movers]
+        self.rows = rows
+
+    def _append(self, ids, matrix):
+        if matrix.shape[1] != self.dim:
+            raise ValueError(f"vector dim {matrix.shape[1]} != local tier dim {self.dim}")
+        needed = self.rows + len(ids)
+        if needed > len(self._ids):
+            self._grow(max(needed, int(len(self._ids) * 1.5)))
+        self._vectors[self.rows:needed] = matrix
+        self._ids[self.rows:needed] = ids
+        self.rows = needed
+
+    def _grow(self, capacity):
+        """Nuovi file con più capacità (chi legge ancora i vecchi continua a vedere il proprio inode)"""
+        for name, dtype, shape, current in (("vectors.npy", np.float32, (capacity, self.dim), self._vectors),
+                                            ("ids.npy", np.int64, (capacity,), self._ids)):
+            tmp = os.path.join(self.path, f"{name}.tmp")
+            grown = np.lib.format.open_memmap(tmp, mode='w+', dtype=dtype, shape=shape)
+            grown[:self.rows] = current[:self.rows]
+            grown.flush()
+            del grown
+            os.replace(tmp, os.path.join(self.path, name))
+        self._vectors = np.load(os.path.join(self.path, "vectors.npy"), mmap_mode='r+')
+        self._ids = np.load(os.path.join(self.path, "ids.npy"), mmap_mode='r+')
+
+    def _commit(self):
+        self._vectors.flush()
+        self._ids.flush()
+        # Le modifiche incrementali non rinnovano l'età: solo un export completo lo fa
+        self._write_meta(self.path, self.rows, self.dim, self.synced_at)
+        self._stamp = None
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+class LocalSearchTier:
+    """
+    Tier di ricerca esatta per i tenant con al più `max_rows` chunk.
+
+    Una copia per (collection reale, tenant) viene costruita con il query
+    iterator (in background nel worker, oppure con l'operazione
+    local_tier_refresh) e aggiornata dalle scritture che passano da questo
+    processo; quelle arrivate durante l'export vengono riapplicate alla fine.
+    Le scritture fatte da altri nodi diventano visibili al refresh successivo
+    (età massima `max_age`). Tenant oltre soglia, copie mancanti o in
+    costruzione: la ricerca va su Milvus.
+    """
+
+    def __init__(self, root, max_rows, max_age, block_rows):
+        self.root = root
+        self.max_rows = max_rows
+        self.max_age = max_age
+        self.block_rows = block_rows
+        self.background_builds = False
+        self._indexes = {}     # (collection, tenant) -> LocalTenantIndex
+        self._too_large = {}   # (collection, tenant) -> istante fino a cui non riprovare
+        self._building = set()
+        self._pending = {}     # (collection, tenant) -> scritture arrivate durante l'export
+        self._lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        self.searches = 0
+        self.fallbacks = 0
+        self.builds = 0
+
+    @property
+    def enabled(self):
+        return bool(self.root) and self.max_rows > 0
+
+    def _key(self, collection_name, tenant_id):
+        return resolve_collection_name(collection_name), int(tenant_id)
+
+    def _path(self, key):
+        return os.path.join(self.root, key[0], f"tenant_{key[1]}")
+
+    def _index(self, key):
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is None and LocalTenantIndex.exists(self._path(key)):
+                index = self._indexes[key] = LocalTenantIndex(self._path(key))
+            return index
+
+    def search(self, collection_name, tenant_id, query_vector, limit, min_score=None, group_size=None,
+               document_ids=None, exclude_document_ids=None):
+        """Hit esatti dalla copia locale, None se il tenant va servito da Milvus"""
+        key = self._key(collection_name, tenant_id)
+        index = self._index(key)
+        if index is None:
+            self.fallbacks += 1
+            self.schedule_build(collection_name, tenant_id)
+            return None
+
+        try:
+            ids, scores = index.scores(query_vector, self.block_rows)
+        except Exception as e:
+            print(f"local tier: ricerca tenant {tenant_id} fallita, uso Milvus: {e}", file=sys.stderr)
+            self.fallbacks += 1
+            return None
+        if time.time() - index.synced_at > self.max_age:
+            self.schedule_build(collection_name, tenant_id)
+        self.searches += 1
+
+        valid = np.ones(len(ids), dtype=bool)
+        if document_ids is not None:
+            valid &= np.isin(ids // 100000, list(document_ids))
+        if exclude_document_ids:
+            valid &= ~np.isin(ids // 100000, list(exclude_document_ids))
+        if min_score is not None:
+            valid &= scores > min_score
+        candidates = np.flatnonzero(valid)
+
+        if group_size:
+            order = candidates[np.argsort(-scores[candidates], kind='stable')]
+        elif len(candidates) > limit:
+            top = candidates[np.argpartition(-scores[candidates], limit - 1)[:limit]]
+            order = top[np.argsort(-scores[top], kind='stable')]
+        else:
+            order = candidates[np.argsort(-scores[candidates], kind='stable')]
+
+        hits = [{"id": int(ids[i]), "distance": float(scores[i]), "score": 1.0 - float(scores[i])} for i in order]
+        return group_hits(hits, limit, group_size) if group_size else hits
+
+    def schedule_build(self, collection_name, tenant_id):
+        """Nel worker avvia (una volta) la costruzione della copia in un thread"""
+        if not self.background_builds:
+            return
+        key = self._key(collection_name, tenant_id)
+        with self._lock:
+            if key in self._building or self._too_large.get(key, 0) > time.monotonic():
+                return
+            self._building.add(key)
+
+        def run():
+            try:
+                self.build(collection_name, tenant_id)
+            except Exception as e:
+                print(f"local tier: build tenant {tenant_id} di {collection_name} fallito: {e}", file=sys.stderr)
+
+        threading.Thread(target=run, name=f"local-tier-{tenant_id}", daemon=True).start()
+
+    def build(self, collection_name, tenant_id):
+        """Export completo del tenant con il query iterator; None se supera la soglia"""
+        key = self._key(collection_name, tenant_id)
+        with self._write_lock:
+            self._pending.setdefault(key, [])
+        try:
+            collection, partitions = get_tenant_collection(collection_name, tenant_id)
+            expr = f"tenant_id == {tenant_id}"
+            rows = count_entities(collection, expr, partitions, consistency_level="Strong") if partitions != [] else 0
+            if rows > self.max_rows:
+                self.drop(key)
+                with self._lock:
+                    self._too_large[key] = time.monotonic() + self.max_age
+                return None
+
+            ids, blocks = [], []
+            if rows:
+                for batch in iter_query_batches(collection, expr, ["id", "vector"], EXPORT_BATCH_SIZE, partitions,
+                                                consistency_level="Strong"):
+                    ids.extend(int(r["id"]) for r in batch)
+                    blocks.append(np.asarray([r["vector"] for r in batch], dtype=np.float32))
+            dim = int(vector_fields(collection)["vector"][1]["dim"])
+            matrix = np.concatenate(blocks) if blocks else np.empty((0, dim), dtype=np.float32)
+            index = LocalTenantIndex.create(self._path(key), ids, matrix)
+
+            # Le scritture arrivate durante l'export potrebbero mancare: si riapplicano in ordine
+            with self._write_lock:
+                for write, args in self._pending.pop(key, []):
+                    getattr(index, write)(*args)
+                with self._lock:
+                    self._indexes[key] = index
+                    self._too_large.pop(key, None)
+            self.builds += 1
+            return index.count()
+        finally:
+            with self._write_lock:
+                self._pending.pop(key, None)
+            with self._lock:
+                self._building.discard(key)
+
+    def _apply(self, collection_name, tenant_id, write, *args):
+        key = self._key(collection_name, tenant_id)
+        with self._write_lock:
+            if key in self._pending:
+                self._pending[key].append((write, args))
+            index = self._index(key)
+            if index is None:
+                return
+            try:
+                if getattr(index, write)(*args) > self.max_rows:
+                    self.drop(key)
+            except Exception as e:
+                # Copia non più affidabile: si torna a Milvus fino al prossimo export
+                print(f"local tier: aggiornamento tenant {tenant_id} fallito: {e}", file=sys.stderr)
+                self.drop(key)
+
+    def apply_documents(self, collection_name, tenant_id, documents):
+        """Riflette upsert/sync di documenti {document_id: vettori} sulla copia locale, se esiste"""
+        self._apply(collection_name, tenant_id, "replace_documents", documents)
+
+    def remove_ids(self, collection_name, primary_ids, tenant_id=None):
+        """Cancellazioni per ID; senza tenant si scartano tutte le copie della collection"""
+        if tenant_id is None:
+            self.drop_collection(collection_name)
+        else:
+            self._apply(collection_name, tenant_id, "remove_ids", primary_ids)
+
+    def drop_tenant(self, collection_name, tenant_id):
+        self.drop(self._key(collection_name, tenant_id))
+
+    def drop(self, key):
+        with self._lock:
+            self._indexes.pop(key, None)
+        shutil.rmtree(self._path(key), ignore_errors=True)
+
+    def drop_collection(self, collection_name):
+        real_name = resolve_collection_name(collection_name)
+        with self._lock:
+            for key in [k for k in self._indexes if k[0] == real_name]:
+                del self._indexes[key]
+        shutil.rmtree(os.path.join(self.root, real_name), ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "max_rows": self.max_rows,
+                "open_tenants": len(self._indexes),
+                "building": len(self._building),
+                "searches": self.searches,
+                "fallbacks": self.fallbacks,
+                "builds": self.builds,
+            }
+
+_local_tier = LocalSearchTier(LOCAL_TIER_DIR, LOCAL_TIER_MAX_ROWS, LOCAL_TIER_MAX_AGE, LOCAL_TIER_BLOCK_ROWS)
+
+def search_vectors(collection_name, query_vector, tenant_id, limit=10, result_format='json', use_cache=True,
+                   two_stage=None, oversample=TWO_STAGE_OVERSAMPLE, min_score=None, group_by=None, group_size=1,
+                   document_ids=None, exclude_document_ids=None, output_fields=None):
+    """
+    Esegue una ricerca vettoriale su Milvus.
+
+    Con `two_stage` (default MILVUS_TWO_STAGE) e una collection con campo
+    compatto la ricerca ANN avviene su vector_coarse e i candidati vengono
+    riordinati con il coseno esatto sui vettori completi.
+
+    `min_score` (similarità coseno, il campo `distance`) diventa una range
+    search; con `group_by='document_id'` `limit` conta i documenti e ognuno
+    porta al più `group_size` chunk. `document_ids` / `exclude_document_ids`
+    restringono il filtro tenant. `output_fields` aggiunge a ogni hit i campi
+    richiesti (`fields`), compresi testo e metadati salvati da upsert_vectors.
+
+    Con il tier locale attivo (MILVUS_LOCAL_TIER_DIR) i tenant piccoli sono
+    serviti con una ricerca esatta sulla copia su disco (`tier: local`).
+    """
+    try:
+        # Parametri di ricerca - per HNSW ef tarato per il tenant, comunque >= limit
+        collection = get_collection(collection_name)
+        params = range_params(search_params(collection, tenant_id, limit), min_score)
+        if two_stage is None:
+            two_stage = TWO_STAGE_DEFAULT
+        two_stage = bool(two_stage) and coarse_field(collection)[0] > 0
+        if two_stage:
+            params = {**params, "two_stage": max(1, oversample)}
+        expr = search_expr(tenant_id, document_ids, exclude_document_ids)
+        if group_by:
+            params = {**params, "group_by": group_by, "group_size": group_size}
+        if expr != f"tenant_id == {tenant_id}":
+            params = {**params, "expr": expr}
+        output_fields = search_output_fields(collection, output_fields)
+        if output_fields:
+            params = {**params, "output_fields": output_fields}
+
+        cache_key = None
+        if use_cache and _search_cache.enabled:
+            cache_key = _search_cache.key(collection_name, tenant_id, query_vector, limit, params)
+            cached = _search_cache.get(cache_key)
+            if cached is not None:
+                return {"success": True, "hits": encode_hits(cached, result_format), "cache": _search_cache.counters(True)}
+
+        if document_ids is not None and not document_ids:
+            return {"success": True, "hits": encode_hits([], result_format)}
+
+        local_hits = None
+        if _local_tier.enabled:
+            local_hits = _local_tier.search(collection_name, tenant_id, query_vector, limit, min_score,
+                                            group_size if group_by else None, document_ids, exclude_document_ids)
+
+        if local_hits is not None:
+            hits = local_hits
+            if output_fields and hits:
+                collection, partitions = get_tenant_collection(collection_name, tenant_id)
+                attach_fields(collection, partitions, hits, output_fields)
+            response = {"success": True, "hits": encode_hits(hits, result_format), "tier": "local"}
+            if cache_key is not None:
+                _search_cache.put(cache_key, hits)
+                response["cache"] = _search_cache.counters(False)
+            return response
+
+        # Carica la collection (handle riusato nel worker persistente)
+        collection, partitions = get_tenant_collection(collection_name, tenant_id)
+        if partitions == []:
+            return {"success": True, "hits": encode_hits([], result_format)}
+
+        if two_stage:
+            hits, candidates = two_stage_search(collection, partitions, query_vector, tenant_id, limit, oversample,
+                                                expr=expr, min_score=min_score,
+                                                group_size=group_size if group_by else None,
+                                                output_fields=output_fields)
+            response = {"success": True, "hits": encode_hits(hits, result_format),
+                        "two_stage": {"candidates": candidates, "rescored": True}}
+        else:
+            # Milvus non combina range search e grouping: con entrambi si raggruppa qui
+            # su limit × group_size × oversample hit sopra la soglia
+            native_grouping = bool(group_by) and min_score is None
+            grouping = {"group_by_field": group_by, "group_size": group_size, "strict_group_size": False} \
+                if native_grouping else {}
+            search_limit = limit * group_size * max(1, oversample) if group_by and not native_grouping else limit
+
+            def run_search(query_vectors, search_limit):
+                # Esegui ricerca con filtro tenant (ripristinato)
+                results = collection.search(
+                    data=query_vectors,
+                    anns_field="vector",
+                    param=range_params(search_params(collection, tenant_id, search_limit), min_score),
+                    limit=search_limit,
+                    expr=expr,
+                    partition_names=partitions,
+                    output_fields=output_fields or None,
+                    **grouping
+                )
+                return [format_hits(result, output_fields) for result in results]
+
+            batch = None
+            if _search_batcher.enabled and not group_by:
+                # Le search concorrenti con lo stesso filtro condividono una chiamata nq > 1
+                batch_key = (collection.name, tenant_id, expr, min_score,
+                             tuple(partitions or ()), tuple(output_fields or ()))
+                hits, batch_size, wait_ms = _search_batcher.search(batch_key, query_vector, search_limit, run_search)
+                batch = {"size": batch_size, "wait_ms": round(wait_ms, 3)}
+            else:
+                hits = run_search([query_vector], search_limit)[0]
+            if group_by and not native_grouping:
+                hits = group_hits(hits, limit, group_size)
+            response = {"success": True, "hits": encode_hits(hits, result_format)}
+            if batch is not None:
+                response["batch"] = batch
+
+        if cache_key is not None:
+            _search_cache.put(cache_key, hits)
+            response["cache"] = _search_cache.counters(False)
+        return response
         
-        # Esegui ricerca con filtro tenant (ripristinato)
+    except Exception as e:
+        return {
+            "success": False, 
+            "error": str(e),
+            "error_type": type(e).__name__
+        }
+
+def search_batch(collection_name, query_vectors, tenant_id, limits, fuse=False, rrf_k=60, fused_limit=None,
+                 result_format='json'):
+    """Esegue N ricerche vettoriali con una sola chiamata Milvus (nq = N)"""
+    try:
+        collection, partitions = get_tenant_collection(collection_name, tenant_id)
+        if partitions == []:
+            empty = [encode_hits([], result_format) for _ in limits]
+            return {"success": True, "results": empty, "nq": len(limits), **({"fused": []} if fuse else {})}
+
+        # Un'unica search con il limit massimo, poi ogni lista viene troncata al suo limit
+        max_limit = max(limits)
+        params = search_params(collection, tenant_id, max_limit)
+
         results = collection.search(
-            data=[query_vector],
+            data=list(query_vectors),
             anns_field="vector",
-            param=search_params,
-            limit=limit,
-            expr=f"tenant_id == {tenant_id}"
+            param=params,
+            limit=max_limit,
+            expr=f"tenant_id == {tenant_id}",
+            partition_names=partitions
         )
-        
-        # Formatta risultati per Laravel
-        hits = []
-        for hit in results[0]:
-            hits.append({
-                "id": int(hit.id),
-                "distance": float(hit.distance),
-                "score": 1.0 - float(hit.distance)  # Converti distance in score
-            })
-        
-        return {"success": True, "hits": hits}
-        
+
+        per_query = [format_hits(raw)[:limit] for raw, limit in zip(results, limits)]
+        response = {
+            "success": True,
+            "results": [encode_hits(hits, result_format) for hits in per_query],
+            "nq": len(per_query)
+        }
+
+        if fuse:
+            response["fused"] = rrf_fuse(per_query, rrf_k, fused_limit)
+
+        return response
+
     except Exception as e:
         return {
-            "success": False, 
+            "success": False,
             "error": str(e),
             "error_type": type(e).__name__
         }
 
-def upsert_vectors(collection_name, tenant_id, document_id, vectors, chunks=None):
-    """Inserisce o aggiorna vettori in Milvus"""
+def hybrid_search(collection_name, query_vector, tenant_id, limit=10, query_sparse=None, query_text=None,
+                  ranker='rrf', rrf_k=60, weights=(0.5, 0.5), candidates=None, result_format='json'):
+    """
+    Ricerca ibrida densa + sparsa in una sola chiamata Milvus.
+
+    Ogni ramo recupera `candidates` hit (default max(limit, MILVUS_HYBRID_CANDIDATES))
+    con lo stesso filtro tenant; Milvus li fonde con RRF o con una media
+    pesata degli score normalizzati. `distance` e `score` sono lo score fuso
+    (più alto = migliore).
+    """
     try:
-        connect_milvus()
-        collection = Collection(collection_name)
+        collection, partitions = get_tenant_collection(collection_name, tenant_id)
+        if not has_sparse_field(collection):
+            return {"success": False, "error": f"Collection {collection.name} has no {SPARSE_FIELD} field"}
+        if partitions == []:
+            return {"success": True, "hits": encode_hits([], result_format), "ranker": ranker}
+
+        candidates = candidates or max(limit, HYBRID_CANDIDATES)
+        sparse = query_sparse if query_sparse is not None else sparse_from_text(query_text, query=True)
+        expr = f"tenant_id == {tenant_id}"
+        requests = [
+            AnnSearchRequest(data=[query_vector], anns_field="vector",
+                             param=search_params(collection, tenant_id, candidates), limit=candidates, expr=expr),
+            AnnSearchRequest(data=[sparse], anns_field=SPARSE_FIELD,
+                             param={"metric_type": "IP", "params": {"drop_ratio_search": SPARSE_DROP_RATIO}},
+                             limit=candidates, expr=expr),
+        ]
+        rerank = RRFRanker(rrf_k) if ranker == 'rrf' else WeightedRanker(*weights)
+
+        results = collection.hybrid_search(requests, rerank, limit, partition_names=partitions)
+        hits = [{"id": int(hit.id), "distance": float(hit.distance), "score": float(hit.distance)} for hit in results[0]]
+        return {"success": True, "hits": encode_hits(hits, result_format), "ranker": ranker, "candidates": candidates}
+
+    except Exception as e:
+        return {
+            "success": False,
+            "error": str(e),
+            "error_type": type(e).__name__
+        }
+
+# Candidati letti da search_mmr quando il client non li indica (multiplo di k)
+MMR_FETCH_FACTOR = int(os.getenv('MILVUS_MMR_FETCH_FACTOR', '4'))
+
+def mmr_select(query_vector, matrix, mmr_lambda, k):
+    """
+    Maximal Marginal Relevance vettoriale (stessa formula di KbSearchService::mmr).
+
+    Similarità con la query e tra candidati sono due prodotti matriciali;
+    ogni passo aggiorna la massima similarità con i già selezionati in O(n).
+    Ritorna (indici selezionati in ordine, score MMR, similarità con la query).
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    matrix = matrix / norms
+    query = np.asarray(query_vector, dtype=np.float32)
+    query = query / (np.linalg.norm(query) or 1.0)
+
+    query_sims = matrix @ query
+    k = min(k, len(matrix))
+    if mmr_lambda >= 0.99:
+        order = np.argsort(-query_sims, kind='stable')[:k]
+        return order.tolist(), query_sims[order].tolist(), query_sims
+
+    pairwise = matrix @ matrix.T
+    max_selected_sim = np.zeros(len(matrix), dtype=np.float32)
+    available = np.ones(len(matrix), dtype=bool)
+    selected, scores = [], []
+    for _ in range(k):
+        mmr = mmr_lambda * query_sims - (1.0 - mmr_lambda) * max_selected_sim
+        mmr[~available] = -np.inf
+        best = int(np.argmax(mmr))
+        selected.append(best)
+        scores.append(float(mmr[best]))
+        available[best] = False
+        np.maximum(max_selected_sim, pairwise[best], out=max_selected_sim)
+    return selected, scores, query_sims
+
+def search_mmr(collection_name, query_vector, tenant_id, k=8, mmr_lambda=0.5, candidate_ids=None, fetch_k=None,
+               result_format='json'):
+    """
+    Diversificazione MMR lato server con i vettori salvati in Milvus.
+
+    Con `candidate_ids` (es. i chunk già riordinati dal reranker) legge i loro
+    vettori; altrimenti recupera `fetch_k` candidati (default k × MILVUS_MMR_FETCH_FACTOR)
+    con una search che restituisce anche i vettori. Gli hit sono nell'ordine
+    di selezione: `distance` = similarità con la query, `mmr_score` = punteggio
+    MMR al momento della scelta.
+    """
+    try:
+        collection, partitions = get_tenant_collection(collection_name, tenant_id)
+        if partitions == [] or candidate_ids is not None and not candidate_ids:
+            return {"success": True, "hits": encode_hits([], result_format), "candidates": 0}
+
+        if candidate_ids is not None:
+            rows = collection.query(expr=f"tenant_id == {tenant_id} && id in {sorted(set(candidate_ids))}",
+                                    output_fields=["id", "vector"], partition_names=partitions)
+            by_id = {int(r["id"]): r["vector"] for r in rows}
+            # Ordine del client: a parità di score MMR vince il candidato meglio classificato
+            ids = [i for i in dict.fromkeys(candidate_ids) if i in by_id]
+            vectors = [by_id[i] for i in ids]
+        else:
+            fetch_k = fetch_k or k * MMR_FETCH_FACTOR
+            results = collection.search(
+                data=[query_vector],
+                anns_field="vector",
+                param=search_params(collection, tenant_id, fetch_k),
+                limit=fetch_k,
+                expr=f"tenant_id == {tenant_id}",
+                partition_names=partitions,
+                output_fields=["vector"]
+            )
+            ids = [int(hit.id) for hit in results[0]]
+            vectors = [hit.fields["vector"] for hit in results[0]]
+
+        if not ids:
+            return {"success": True, "hits": encode_hits([], result_format), "candidates": 0}
+
+        selected, scores, query_sims = mmr_select(query_vector, vectors, mmr_lambda, k)
+        hits = [{"id": ids[i], "distance": float(query_sims[i]), "score": 1.0 - float(query_sims[i]),
+                 "mmr_score": score} for i, score in zip(selected, scores)]
+        response = {"success": True, "hits": encode_hits(hits, result_format), "candidates": len(ids)}
+        if candidate_ids is not None and len(ids) < len(set(candidate_ids)):
+            response["missing_ids"] = sorted(set(candidate_ids) - set(ids))
+        return response
+
+    except Exception as e:
+        return {
+            "success": False,
+            "error": str(e),
+            "error_type": type(e).__name__
+        }
+
+# Politica di flush delle scritture: none | async | sync (| coalesce nel worker)
+FLUSH_MODES = ('none', 'async', 'sync', 'coalesce')
+# Operazioni di scrittura a cui si applica il parametro flush
+WRITE_OPERATIONS = {'upsert', 'sync_document', 'bulk_upsert', 'delete_by_ids', 'delete_by_tenant'}
+_default_flush_mode = os.getenv('MILVUS_FLUSH_MODE', 'sync')
+_flush_coalescer = None
+
+class FlushCoalescer:
+    """
+    Accorpa i flush delle scritture nel worker persistente.
+
+    Le scritture registrano le righe in attesa per collection; un thread di
+    background esegue un solo flush quando si supera la soglia di righe o
+    quando la scrittura più vecchia non flushata supera il ritardo massimo.
+    """
+
+    def __init__(self, max_rows=10000, max_delay=5.0):
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self._pending = {}  # collection -> [righe, timestamp prima scrittura]
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="flush-coalescer", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def record(self, collection_name, rows):
+        """Registra una scrittura e ritorna le righe in attesa di flush per la collection"""
+        with self._lock:
+            entry = self._pending.setdefault(collection_name, [0, time.monotonic()])
+            entry[0] += rows
+            pending = entry[0]
+        if pending >= self.max_rows:
+            self._wakeup.set()
+        return pending
+
+    def _due(self, force=False):
+        now = time.monotonic()
+        with self._lock:
+            due = [name for name, (rows, since) in self._pending.items()
+                   if force or rows >= self.max_rows or now - since >= self.max_delay]
+            for name in due:
+                del self._pending[name]
+        return due
+
+    def flush_due(self, force=False):
+        for collection_name in self._due(force):
+            try:
+                get_collection(collection_name).flush()
+            except Exception as e:
+                print(f"flush coalescato di {collection_name} fallito: {e}", file=sys.stderr)
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(min(self.max_delay, 0.5))
+            self._wakeup.clear()
+            self.flush_due()
+
+    def stop(self):
+        """Ferma il thread ed esegue i flush rimasti in sospeso"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.flush_due(force=True)
+
+def apply_flush(collection, mode, rows=0):
+    """
+    Applica la politica di flush a una scrittura e riporta se i segmenti sono stati sigillati.
+
+    flushed descrive solo la persistenza: le ricerche vedono anche i segmenti growing,
+    quindi la visibilità di una scrittura dipende dal consistency level della ricerca.
+    """
+    if mode == 'coalesce' and _flush_coalescer is None:
+        mode = 'sync'
+
+    if mode == 'coalesce':
+        pending = _flush_coalescer.record(collection.name, rows)
+        return {"flush": mode, "flushed": False, "pending_rows": pending}
+    if mode == 'none':
+        return {"flush": mode, "flushed": False}
+    if mode == 'async':
+        collection.flush(_async=True)
+        return {"flush": mode, "flushed": False}
+
+    collection.flush()
+    return {"flush": "sync", "flushed": True}
+
+# ---------------------------------------------------------------------------
+# Dual-write durante la migrazione online (recreate_milvus_collection.py online_migration)
+# ---------------------------------------------------------------------------
+
+# Proprietà della collection sorgente: nome della collection su cui ripetere le scritture
+DUAL_WRITE_PROPERTY = "kb.dual_write_target"
+_dual_write_targets = {}
+
+def dual_write_target(collection):
+    """Collection di destinazione della migrazione in corso, None se il dual-write è spento"""
+    with _state_lock:
+        cached = _dual_write_targets.get(collection.name)
+        if cached is None or time.monotonic() - cached[0] > ALIAS_REFRESH_SECONDS:
+            target = collection.describe().get('properties', {}).get(DUAL_WRITE_PROPERTY) or None
+            cached = (time.monotonic(), target if target != collection.name else None)
+            _dual_write_targets[collection.name] = cached
+        return cached[1]
+
+def mirror_write(collection, write, *args, **kwargs):
+    """
+    Ripete una scrittura riuscita sulla collection di destinazione.
+
+    Un errore sulla destinazione non fa fallire la scrittura principale:
+    viene riportato nella risposta e recuperato dalla verifica per tenant
+    della migrazione.
+    """
+    target = None
+    try:
+        target = dual_write_target(collection)
+        if target is None:
+            return {}
+        result = write(target, *args, **kwargs)
+        report = {"collection": target, "success": bool(result.get("success"))}
+        if not report["success"]:
+            report["error"] = result.get("error")
+    except Exception as e:
+        # La scrittura principale è già avvenuta: non deve risultare fallita
+        report = {"collection": target, "success": False, "error": str(e), "error_type": type(e).__name__}
+    if not report["success"]:
+        print(f"dual-write su {target} fallito: {report['error']}", file=sys.stderr)
+    return {"dual_write": report}
+
+def upsert_vectors(collection_name, tenant_id, document_id, vectors, chunks=None, flush='sync', sparse_vectors=None,
+                   metadata=None):
+    """
+    Inserisce o aggiorna vettori in Milvus.
+
+    Con il campo sparso i pesi sono espliciti o calcolati da `chunks`; con i
+    campi dinamici il testo dei chunk e `metadata` (title, source_url,
+    knowledge_base_id) vengono salvati con ogni riga.
+    """
+    try:
+        collection = get_collection(collection_name)
         
         # Prepara i dati per l'inserimento usando il formato a liste
         ids = []
@@ -82,31 +2001,255 @@ def upsert_vectors(collection_name, tenant_id, document_id, vectors, chunks=None
         vector_data = []
         
         for i, vector in enumerate(vectors):
-            primary_id = (document_id * 100000) + i
-            ids.append(primary_id)
-            tenant_ids.append(tenant_id)
-            document_ids.append(document_id)
-            chunk_indices.append(i)
-            vector_data.append(vector)
-        
-        # Formato corretto per Milvus: liste separate per ogni campo
-        data = [
-            ids,           # id (primary key)
-            tenant_ids,    # tenant_id
-            document_ids,  # document_id  
-            chunk_indices, # chunk_index
-            vector_data    # vector
-        ]
-        
-        # Inserisci i dati
-        collection.insert(data)
-        collection.flush()
-        
+            primary_id = (document_id * 100000) + i
+            ids.append(primary_id)
+            tenant_ids.append(tenant_id)
+            document_ids.append(document_id)
+            chunk_indices.append(i)
+            vector_data.append(vector)
+        
+        # Formato corretto per Milvus: liste separate per ogni campo
+        data = [
+            ids,           # id (primary key)
+            tenant_ids,    # tenant_id
+            document_ids,  # document_id  
+            chunk_indices, # chunk_index
+            vector_data    # vector
+        ]
+        # vector_coarse / sparse_vector, se presenti nello schema
+        data.extend(optional_columns(collection, vector_data, sparse_rows(collection, len(ids), sparse_vectors, chunks)))
+        
+        # Inserisci i dati (nella partizione del tenant, se la collection ne usa una per tenant)
+        partitions = tenant_partitions(collection, tenant_id, create=True)
+        payloads = chunk_payloads(collection, len(ids), chunks, metadata)
+        insert_columns(collection, data, payloads, partitions[0] if partitions else None)
+        
+        return {
+            "success": True,
+            "inserted_count": len(ids),
+            "payload_stored": payloads is not None,
+            **apply_flush(collection, flush, len(ids)),
+            **mirror_write(collection, upsert_vectors, tenant_id, document_id, vectors, chunks, flush, sparse_vectors,
+                           metadata)
+        }
+        
+    except Exception as e:
+        return {
+            "success": False,
+            "error": str(e),
+            "error_type": type(e).__name__
+        }
+
+# Budget per singolo insert: il limite gRPC di default di Milvus è 64 MB per messaggio
+INSERT_BATCH_ROWS = int(os.getenv('MILVUS_INSERT_BATCH_ROWS', '5000'))
+INSERT_BATCH_BYTES = int(os.getenv('MILVUS_INSERT_BATCH_BYTES', str(48 * 1024 * 1024)))
+
+def bulk_upsert(collection_name, documents, max_batch_rows=INSERT_BATCH_ROWS, max_batch_bytes=INSERT_BATCH_BYTES,
+                flush='sync'):
+    """
+    Inserisce i vettori di molti documenti in una sola chiamata.
+
+    Le righe di tutti i documenti vengono accumulate e inviate con insert
+    dimensionati per righe e byte; il flush (se richiesto) avviene una sola
+    volta alla fine.
+    Ogni documento è un dict con tenant_id, document_id e vettori in uno dei
+    formati accettati da decode_vectors. Gli errori sono riportati per
+    documento (`documents[].error`) senza interrompere gli altri.
+    """
+    try:
+        collection = get_collection(collection_name)
+        coarse_dim, coarse_dtype = coarse_field(collection)
+        with_sparse = has_sparse_field(collection)
+
+        report = {}
+        columns = ([], [], [], [], [])  # id, tenant_id, document_id, chunk_index, vector
+        sparse_column = []              # sparse_vector (solo se la collection lo ha)
+        payload_column = []             # campi dinamici (solo se la collection li ha)
+        with_payload = has_dynamic_fields(collection)
+        batch_docs = {}                 # document_id -> righe nel batch corrente
+        batch_bytes = 0
+        batch_partition = [None]        # con una partizione per tenant ogni batch resta in una partizione
+
+        def send_batch():
+            if not columns[0]:
+                return
+            try:
+                data = [list(column) for column in columns]
+                data.extend(optional_columns(collection, columns[4], list(sparse_column) if with_sparse else None))
+                insert_columns(collection, data, list(payload_column) if with_payload else None, batch_partition[0])
+                for doc_id, rows in batch_docs.items():
+                    report[doc_id]["inserted_count"] += rows
+            except Exception as e:
+                for doc_id in batch_docs:
+                    report[doc_id]["success"] = False
+                    report[doc_id]["error"] = str(e)
+            for column in columns:
+                column.clear()
+            sparse_column.clear()
+            payload_column.clear()
+            batch_docs.clear()
+
+        for doc in documents:
+            tenant_id = int(doc.get('tenant_id', 0))
+            document_id = int(doc.get('document_id', 0))
+            entry = report.setdefault(document_id, {
+                "tenant_id": tenant_id,
+                "document_id": document_id,
+                "success": True,
+                "inserted_count": 0,
+            })
+
+            try:
+                if tenant_id <= 0 or document_id <= 0:
+                    raise InvalidParams("valid tenant_id and document_id required")
+                vectors = decode_vectors(doc, 'vectors', int(doc.get('dim', 0)) or None)
+                if vectors is None:
+                    raise InvalidParams("vectors is required")
+                sparse = doc.get('sparse_vectors')
+                sparse = sparse_rows(collection, len(vectors), decode_sparse(sparse) if sparse is not None else None,
+                                     doc.get('chunks'))
+                payloads = chunk_payloads(collection, len(vectors), doc.get('chunks'), decode_metadata(doc))
+            except InvalidParams as e:
+                entry["success"] = False
+                entry["error"] = str(e)
+                continue
+
+            partitions = tenant_partitions(collection, tenant_id, create=True)
+            partition_name = partitions[0] if partitions else None
+            if partition_name != batch_partition[0]:
+                send_batch()
+                batch_bytes = 0
+                batch_partition[0] = partition_name
+
+            # id + 3 campi INT64 + vettore float32 (+ eventuale campo compatto)
+            row_bytes = 32 + vectors.shape[1] * 4 + coarse_dim * np.dtype(coarse_dtype or np.float32).itemsize
+            if sparse is not None:
+                row_bytes += 12 * sum(len(row) for row in sparse) // len(sparse)  # indice + peso per termine
+            if payloads is not None:
+                row_bytes += sum(len(json.dumps(p)) for p in payloads) // len(payloads)
+            for i, vector in enumerate(vectors):
+                if columns[0] and (len(columns[0]) >= max_batch_rows or batch_bytes + row_bytes > max_batch_bytes):
+                    send_batch()
+                    batch_bytes = 0
+
+                columns[0].append((document_id * 100000) + i)
+                columns[1].append(tenant_id)
+                columns[2].append(document_id)
+                columns[3].append(i)
+                columns[4].append(vector)
+                if sparse is not None:
+                    sparse_column.append(sparse[i])
+                if with_payload:
+                    payload_column.append(payloads[i] if payloads is not None else {})
+                batch_docs[document_id] = batch_docs.get(document_id, 0) + 1
+                batch_bytes += row_bytes
+
+        send_batch()
+
+        documents_report = list(report.values())
+        inserted_count = sum(d["inserted_count"] for d in documents_report)
+        return {
+            "success": True,
+            "inserted_count": inserted_count,
+            "failed_documents": sum(1 for d in documents_report if not d["success"]),
+            "documents": documents_report,
+            **apply_flush(collection, flush, inserted_count),
+            **mirror_write(collection, bulk_upsert, documents, max_batch_rows, max_batch_bytes, flush)
+        }
+
+    except Exception as e:
+        return {
+            "success": False,
+            "error": str(e),
+            "error_type": type(e).__name__
+        }
+
+def chunk_content_hashes(chunks):
+    """Hash del contenuto di ogni chunk, usato da sync_document per riconoscere i chunk invariati"""
+    return [hashlib.sha1((chunk or '').encode('utf-8')).hexdigest() for chunk in chunks]
+
+def sync_document(collection_name, tenant_id, document_id, vectors, chunk_hashes=None, flush='sync', chunks=None,
+                  sparse_vectors=None, metadata=None):
+    """
+    Re-indicizzazione incrementale di un documento.
+
+    Confronta i chunk in arrivo con quelli già in Milvus: scrive (upsert) solo
+    i chunk nuovi o modificati, cancella i chunk_index che non esistono più e
+    lascia invariati gli altri. Il confronto usa l'hash del contenuto salvato
+    nel campo dinamico `content_hash`; senza hash o senza campi dinamici tutti
+    i chunk vengono riscritti e si eliminano solo quelli in eccesso.
+    Testo e `metadata` dei chunk riscritti vengono salvati come in upsert_vectors;
+    i metadati entrano nell'hash, così un cambio di titolo o URL riscrive i chunk.
+    """
+    try:
+        if chunk_hashes and len(chunk_hashes) != len(vectors):
+            return {"success": False, "error": "chunk_hashes must contain one hash per vector"}
+
+        collection, partitions = get_tenant_collection(collection_name, tenant_id, create=True)
+        use_hashes = bool(chunk_hashes) and has_dynamic_fields(collection)
+        partition_name = partitions[0] if partitions else None
+        coarse_dim, coarse_dtype = coarse_field(collection)
+        sparse = sparse_rows(collection, len(vectors), sparse_vectors, chunks)
+        payloads = chunk_payloads(collection, len(vectors), chunks, metadata)
+        stored_hashes = chunk_hashes
+        if use_hashes and metadata:
+            digest = hashlib.sha1(json.dumps({k: metadata.get(k) for k in PAYLOAD_METADATA_FIELDS},
+                                             sort_keys=True, default=str).encode('utf-8')).hexdigest()[:12]
+            stored_hashes = [f"{h}:{digest}" for h in chunk_hashes]
+
+        output_fields = ["id", "chunk_index"] + (["content_hash"] if use_hashes else [])
+        # Query iterator: un documento può superare il limite di 16384 righe di una singola query
+        batches = iter_query_batches(collection, f"tenant_id == {tenant_id} && document_id == {document_id}",
+                                     output_fields, partition_names=partitions)
+        existing = [r for batch in batches for r in batch]
+        stored = {int(r["chunk_index"]): r for r in existing}
+
+        rows = []
+        unchanged = 0
+        for i, vector in enumerate(vectors):
+            previous = stored.get(i)
+            if use_hashes and previous is not None and previous.get("content_hash") == stored_hashes[i]:
+                unchanged += 1
+                continue
+
+            row = {
+                "id": (document_id * 100000) + i,
+                "tenant_id": tenant_id,
+                "document_id": document_id,
+                "chunk_index": i,
+                "vector": vector,
+            }
+            if coarse_dim:
+                row[COARSE_FIELD] = coarse_vectors([vector], coarse_dim, coarse_dtype)[0]
+            if sparse is not None:
+                row[SPARSE_FIELD] = sparse[i]
+            if payloads is not None:
+                row.update(payloads[i])
+            if use_hashes:
+                row["content_hash"] = stored_hashes[i]
+            rows.append(row)
+
+        # Chunk (e relativi eventuali duplicati) che non esistono più nel documento
+        stale_ids = sorted({int(r["id"]) for r in existing if int(r["chunk_index"]) >= len(vectors)})
+
+        for start in range(0, len(rows), INSERT_BATCH_ROWS):
+            collection.upsert(rows[start:start + INSERT_BATCH_ROWS], partition_name=partition_name)
+        for start in range(0, len(stale_ids), 16384):
+            collection.delete(f"id in {stale_ids[start:start + 16384]}", partition_name=partition_name)
+
         return {
             "success": True,
-            "inserted_count": len(ids)
+            "tenant_id": tenant_id,
+            "document_id": document_id,
+            "upserted_count": len(rows),
+            "unchanged_count": unchanged,
+            "deleted_count": len(stale_ids),
+            "hash_compare": use_hashes,
+            **apply_flush(collection, flush, len(rows) + len(stale_ids)),
+            **mirror_write(collection, sync_document, tenant_id, document_id, vectors, chunk_hashes, flush, chunks,
+                           sparse_vectors, metadata)
         }
-        
+
     except Exception as e:
         return {
             "success": False,
@@ -114,11 +2257,10 @@ def upsert_vectors(collection_name, tenant_id, document_id, vectors, chunks=None
             "error_type": type(e).__name__
         }
 
-def delete_by_primary_ids(collection_name, primary_ids):
+def delete_by_primary_ids(collection_name, primary_ids, flush='sync'):
     """Cancella documenti per primary ID"""
     try:
-        connect_milvus()
-        collection = Collection(collection_name)
+        collection = get_collection(collection_name)
         
         # Milvus accetta max 16384 ID per volta
         batch_size = 16384
@@ -126,15 +2268,21 @@ def delete_by_primary_ids(collection_name, primary_ids):
         
         for i in range(0, len(primary_ids), batch_size):
             batch = primary_ids[i:i + batch_size]
-            expr = f"id in {batch}"
-            collection.delete(expr)
-            deleted_count += len(batch)
-        
-        collection.flush()
+            # Con un'espressione sulla primary key Milvus conta gli ID richiesti, anche quelli
+            # inesistenti: si cancellano solo gli ID presenti e si somma il delete_count reale
+            rows = collection.query(expr=f"id in {batch}", output_fields=["id"], consistency_level="Strong")
+            existing = [row["id"] for row in rows]
+            if not existing:
+                continue
+            mutation = collection.delete(f"id in {existing}")
+            deleted_count += int(getattr(mutation, 'delete_count', 0) or 0)
         
         return {
             "success": True,
-            "deleted_count": deleted_count
+            "deleted_count": deleted_count,
+            "requested_count": len(primary_ids),
+            **apply_flush(collection, flush, deleted_count),
+            **mirror_write(collection, delete_by_primary_ids, primary_ids, flush)
         }
         
     except Exception as e:
@@ -144,17 +2292,37 @@ def delete_by_primary_ids(collection_name, primary_ids):
             "error_type": type(e).__name__
         }
 
-def delete_by_tenant(collection_name, tenant_id):
+def delete_by_tenant(collection_name, tenant_id, flush='sync'):
     """Cancella tutti i documenti di un tenant"""
     try:
-        connect_milvus()
-        collection = Collection(collection_name)
+        collection = get_collection(collection_name)
         
+        # Con una partizione per tenant la cancellazione è un drop di partizione
+        result = {"success": True, "dropped_partition": None}
+        deleted_count = 0
+        partitions = tenant_partitions(collection, tenant_id)
+        if partitions:
+            try:
+                partition = collection.partition(partitions[0])
+                partition_rows = int(partition.num_entities)
+                partition.release()
+                collection.drop_partition(partitions[0])
+                forget_partition(collection.name, partitions[0])
+                result["dropped_partition"] = partitions[0]
+                deleted_count = partition_rows
+            except Exception as e:
+                # Se il drop non è possibile si ripiega sulla delete per espressione
+                result["partition_drop_error"] = str(e)
+        
+        # Eventuali righe del tenant rimaste fuori dalla sua partizione (es. dati pre-migrazione)
         expr = f"tenant_id == {tenant_id}"
-        collection.delete(expr)
-        collection.flush()
+        mutation = collection.delete(expr)
+        deleted_count += int(getattr(mutation, 'delete_count', 0) or 0)
         
-        return {"success": True}
+        result["deleted_count"] = deleted_count
+        result.update(apply_flush(collection, flush, deleted_count))
+        result.update(mirror_write(collection, delete_by_tenant, tenant_id, flush))
+        return result
         
     except Exception as e:
         return {
@@ -163,24 +2331,22 @@ def delete_by_tenant(collection_name, tenant_id):
             "error_type": type(e).__name__
         }
 
+def count_entities(collection, expr, partition_names=None, consistency_level=None):
+    """Conteggio esatto lato server con l'aggregazione count(*), senza materializzare le righe"""
+    if partition_names == []:
+        return 0
+    extra = {"consistency_level": consistency_level} if consistency_level else {}
+    results = collection.query(expr=expr, output_fields=["count(*)"], partition_names=partition_names, **extra)
+    return int(results[0]["count(*)"]) if results else 0
+
 def count_by_tenant(collection_name, tenant_id):
     """Conta i chunk per uno specifico tenant"""
     try:
-        connect_milvus()
-        collection = Collection(collection_name)
-        collection.load()
-        
-        # Fai una query limitata per contare gli elementi
-        expr = f"tenant_id == {tenant_id}"
-        results = collection.query(
-            expr=expr,
-            output_fields=["id"],
-            limit=10000  # Limite alto per contare tutto
-        )
+        collection, partitions = get_tenant_collection(collection_name, tenant_id)
         
         return {
             "success": True,
-            "count": len(results)
+            "count": count_entities(collection, f"tenant_id == {tenant_id}", partitions)
         }
         
     except Exception as e:
@@ -190,35 +2356,71 @@ def count_by_tenant(collection_name, tenant_id):
             "error_type": type(e).__name__
         }
 
-def list_ids_by_tenant(collection_name, tenant_id):
-    """Ritorna tutti i primary ID per un tenant"""
+# Dimensione dei batch letti con i query iterator (export, statistiche, liste di ID)
+EXPORT_BATCH_SIZE = int(os.getenv('MILVUS_EXPORT_BATCH_SIZE', '4096'))
+
+def iter_query_batches(collection, expr, output_fields, batch_size=EXPORT_BATCH_SIZE, partition_names=None,
+                       consistency_level=None):
+    """Scorre i risultati di una query con il query iterator di pymilvus (memoria costante, niente offset)"""
+    if partition_names == []:
+        return
+    extra = {"consistency_level": consistency_level} if consistency_level else {}
+    iterator = collection.query_iterator(batch_size=batch_size, expr=expr, output_fields=output_fields,
+                                         partition_names=partition_names, **extra)
     try:
-        connect_milvus()
-        collection = Collection(collection_name)
-        collection.load()
+        while True:
+            batch = iterator.next()
+            if not batch:
+                break
+            yield batch
+    finally:
+        iterator.close()
 
-        expr = f"tenant_id == {tenant_id}"
-        batch_size = 16384
-        offset = 0
-        collected_ids = []
+def stats_by_tenant(collection_name, tenant_id, batch_size=16384):
+    """
+    Statistiche per documento di un tenant in un'unica chiamata:
+    numero di chunk e chunk_index massimo per ogni document_id.
 
-        while True:
-            results = collection.query(
-                expr=expr,
-                output_fields=["id"],
-                limit=batch_size,
-                offset=offset
-            )
+    Scorre solo i campi scalari con un query iterator (nessun vettore letto).
+    """
+    try:
+        collection, partitions = get_tenant_collection(collection_name, tenant_id)
 
-            if not results:
-                break
+        documents = {}
+        batches = iter_query_batches(collection, f"tenant_id == {tenant_id}", ["document_id", "chunk_index"], batch_size,
+                                     partitions)
+        for batch in batches:
+            for row in batch:
+                stats = documents.setdefault(int(row["document_id"]), [0, -1])
+                stats[0] += 1
+                stats[1] = max(stats[1], int(row["chunk_index"]))
 
-            collected_ids.extend(int(r.get("id")) for r in results if r.get("id") is not None)
+        return {
+            "success": True,
+            "tenant_id": tenant_id,
+            "count": sum(stats[0] for stats in documents.values()),
+            "document_count": len(documents),
+            "documents": [
+                {"document_id": doc_id, "count": stats[0], "max_chunk_index": stats[1]}
+                for doc_id, stats in sorted(documents.items())
+            ]
+        }
 
-            if len(results) < batch_size:
-                break
+    except Exception as e:
+        return {
+            "success": False,
+            "error": str(e),
+            "error_type": type(e).__name__
+        }
+
+def list_ids_by_tenant(collection_name, tenant_id):
+    """Ritorna tutti i primary ID per un tenant"""
+    try:
+        collection, partitions = get_tenant_collection(collection_name, tenant_id)
 
-            offset += batch_size
+        collected_ids = []
+        for batch in iter_query_batches(collection, f"tenant_id == {tenant_id}", ["id"], partition_names=partitions):
+            collected_ids.extend(int(r["id"]) for r in batch)
 
         return {
             "success": True,
@@ -232,32 +2434,324 @@ def list_ids_by_tenant(collection_name, tenant_id):
             "error_type": type(e).__name__
         }
 
-def count_by_document(collection_name, tenant_id, document_id):
+class StreamingResult:
+    """
+    Risultato emesso a frame NDJSON man mano che i batch arrivano da Milvus.
+
+    `frames` è un iterabile di dict; `summary` viene completato durante
+    l'iterazione e finisce nel frame conclusivo (`done: true`).
+    """
+
+    def __init__(self, frames, summary):
+        self.frames = frames
+        self.summary = summary
+
+# Nome della colonna nei frame per ogni campo scalare esportato
+_EXPORT_COLUMNS = {"id": "ids", "document_id": "document_ids", "chunk_index": "chunk_indices"}
+
+def encode_rows_frame(batch, fields, with_vectors, result_format):
+    """Serializza un batch di righe in forma colonnare (liste JSON o base64 binario)"""
+    frame = {"rows": len(batch)}
+    for field in fields:
+        values = [int(r[field]) for r in batch]
+        if result_format == 'binary':
+            frame[f"{_EXPORT_COLUMNS[field]}_b64"] = base64.b64encode(np.array(values, dtype='<i8').tobytes()).decode('ascii')
+        else:
+            frame[_EXPORT_COLUMNS[field]] = values
+
+    if with_vectors:
+        matrix = np.asarray([r["vector"] for r in batch], dtype='<f4')
+        frame["dim"] = int(matrix.shape[1])
+        frame["vectors_b64"] = base64.b64encode(matrix.tobytes()).decode('ascii')
+
+    return frame
+
+def export_tenant(collection_name, tenant_id, fields=("id", "document_id", "chunk_index"), with_vectors=False,
+                  result_format='columnar', batch_size=EXPORT_BATCH_SIZE):
+    """Esporta in streaming le righe di un tenant (memoria costante, il client consuma subito)"""
+    summary = {"tenant_id": tenant_id, "count": 0, "frames": 0}
+
+    def frames():
+        collection, partitions = get_tenant_collection(collection_name, tenant_id)
+        output_fields = list(fields) + (["vector"] if with_vectors else [])
+        for batch in iter_query_batches(collection, f"tenant_id == {tenant_id}", output_fields, batch_size, partitions):
+            summary["count"] += len(batch)
+            summary["frames"] += 1
+            yield encode_rows_frame(batch, fields, with_vectors, result_format)
+
+    return StreamingResult(frames(), summary)
+
+def with_timings(text, timings):
+    """Aggiunge `timings` all'oggetto JSON già serializzato, così il dato comprende anche la serializzazione"""
+    if timings is None or not timings.include:
+        return text
+    return f'{text[:-1]}, "timings": {json.dumps(timings.as_dict())}}}'
+
+def emit_result(write_line, result, extra=None, timings=None):
+    """Scrive un risultato: una riga JSON, oppure i frame di uno StreamingResult più il frame finale"""
+    extra = extra or {}
+    if not isinstance(result, StreamingResult):
+        with timed_phase('serialize'):
+            text = json.dumps({**result, **extra})
+        write_line(with_timings(text, timings))
+        return
+
+    try:
+        for frame in result.frames:
+            with timed_phase('serialize'):
+                text = json.dumps({**frame, **extra})
+            write_line(text)
+        final = {"success": True, "done": True, **result.summary}
+    except Exception as e:
+        final = {"success": False, "done": True, "error": str(e), "error_type": type(e).__name__}
+    write_line(with_timings(json.dumps({**final, **extra}), timings))
+
+def count_by_document(collection_name, tenant_id, document_id, with_chunk_indices=True):
     """Conta i chunk per uno specifico documento"""
     try:
-        connect_milvus()
-        collection = Collection(collection_name)
-        collection.load()
+        collection, partitions = get_tenant_collection(collection_name, tenant_id)
         
         # Query per contare con entrambi i filtri
         expr = f"tenant_id == {tenant_id} && document_id == {document_id}"
-        results = collection.query(
-            expr=expr,
-            output_fields=["id", "chunk_index"],
-            limit=1000
-        )
-        
-        # Estrai chunk_indices per debug
-        chunk_indices = [r.get('chunk_index', -1) for r in results]
-        
-        return {
+        result = {
             "success": True,
-            "count": len(results),
-            "chunk_indices": sorted(chunk_indices),
+            "count": count_entities(collection, expr, partitions),
             "tenant_id": tenant_id,
             "document_id": document_id
         }
         
+        # Estrai chunk_indices per debug (solo campo scalare)
+        if with_chunk_indices:
+            batches = iter_query_batches(collection, expr, ["chunk_index"], partition_names=partitions)
+            result["chunk_indices"] = sorted(r.get('chunk_index', -1) for batch in batches for r in batch)
+        
+        return result
+        
+    except Exception as e:
+        return {
+            "success": False,
+            "error": str(e),
+            "error_type": type(e).__name__
+        }
+
+# ---------------------------------------------------------------------------
+# Compaction manuale: tombstone delle cancellazioni per segmento
+# ---------------------------------------------------------------------------
+
+# Re-scrape, delete_by_ids, delete_by_tenant e pulizia degli zombie lasciano righe cancellate nei segmenti
+# sigillati finché Milvus non li compatta: la ricerca continua a visitarle e a scartarle
+COMPACTION_DELETE_RATIO = float(os.getenv('MILVUS_COMPACTION_DELETE_RATIO', '0.2'))
+COMPACTION_MIN_DELETED = int(os.getenv('MILVUS_COMPACTION_MIN_DELETED', '1000'))
+COMPACTION_POLL_SECONDS = float(os.getenv('MILVUS_COMPACTION_POLL_SECONDS', '2'))
+# Id dell'ultima compaction avviata: l'esecuzione successiva la segue invece di avviarne un'altra
+COMPACTION_PROPERTY = "kb.compaction_id"
+
+_segment_client = None
+
+def persistent_segments(collection_name):
+    """
+    Segmenti persistiti (righe cancellate comprese) dal MilvusClient pubblico.
+
+    None se la versione di pymilvus non espone list_persistent_segments o con
+    Milvus Lite, dove un secondo client avvierebbe un altro server sullo stesso file.
+    """
+    global _segment_client
+    if not hasattr(MilvusClient, 'list_persistent_segments') or (MILVUS_URI and '://' not in MILVUS_URI):
+        return None
+    with _state_lock:
+        if _segment_client is None:
+            scheme = "https" if os.getenv('MILVUS_TLS', 'false').lower() == 'true' else "http"
+            uri = MILVUS_URI or f"{scheme}://{os.getenv('MILVUS_HOST', '127.0.0.1')}:{os.getenv('MILVUS_PORT', '19530')}"
+            _segment_client = MilvusClient(uri=uri, token=os.getenv('MILVUS_TOKEN', '').strip())
+    return _segment_client.list_persistent_segments(collection_name)
+
+def enum_name(enum, value):
+    """Nome di un valore enum del protocollo (il numero se sconosciuto)"""
+    try:
+        return enum.Name(int(value))
+    except (ValueError, TypeError):
+        return str(value)
+
+@contextmanager
+def compaction_lock(collection_name):
+    """Lock di processo per collection: True se acquisito, False se un'altra compaction è in corso"""
+    if fcntl is None:
+        yield True
+        return
+    path = os.path.join(tempfile.gettempdir(), f"milvus_compaction_{collection_name}.lock")
+    with open(path, "a") as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def segment_report(collection, delete_ratio):
+    """
+    Segmenti persistiti con righe, dimensione e quota di righe cancellate.
+
+    Le righe di un segmento persistito comprendono quelle cancellate finché non viene
+    compattato, mentre i query node riportano le righe vive dei segmenti caricati: la
+    differenza sono i tombstone del segmento. I segmenti L0 contengono solo cancellazioni
+    non ancora applicate. Il totale della collection (num_entities contro count(*))
+    resta disponibile anche quando le informazioni per segmento non lo sono.
+    """
+    report = {"rows": int(collection.num_entities)}
+    try:
+        report["live_rows"] = count_entities(collection, "id >= 0", consistency_level="Strong")
+        report["deleted_rows"] = max(0, report["rows"] - report["live_rows"])
+        report["delete_ratio"] = round(report["deleted_rows"] / report["rows"], 4) if report["rows"] else 0.0
+    except Exception as e:
+        # Collection non caricata (es. partizioni per tenant caricate su richiesta)
+        report.update({"live_rows": None, "deleted_rows": None, "delete_ratio": None, "count_error": str(e)})
+
+    try:
+        persistent = persistent_segments(collection.name)
+    except Exception as e:
+        report.update({"segments": None, "segment_info_error": str(e)})
+        return report
+    if persistent is None:
+        report.update({"segments": None, "segment_info": "unsupported",
+                       "segment_info_error": "list_persistent_segments non disponibile (pymilvus o Milvus Lite)"})
+        return report
+    try:
+        loaded = {info.segmentID: info for info in utility.get_query_segment_info(collection.name)}
+    except Exception:
+        loaded = {}
+
+    segments = []
+    for info in persistent:
+        segment = {
+            "id": info.segment_id,
+            "partition_id": info.partition_id,
+            "state": enum_name(common_pb2.SegmentState, info.state),
+            "level": enum_name(common_pb2.SegmentLevel, info.level),
+            "rows": int(info.num_rows),
+        }
+        query_info = loaded.get(info.segment_id)
+        if query_info is not None and segment["level"] != "L0":
+            segment["live_rows"] = min(int(query_info.num_rows), segment["rows"])
+            segment["size_bytes"] = int(query_info.mem_size)
+            segment["delete_ratio"] = round(1 - segment["live_rows"] / segment["rows"], 4) if segment["rows"] else 0.0
+        segments.append(segment)
+
+    report["segments"] = len(segments)
+    report["l0_segments"] = sum(1 for s in segments if s["level"] == "L0")
+    report["pending_delete_rows"] = sum(s["rows"] for s in segments if s["level"] == "L0")
+    report["size_bytes"] = sum(s.get("size_bytes", 0) for s in segments)
+    report["over_threshold"] = [s["id"] for s in segments if s.get("delete_ratio", 0.0) >= delete_ratio > 0]
+    report["segment_details"] = segments
+    return report
+
+def compaction_reasons(report, delete_ratio, min_deleted):
+    """Motivi per cui la compaction serve (lista vuota se non serve)"""
+    reasons = []
+    over = [s for s in report.get("segment_details") or [] if s["id"] in report.get("over_threshold", ())]
+    over_deleted = sum(s["rows"] - s["live_rows"] for s in over)
+    if over and over_deleted >= min_deleted:
+        reasons.append(f"{len(over)} segmenti con delete ratio >= {delete_ratio} ({over_deleted} righe cancellate)")
+    if report.get("delete_ratio") is not None and report["delete_ratio"] >= delete_ratio \
+            and report["deleted_rows"] >= min_deleted:
+        reasons.append(f"delete ratio della collection {report['delete_ratio']} ({report['deleted_rows']} righe cancellate)")
+    if report.get("pending_delete_rows", 0) >= min_deleted:
+        reasons.append(f"{report['pending_delete_rows']} cancellazioni in segmenti L0")
+    return reasons
+
+def compaction_state(collection, compaction_id):
+    """Stato di una compaction, anche avviata da un altro processo"""
+    # get_compaction_state interroga l'id registrato sull'handle da compact()
+    collection.compaction_id = compaction_id
+    return collection.get_compaction_state()
+
+def wait_for_compaction(collection, compaction_id, wait_seconds):
+    """Interroga lo stato della compaction finché non è completata o scade l'attesa"""
+    started = time.monotonic()
+    while True:
+        state = compaction_state(collection, compaction_id)
+        waited = time.monotonic() - started
+        if state.state.name == "Completed" or waited >= wait_seconds:
+            return {
+                "id": compaction_id,
+                "state": state.state.name,
+                "executing_plans": state.in_executing,
+                "completed_plans": state.completed,
+                "timeout_plans": state.in_timeout,
+                "waited_seconds": round(waited, 2),
+            }
+        time.sleep(min(COMPACTION_POLL_SECONDS, wait_seconds - waited))
+
+def compact_collection(collection_name, delete_ratio=None, min_deleted=None, wait_seconds=60.0,
+                       force=False, dry_run=False, flush=True):
+    """
+    Compatta la collection se le righe cancellate superano la soglia.
+
+    Sicura da lanciare da uno scheduler: due esecuzioni sulla stessa collection non si
+    sovrappongono (la seconda ritorna subito) e una compaction avviata da un'esecuzione
+    precedente e ancora in corso viene seguita invece di avviarne un'altra. Se l'attesa
+    scade la compaction prosegue in Milvus e la risposta riporta state "Executing".
+    Il report "after" può mostrare ancora i vecchi segmenti finché i query node non
+    caricano quelli compattati.
+    """
+    delete_ratio = COMPACTION_DELETE_RATIO if delete_ratio is None else float(delete_ratio)
+    min_deleted = COMPACTION_MIN_DELETED if min_deleted is None else int(min_deleted)
+    try:
+        collection = get_collection(collection_name)
+        result = {
+            "success": True,
+            "collection": collection.name,
+            "delete_ratio_threshold": delete_ratio,
+            "min_deleted": min_deleted,
+            "triggered": False,
+            "compaction": None,
+            "after": None,
+        }
+        with compaction_lock(collection.name) as acquired:
+            if not acquired:
+                result["skipped"] = "compaction già in corso in un altro processo"
+                return result
+
+            pending_id = int(collection.describe().get('properties', {}).get(COMPACTION_PROPERTY) or 0)
+            if pending_id:
+                try:
+                    state = compaction_state(collection, pending_id)
+                except Exception:
+                    state = None  # id sconosciuto (es. proprietà copiata da un rebuild)
+                if state is not None and state.state.name == "Executing":
+                    result["before"] = segment_report(collection, delete_ratio)
+                    result["resumed"] = True
+                    if not dry_run:
+                        result["compaction"] = wait_for_compaction(collection, pending_id, wait_seconds)
+                        if result["compaction"]["state"] == "Completed":
+                            result["after"] = segment_report(collection, delete_ratio)
+                    return result
+
+            # Le cancellazioni ancora nel buffer dei segmenti growing non sono compattabili
+            if flush and not dry_run:
+                collection.flush()
+            result["before"] = segment_report(collection, delete_ratio)
+            result["reasons"] = compaction_reasons(result["before"], delete_ratio, min_deleted)
+            if force:
+                result["reasons"].append("forzata")
+            if dry_run or not result["reasons"]:
+                result["dry_run"] = dry_run
+                return result
+
+            collection.compact()
+            compaction_id = collection.compaction_id
+            result["triggered"] = True
+            try:
+                collection.set_properties({COMPACTION_PROPERTY: str(compaction_id)})
+            except Exception as e:
+                result["property_error"] = str(e)
+            result["compaction"] = wait_for_compaction(collection, compaction_id, wait_seconds)
+            if result["compaction"]["state"] == "Completed":
+                result["after"] = segment_report(collection, delete_ratio)
+            return result
+
     except Exception as e:
         return {
             "success": False,
@@ -273,14 +2767,28 @@ def health_check(collection_name):
         # Lista collection
         collections = utility.list_collections()
         
-        collection_exists = collection_name in collections
+        # Il nome configurato può essere un alias (non compare in list_collections)
+        real_name = collection_name
+        if collection_name not in collections:
+            try:
+                real_name = resolve_collection_name(collection_name)
+            except Exception:
+                pass
+        collection_exists = real_name in collections
         collection_info = {}
         
         if collection_exists:
-            collection = Collection(collection_name)
+            collection = get_collection(collection_name)
             collection_info = {
+                "collection_name": real_name,
                 "num_entities": collection.num_entities,
-                "schema": str(collection.schema)
+                "schema": str(collection.schema),
+                "tenant_layout": tenant_layout(collection),
+                "index_type": vector_index_type(collection),
+                "coarse_dim": coarse_field(collection)[0],
+                "sparse": has_sparse_field(collection),
+                "dual_write_target": dual_write_target(collection),
+                "loaded": is_loaded(real_name)
             }
         
         return {
@@ -288,7 +2796,11 @@ def health_check(collection_name):
             "connected": True,
             "collections": collections,
             "collection_exists": collection_exists,
-            "collection_info": collection_info
+            "collection_info": collection_info,
+            "partition_loading": _partition_loader.stats(),
+            "search_cache": _search_cache.counters(None),
+            "local_tier": _local_tier.stats(),
+            "search_batching": _search_batcher.stats()
         }
         
     except Exception as e:
@@ -302,8 +2814,7 @@ def health_check(collection_name):
 def create_partition(collection_name, partition_name):
     """Crea una partizione"""
     try:
-        connect_milvus()
-        collection = Collection(collection_name)
+        collection = get_collection(collection_name)
         
         # Controlla se esiste già
         partitions = [p.name for p in collection.partitions]
@@ -331,8 +2842,7 @@ def create_partition(collection_name, partition_name):
 def has_partition(collection_name, partition_name):
     """Verifica se una partizione esiste"""
     try:
-        connect_milvus()
-        collection = Collection(collection_name)
+        collection = get_collection(collection_name)
         
         partitions = [p.name for p in collection.partitions]
         exists = partition_name in partitions
@@ -350,10 +2860,624 @@ def has_partition(collection_name, partition_name):
             "error_type": type(e).__name__
         }
 
+def dispatch(params):
+    """Valida i parametri ed esegue l'operazione richiesta, ritornando il risultato"""
+    operation = params.get('operation', 'search')
+    collection_name = params.get('collection', 'kb_chunks_v1')
+
+    dim = int(params.get('dim', 0)) or None
+    flush = None
+    if operation in WRITE_OPERATIONS:
+        flush = params.get('flush') or _default_flush_mode
+        if flush not in FLUSH_MODES:
+            raise InvalidParams(f"flush must be one of {', '.join(FLUSH_MODES)}")
+    result_format = params.get('result_format', 'json')
+    if result_format not in RESULT_FORMATS:
+        raise InvalidParams(f"result_format must be one of {', '.join(RESULT_FORMATS)}")
+
+    if operation == 'search':
+        query_vector = decode_vectors(params, 'query_vector', single=True)
+        tenant_id = int(params.get('tenant_id', 0))
+        limit = int(params.get('limit', 10))
+
+        if query_vector is None:
+            raise InvalidParams("query_vector is required")
+        if tenant_id <= 0:
+            raise InvalidParams("valid tenant_id is required")
+
+        group_by = params.get('group_by') or None
+        if group_by is not None and group_by not in GROUP_BY_FIELDS:
+            raise InvalidParams(f"group_by must be one of {', '.join(GROUP_BY_FIELDS)}")
+        group_size = int(params.get('group_size', 1))
+        if group_size <= 0:
+            raise InvalidParams("group_size must be positive")
+        document_ids = params.get('document_ids')
+        exclude_document_ids = params.get('exclude_document_ids')
+        if not isinstance(document_ids, (list, type(None))) or not isinstance(exclude_document_ids, (list, type(None))):
+            raise InvalidParams("document_ids and exclude_document_ids must be lists of document ids")
+        min_score = params.get('min_score')
+        output_fields = params.get('output_fields') or []
+        unknown = [f for f in output_fields if f not in SEARCH_OUTPUT_FIELDS]
+        if unknown:
+            raise InvalidParams(f"output_fields must be among {', '.join(SEARCH_OUTPUT_FIELDS)}")
+
+        two_stage = params.get('two_stage')
+        return search_vectors(collection_name, query_vector[0], tenant_id, limit, result_format,
+                              use_cache=params.get('cache', True) is not False,
+                              two_stage=None if two_stage is None else bool(two_stage),
+                              oversample=int(params.get('oversample', TWO_STAGE_OVERSAMPLE)),
+                              min_score=None if min_score is None else float(min_score),
+                              group_by=group_by, group_size=group_size,
+                              document_ids=None if document_ids is None else [int(d) for d in document_ids],
+                              exclude_document_ids=[int(d) for d in exclude_document_ids or []],
+                              output_fields=output_fields)
+
+    elif operation == 'search_batch':
+        query_vectors = decode_vectors(params, 'query_vectors', dim)
+        tenant_id = int(params.get('tenant_id', 0))
+
+        if query_vectors is None:
+            raise InvalidParams("query_vectors is required")
+        if tenant_id <= 0:
+            raise InvalidParams("valid tenant_id is required")
+
+        # `limits` (uno per query) ha precedenza su `limit` (uguale per tutte)
+        limits = params.get('limits')
+        if limits is None:
+            limits = [int(params.get('limit', 10))] * len(query_vectors)
+        limits = [int(l) for l in limits]
+        if len(limits) != len(query_vectors) or min(limits) <= 0:
+            raise InvalidParams("limits must contain a positive limit for each query vector")
+
+        fused_limit = params.get('fused_limit')
+        return search_batch(
+            collection_name, query_vectors, tenant_id, limits,
+            fuse=bool(params.get('fuse', False)),
+            rrf_k=int(params.get('rrf_k', 60)),
+            fused_limit=int(fused_limit) if fused_limit else None,
+            result_format=result_format,
+        )
+
+    elif operation == 'hybrid_search':
+        query_vector = decode_vectors(params, 'query_vector', single=True)
+        tenant_id = int(params.get('tenant_id', 0))
+        limit = int(params.get('limit', 10))
+        ranker = params.get('ranker', 'rrf')
+
+        if query_vector is None:
+            raise InvalidParams("query_vector is required")
+        if tenant_id <= 0:
+            raise InvalidParams("valid tenant_id is required")
+        if ranker not in HYBRID_RANKERS:
+            raise InvalidParams(f"ranker must be one of {', '.join(HYBRID_RANKERS)}")
+        if params.get('query_sparse') is None and not params.get('query_text'):
+            raise InvalidParams("query_sparse or query_text is required")
+
+        weights = params.get('weights', [0.5, 0.5])
+        if len(weights) != 2:
+            raise InvalidParams("weights must contain the dense and the sparse weight")
+        query_sparse = params.get('query_sparse')
+        candidates = params.get('candidates')
+        return hybrid_search(
+            collection_name, query_vector[0], tenant_id, limit,
+            query_sparse=decode_sparse([query_sparse])[0] if query_sparse is not None else None,
+            query_text=params.get('query_text'),
+            ranker=ranker,
+            rrf_k=int(params.get('rrf_k', 60)),
+            weights=[float(w) for w in weights],
+            candidates=int(candidates) if candidates else None,
+            result_format=result_format,
+        )
+
+    elif operation == 'search_mmr':
+        query_vector = decode_vectors(params, 'query_vector', single=True)
+        tenant_id = int(params.get('tenant_id', 0))
+        k = int(params.get('k', params.get('limit', 8)))
+        mmr_lambda = float(params.get('mmr_lambda', params.get('lambda', 0.5)))
+
+        if query_vector is None:
+            raise InvalidParams("query_vector is required")
+        if tenant_id <= 0:
+            raise InvalidParams("valid tenant_id is required")
+        if k <= 0:
+            raise InvalidParams("k must be positive")
+        if not 0.0 <= mmr_lambda <= 1.0:
+            raise InvalidParams("mmr_lambda must be between 0 and 1")
+
+        candidate_ids = params.get('candidate_ids')
+        fetch_k = params.get('fetch_k')
+        return search_mmr(
+            collection_name, query_vector[0], tenant_id, k, mmr_lambda,
+            candidate_ids=[int(i) for i in candidate_ids] if candidate_ids is not None else None,
+            fetch_k=int(fetch_k) if fetch_k else None,
+            result_format=result_format,
+        )
+
+    elif operation == 'upsert':
+        tenant_id = int(params.get('tenant_id', 0))
+        document_id = int(params.get('document_id', 0))
+        vectors = decode_vectors(params, 'vectors', dim)
+
+        if tenant_id <= 0 or document_id <= 0:
+            raise InvalidParams("valid tenant_id and document_id required")
+        if vectors is None:
+            raise InvalidParams("vectors is required")
+
+        sparse_vectors = params.get('sparse_vectors')
+        result = upsert_vectors(collection_name, tenant_id, document_id, vectors, chunks=params.get('chunks'), flush=flush,
+                                sparse_vectors=decode_sparse(sparse_vectors) if sparse_vectors is not None else None,
+                                metadata=decode_metadata(params))
+        _search_cache.invalidate(collection_name, tenant_id)
+        if result.get("success") and _local_tier.enabled:
+            _local_tier.apply_documents(collection_name, tenant_id, {document_id: vectors})
+        return result
+
+    elif operation == 'sync_document':
+        tenant_id = int(params.get('tenant_id', 0))
+        document_id = int(params.get('document_id', 0))
+        vectors = decode_vectors(params, 'vectors', dim)
+
+        if tenant_id <= 0 or document_id <= 0:
+            raise InvalidParams("valid tenant_id and document_id required")
+        if vectors is None:
+            raise InvalidParams("vectors is required")
+
+        # Hash calcolati dal client oppure dal testo dei chunk
+        chunk_hashes = params.get('chunk_hashes')
+        if not chunk_hashes and params.get('chunks'):
+            chunk_hashes = chunk_content_hashes(params['chunks'])
+
+        sparse_vectors = params.get('sparse_vectors')
+        result = sync_document(collection_name, tenant_id, document_id, vectors, chunk_hashes, flush=flush,
+                               chunks=params.get('chunks'),
+                               sparse_vectors=decode_sparse(sparse_vectors) if sparse_vectors is not None else None,
+                               metadata=decode_metadata(params))
+        _search_cache.invalidate(collection_name, tenant_id)
+        if result.get("success") and _local_tier.enabled:
+            # Dopo la sync il documento è esattamente `vectors` (chunk in eccesso eliminati)
+            _local_tier.apply_documents(collection_name, tenant_id, {document_id: vectors})
+        return result
+
+    elif operation == 'bulk_upsert':
+        documents = params.get('documents', [])
+
+        if not documents:
+            raise InvalidParams("documents is required")
+
+        result = bulk_upsert(
+            collection_name, documents,
+            max_batch_rows=int(params.get('max_batch_rows', INSERT_BATCH_ROWS)),
+            max_batch_bytes=int(params.get('max_batch_bytes', INSERT_BATCH_BYTES)),
+            flush=flush,
+        )
+        for tenant_id in {int(doc.get('tenant_id', 0)) for doc in documents}:
+            _search_cache.invalidate(collection_name, tenant_id)
+        if result.get("success") and _local_tier.enabled:
+            inserted = {d["document_id"] for d in result["documents"] if d["success"]}
+            by_tenant = {}
+            for doc in documents:
+                if int(doc.get('document_id', 0)) in inserted:
+                    by_tenant.setdefault(int(doc['tenant_id']), {})[int(doc['document_id'])] = \
+                        decode_vectors(doc, 'vectors', int(doc.get('dim', 0)) or None)
+            for tenant_id, tenant_documents in by_tenant.items():
+                _local_tier.apply_documents(collection_name, tenant_id, tenant_documents)
+        return result
+
+    elif operation == 'delete_by_ids':
+        primary_ids = params.get('primary_ids', [])
+
+        if not primary_ids:
+            raise InvalidParams("primary_ids is required")
+
+        result = delete_by_primary_ids(collection_name, primary_ids, flush=flush)
+        # Senza tenant_id non si sa a chi appartengono gli ID: si invalida tutta la collection
+        tenant_id = int(params['tenant_id']) if params.get('tenant_id') else None
+        _search_cache.invalidate(collection_name, tenant_id)
+        if result.get("success") and _local_tier.enabled:
+            _local_tier.remove_ids(collection_name, [int(i) for i in primary_ids], tenant_id)
+        return result
+
+    elif operation == 'delete_by_tenant':
+        tenant_id = int(params.get('tenant_id', 0))
+
+        if tenant_id <= 0:
+            raise InvalidParams("valid tenant_id is required")
+
+        result = delete_by_tenant(collection_name, tenant_id, flush=flush)
+        _search_cache.invalidate(collection_name, tenant_id)
+        if result.get("success") and _local_tier.enabled:
+            _local_tier.drop_tenant(collection_name, tenant_id)
+        return result
+
+    elif operation == 'count_by_tenant':
+        tenant_id = int(params.get('tenant_id', 0))
+
+        if tenant_id <= 0:
+            raise InvalidParams("valid tenant_id is required")
+
+        return count_by_tenant(collection_name, tenant_id)
+
+    elif operation == 'stats_by_tenant':
+        tenant_id = int(params.get('tenant_id', 0))
+
+        if tenant_id <= 0:
+            raise InvalidParams("valid tenant_id is required")
+
+        return stats_by_tenant(collection_name, tenant_id)
+
+    elif operation == 'list_ids_by_tenant':
+        tenant_id = int(params.get('tenant_id', 0))
+
+        if tenant_id <= 0:
+            raise InvalidParams("valid tenant_id is required")
+
+        if params.get('stream'):
+            return export_tenant(collection_name, tenant_id, fields=("id",), result_format=result_format,
+                                 batch_size=int(params.get('batch_size', EXPORT_BATCH_SIZE)))
+        return list_ids_by_tenant(collection_name, tenant_id)
+
+    elif operation == 'export_tenant':
+        tenant_id = int(params.get('tenant_id', 0))
+
+        if tenant_id <= 0:
+            raise InvalidParams("valid tenant_id is required")
+
+        return export_tenant(
+            collection_name, tenant_id,
+            with_vectors=bool(params.get('with_vectors', False)),
+            result_format='binary' if result_format == 'binary' else 'columnar',
+            batch_size=int(params.get('batch_size', EXPORT_BATCH_SIZE)),
+        )
+
+    elif operation == 'count_by_document':
+        tenant_id = int(params.get('tenant_id', 0))
+        document_id = int(params.get('document_id', 0))
+
+        if tenant_id <= 0 or document_id <= 0:
+            raise InvalidParams("valid tenant_id and document_id required")
+
+        return count_by_document(collection_name, tenant_id, document_id,
+                                 with_chunk_indices=bool(params.get('with_chunk_indices', True)))
+
+    elif operation == 'health':
+        return health_check(collection_name)
+
+    elif operation == 'local_tier_refresh':
+        tenant_id = int(params.get('tenant_id', 0))
+
+        if tenant_id <= 0:
+            raise InvalidParams("valid tenant_id is required")
+        if not _local_tier.enabled:
+            return {"success": False, "error": "local tier is disabled (MILVUS_LOCAL_TIER_DIR)"}
+
+        rows = _local_tier.build(collection_name, tenant_id)
+        return {"success": True, "tenant_id": tenant_id, "local": rows is not None, "rows": rows,
+                "max_rows": _local_tier.max_rows}
+
+    elif operation == 'compaction':
+        return compact_collection(
+            collection_name,
+            delete_ratio=params.get('delete_ratio'),
+            min_deleted=params.get('min_deleted'),
+            wait_seconds=float(params.get('wait_seconds', 60)),
+            force=bool_param(params, 'force', False),
+            dry_run=bool_param(params, 'dry_run', False),
+            flush=bool_param(params, 'flush_before', True),
+        )
+
+    elif operation == 'metrics':
+        if _metrics is None:
+            return {"success": False, "error": "metrics are only collected by the persistent worker (--serve)"}
+        return {"success": True, "content_type": OPENMETRICS_CONTENT_TYPE, "metrics": _metrics.render()}
+
+    elif operation == 'create_partition':
+        partition_name = params.get('partition_name', '')
+
+        if not partition_name:
+            raise InvalidParams("partition_name is required")
+
+        return create_partition(collection_name, partition_name)
+
+    elif operation == 'has_partition':
+        partition_name = params.get('partition_name', '')
+
+        if not partition_name:
+            raise InvalidParams("partition_name is required")
+
+        return has_partition(collection_name, partition_name)
+
+    raise InvalidParams(f"Unknown operation: {operation}")
+
+# ---------------------------------------------------------------------------
+# Worker persistente (NDJSON su stdin/stdout o Unix domain socket)
+# ---------------------------------------------------------------------------
+
+# Operazioni senza effetti collaterali: possono essere ripetute dopo una riconnessione
+READ_OPERATIONS = {
+    'search', 'search_batch', 'hybrid_search', 'search_mmr', 'count_by_tenant', 'stats_by_tenant',
+    'list_ids_by_tenant', 'export_tenant', 'count_by_document', 'health', 'has_partition',
+}
+
+def connection_alive():
+    """Verifica che la connessione a Milvus risponda"""
+    try:
+        if not connections.has_connection("default"):
+            return False
+        utility.get_server_version()
+        return True
+    except Exception:
+        return False
+
+def handle_request(params):
+    """Esegue una richiesta nel worker gestendo riconnessione e retry delle letture"""
+    try:
+        result = dispatch(params)
+    except InvalidParams as e:
+        return {"success": False, "error": str(e)}
+    except Exception as e:
+        result = {"success": False, "error": str(e), "error_type": type(e).__name__}
+
+    # Gli stream riportano gli errori nel frame finale
+    if isinstance(result, StreamingResult) or result.get("success"):
+        return result
+
+    # L'handle potrebbe essere stato rilasciato o la connessione persa
+    invalidate_collection(params.get('collection', 'kb_chunks_v1'))
+    if connection_alive():
+        # Collection o partizione rilasciata da fuori: la lettura si ripete dopo un nuovo load
+        if 'not loaded' in str(result.get("error", "")).lower() and params.get('operation', 'search') in READ_OPERATIONS:
+            try:
+                result = dispatch(params)
+            except Exception as e:
+                result = {"success": False, "error": str(e), "error_type": type(e).__name__}
+        return result
+
+    reset_connection()
+    if params.get('operation', 'search') not in READ_OPERATIONS:
+        # Le scritture non vengono ripetute: l'insert potrebbe essere già avvenuto
+        result["reconnected"] = True
+        return result
+
+    try:
+        result = dispatch(params)
+    except Exception as e:
+        result = {"success": False, "error": str(e), "error_type": type(e).__name__}
+    result["reconnected"] = True
+    return result
+
+def process_line(line, write_line):
+    """Decodifica una riga NDJSON, scrive la risposta e ritorna True se il client ha chiesto lo shutdown"""
+    try:
+        params = json.loads(line)
+    except json.JSONDecodeError as e:
+        write_line(json.dumps({"success": False, "error": f"Invalid JSON: {e}"}))
+        return False
+
+    if not isinstance(params, dict):
+        write_line(json.dumps({"success": False, "error": "Request must be a JSON object"}))
+        return False
+
+    shutdown = params.get('operation') == 'shutdown'
+    timings = begin_timings(params)
+    try:
+        if shutdown:
+            result = {"success": True, "shutdown": True}
+        else:
+            result = handle_request(params)
+
+        # Permette al client di correlare richieste e risposte (anche su ogni frame degli stream)
+        extra = {"request_id": params['request_id']} if 'request_id' in params else None
+        emit_result(write_line, result, extra, timings)
+    finally:
+        end_timings(timings)
+    return shutdown
+
+def serve_stdio():
+    """Worker persistente: una richiesta JSON per riga su stdin, una risposta per riga su stdout"""
+    def write_line(text):
+        sys.stdout.write(text + "\n")
+        sys.stdout.flush()
+
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+
+        if process_line(line, write_line):
+            break
+
+class _WorkerRequestHandler(socketserver.StreamRequestHandler):
+    """Gestisce una connessione client: più richieste NDJSON sulla stessa connessione"""
+
+    def write_line(self, text):
+        self.wfile.write((text + "\n").encode('utf-8'))
+        self.wfile.flush()
+
+    def handle(self):
+        for raw in self.rfile:
+            line = raw.decode('utf-8').strip()
+            if not line:
+                continue
+
+            if process_line(line, self.write_line):
+                # shutdown() blocca finché serve_forever non termina: va chiamato da un altro thread
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+                return
+
+# Connessioni in attesa di accept: con il default di socketserver (5) i client concorrenti in eccesso
+# ricevono EAGAIN e ripiegano sul processo one-shot
+WORKER_BACKLOG = int(os.getenv('MILVUS_WORKER_BACKLOG', '256'))
+
+if hasattr(socketserver, 'UnixStreamServer'):
+    class _WorkerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+        request_queue_size = WORKER_BACKLOG
+else:
+    # Windows: nessun AF_UNIX, resta disponibile la modalità stdin/stdout
+    _WorkerServer = None
+
+def prepare_socket_path(socket_path):
+    """Rimuove un socket orfano lasciato da un worker terminato male"""
+    if not os.path.exists(socket_path):
+        return
+
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except OSError:
+        os.unlink(socket_path)
+        return
+    finally:
+        probe.close()
+
+    raise SystemExit(f"Worker già in ascolto su {socket_path}")
+
+def serve_socket(socket_path, socket_mode=0o660, backlog=WORKER_BACKLOG):
+    """Worker persistente in ascolto su Unix domain socket"""
+    if _WorkerServer is None:
+        raise SystemExit("Unix domain socket non supportati su questa piattaforma: usare --serve senza --socket")
+
+    prepare_socket_path(socket_path)
+    server = _WorkerServer(socket_path, _WorkerRequestHandler, bind_and_activate=False)
+    server.request_queue_size = backlog
+    try:
+        server.server_bind()
+        server.server_activate()
+    except BaseException:
+        server.server_close()
+        raise
+    os.chmod(socket_path, socket_mode)
+
+    def _stop(signum, frame):
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    print(f"milvus worker in ascolto su {socket_path}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+def serve_metrics(port):
+    """Espone gli istogrammi su http://127.0.0.1:<port>/metrics (thread in background)"""
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?', 1)[0] != '/metrics':
+                self.send_error(404)
+                return
+            body = _metrics.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', OPENMETRICS_CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def serve(argv):
+    """Entry point della modalità worker (--serve)"""
+    import argparse
+
+    parser = argparse.ArgumentParser(prog="milvus_search.py --serve")
+    parser.add_argument("--socket", default=os.getenv("MILVUS_WORKER_SOCKET", ""),
+                        help="Path del Unix domain socket (default: NDJSON su stdin/stdout)")
+    parser.add_argument("--socket-mode", default="660",
+                        help="Permessi ottali del socket (default: 660)")
+    parser.add_argument("--preload", action="append", default=[],
+                        help="Collection da caricare all'avvio (ripetibile)")
+    parser.add_argument("--flush-policy", choices=["per-call", "coalesce"],
+                        default=os.getenv("MILVUS_FLUSH_POLICY", "per-call"),
+                        help="coalesce: un flush ogni --flush-max-rows righe o --flush-max-delay secondi")
+    parser.add_argument("--flush-max-rows", type=int, default=int(os.getenv("MILVUS_FLUSH_MAX_ROWS", "10000")))
+    parser.add_argument("--flush-max-delay", type=float, default=float(os.getenv("MILVUS_FLUSH_MAX_DELAY", "5")))
+    parser.add_argument("--prewarm-tenants", default=os.getenv("MILVUS_PREWARM_TENANTS", ""),
+                        help="Tenant da caricare all'avvio, separati da virgola (es. i più attivi)")
+    parser.add_argument("--prewarm-collection", default=os.getenv("MILVUS_COLLECTION", "kb_chunks_v1"))
+    parser.add_argument("--metrics-port", type=int, default=int(os.getenv("MILVUS_METRICS_PORT", "0")),
+                        help="Porta HTTP (su 127.0.0.1) per /metrics in formato OpenMetrics (default: disattivata)")
+    parser.add_argument("--batch-window-ms", type=float, default=float(os.getenv("MILVUS_BATCH_WINDOW_MS", "0")),
+                        help="Finestra di micro-batching delle search concorrenti, solo con --socket (es. 2-5; 0 = disattivato)")
+    parser.add_argument("--batch-max-size", type=int, default=int(os.getenv("MILVUS_BATCH_MAX_SIZE", "16")),
+                        help="Numero massimo di query per search accorpata")
+    parser.add_argument("--backlog", type=int, default=WORKER_BACKLOG,
+                        help="Connessioni in attesa sul socket (default: MILVUS_WORKER_BACKLOG)")
+    args = parser.parse_args(argv)
+
+    global _flush_coalescer, _default_flush_mode, _metrics
+    _metrics = PhaseHistograms()
+    if args.metrics_port:
+        serve_metrics(args.metrics_port)
+
+    if args.flush_policy == "coalesce":
+        _flush_coalescer = FlushCoalescer(args.flush_max_rows, args.flush_max_delay)
+        _flush_coalescer.start()
+        # Le scritture senza `flush` esplicito vengono accorpate
+        _default_flush_mode = 'coalesce'
+
+    # Nel worker le copie locali dei tenant piccoli si costruiscono in background alla prima ricerca
+    _local_tier.background_builds = _local_tier.enabled
+
+    if args.socket and args.batch_window_ms > 0:
+        # Su stdin/stdout le richieste sono sequenziali: non ci sarebbe nulla da accorpare
+        _search_batcher.window = args.batch_window_ms / 1000
+        _search_batcher.max_batch = args.batch_max_size
+        # Un batch si riempie solo se i client concorrenti riescono a connettersi:
+        # spazio in coda per diversi batch completi
+        args.backlog = max(args.backlog, 8 * args.batch_max_size)
+
+    for collection_name in args.preload:
+        try:
+            get_collection(collection_name, load=True)
+        except Exception as e:
+            print(f"preload {collection_name} fallito: {e}", file=sys.stderr)
+
+    for tenant in filter(None, (t.strip() for t in args.prewarm_tenants.split(","))):
+        try:
+            get_tenant_collection(args.prewarm_collection, int(tenant))
+        except Exception as e:
+            print(f"prewarm tenant {tenant} fallito: {e}", file=sys.stderr)
+
+    if _partition_loader.idle_seconds:
+        # Rilascia periodicamente le partizioni dei tenant inattivi
+        def release_idle_loop():
+            while True:
+                time.sleep(max(1.0, _partition_loader.idle_seconds / 4))
+                _partition_loader.release_idle()
+
+        threading.Thread(target=release_idle_loop, daemon=True).start()
+
+    try:
+        if args.socket:
+            serve_socket(args.socket, int(args.socket_mode, 8), args.backlog)
+        else:
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+            serve_stdio()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if _flush_coalescer is not None:
+            _flush_coalescer.stop()
+        reset_connection()
+
 def main():
     """Main entry point - gestisce tutte le operazioni Milvus"""
+    if len(sys.argv) >= 2 and sys.argv[1] == '--serve':
+        serve(sys.argv[2:])
+        return
+
     if len(sys.argv) != 2:
-        print(json.dumps({"success": False, "error": "Usage: python milvus_search.py '<json_params>'"}))
+        print(json.dumps({"success": False, "error": "Usage: python milvus_search.py '<json_params>' | --serve [--socket PATH]"}))
         sys.exit(1)
     
     try:
@@ -369,110 +3493,16 @@ def main():
             # Legacy: leggi direttamente da parametro
             params = json.loads(param_str)
         
-        operation = params.get('operation', 'search')
-        collection_name = params.get('collection', 'kb_chunks_v1')
-        
-        if operation == 'search':
-            query_vector = params.get('query_vector', [])
-            tenant_id = int(params.get('tenant_id', 0))
-            limit = int(params.get('limit', 10))
-            
-            if not query_vector:
-                print(json.dumps({"success": False, "error": "query_vector is required"}))
-                sys.exit(1)
-            if tenant_id <= 0:
-                print(json.dumps({"success": False, "error": "valid tenant_id is required"}))
-                sys.exit(1)
-            
-            result = search_vectors(collection_name, query_vector, tenant_id, limit)
-            
-        elif operation == 'upsert':
-            tenant_id = int(params.get('tenant_id', 0))
-            document_id = int(params.get('document_id', 0))
-            vectors = params.get('vectors', [])
-            
-            if tenant_id <= 0 or document_id <= 0:
-                print(json.dumps({"success": False, "error": "valid tenant_id and document_id required"}))
-                sys.exit(1)
-            if not vectors:
-                print(json.dumps({"success": False, "error": "vectors is required"}))
-                sys.exit(1)
-            
-            result = upsert_vectors(collection_name, tenant_id, document_id, vectors)
-            
-        elif operation == 'delete_by_ids':
-            primary_ids = params.get('primary_ids', [])
-            
-            if not primary_ids:
-                print(json.dumps({"success": False, "error": "primary_ids is required"}))
-                sys.exit(1)
-            
-            result = delete_by_primary_ids(collection_name, primary_ids)
-            
-        elif operation == 'delete_by_tenant':
-            tenant_id = int(params.get('tenant_id', 0))
-            
-            if tenant_id <= 0:
-                print(json.dumps({"success": False, "error": "valid tenant_id is required"}))
-                sys.exit(1)
-            
-            result = delete_by_tenant(collection_name, tenant_id)
-            
-        elif operation == 'count_by_tenant':
-            tenant_id = int(params.get('tenant_id', 0))
-            
-            if tenant_id <= 0:
-                print(json.dumps({"success": False, "error": "valid tenant_id is required"}))
-                sys.exit(1)
-            
-            result = count_by_tenant(collection_name, tenant_id)
-            
-        elif operation == 'list_ids_by_tenant':
-            tenant_id = int(params.get('tenant_id', 0))
-            
-            if tenant_id <= 0:
-                print(json.dumps({"success": False, "error": "valid tenant_id is required"}))
-                sys.exit(1)
-            
-            result = list_ids_by_tenant(collection_name, tenant_id)
-            
-        elif operation == 'count_by_document':
-            tenant_id = int(params.get('tenant_id', 0))
-            document_id = int(params.get('document_id', 0))
-            
-            if tenant_id <= 0 or document_id <= 0:
-                print(json.dumps({"success": False, "error": "valid tenant_id and document_id required"}))
-                sys.exit(1)
-            
-            result = count_by_document(collection_name, tenant_id, document_id)
-            
-        elif operation == 'health':
-            result = health_check(collection_name)
-            
-        elif operation == 'create_partition':
-            partition_name = params.get('partition_name', '')
-            
-            if not partition_name:
-                print(json.dumps({"success": False, "error": "partition_name is required"}))
-                sys.exit(1)
-            
-            result = create_partition(collection_name, partition_name)
-            
-        elif operation == 'has_partition':
-            partition_name = params.get('partition_name', '')
-            
-            if not partition_name:
-                print(json.dumps({"success": False, "error": "partition_name is required"}))
-                sys.exit(1)
-            
-            result = has_partition(collection_name, partition_name)
-            
-        else:
-            print(json.dumps({"success": False, "error": f"Unknown operation: {operation}"}))
-            sys.exit(1)
-        
-        print(json.dumps(result))
+        timings = begin_timings(params, one_shot=True)
+        try:
+            result = dispatch(params)
+            emit_result(lambda text: print(text, flush=True), result, timings=timings)
+        finally:
+            end_timings(timings)
         
+    except InvalidParams as e:
+        print(json.dumps({"success": False, "error": str(e)}))
+        sys.exit(1)
     except json.JSONDecodeError as e:
         print(json.dumps({"success": False, "error": f"Invalid JSON: {e}"}))
         sys.exit(1)
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+Ricostruzione dell'indice senza downtime tramite alias Milvus.
+
+Il client (MILVUS_COLLECTION) usa un alias, es. `kb_chunks`, che punta alla
+collection reale. Il rebuild:
+1. crea una collection ombra con lo stesso schema, partizioni e proprietà kb.*
+2. costruisce il nuovo indice (HNSW, HNSW_SQ, HNSW_PQ, IVF_SQ8, IVF_PQ, DISKANN)
+3. copia i dati con il query iterator, partizione per partizione
+4. verifica i conteggi, carica la collection ombra e sposta l'alias (atomico)
+5. dopo un periodo di grazia rilascia (o elimina, con --drop-old) la vecchia
+
+Le letture non si fermano mai: i worker risolvono di nuovo l'alias ogni
+MILVUS_ALIAS_REFRESH secondi. Durante la copia la vecchia collection ha il
+dual-write (kb.dual_write_target) verso quella ombra, così le scritture
+arrivate nel frattempo non vanno perse; se i conteggi non coincidono l'alias
+non viene spostato (a meno di --force) e la collection ombra resta per un
+nuovo tentativo.
+
+Primo utilizzo su una collection senza alias:
+    python rebuild_milvus_index.py --alias kb_chunks --source kb_chunks_v1 --index-type HNSW
+poi impostare MILVUS_COLLECTION=kb_chunks. Finché i client scrivono sul nome
+reale il dual-write resta attivo: dopo il cambio di MILVUS_COLLECTION si ritira
+la vecchia collection con
+    python recreate_milvus_collection.py retire_source kb_chunks_v1
+
+Il risultato è un oggetto JSON su stdout; l'avanzamento va su stderr.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import warnings
+
+# milvus_search va importato prima di pymilvus (gestisce MILVUS_URI con un file di Milvus Lite)
+import milvus_search
+from milvus_search import DUAL_WRITE_PROPERTY, connect_milvus, count_entities, iter_query_batches
+from pymilvus import Collection, utility
+from create_milvus_collection import INDEX_TYPES, create_optional_indexes, parse_index_params, vector_index_params
+
+warnings.filterwarnings("ignore", category=UserWarning)
+
+def log(message):
+    print(message, file=sys.stderr)
+
+def alias_target(alias):
+    """Collection puntata dall'alias, None se l'alias non esiste"""
+    try:
+        name = Collection(alias).describe().get('collection_name')
+    except Exception:
+        return None
+    return name if name and name != alias else None
+
+def create_shadow(source, shadow_name, index_params):
+    """Collection vuota con schema, partizioni e proprietà kb.* della sorgente"""
+    info = source.describe()
+    extra = {}
+    if any(getattr(f, 'is_partition_key', False) for f in source.schema.fields):
+        extra["num_partitions"] = int(info.get('num_partitions') or 64)
+    shadow = Collection(name=shadow_name, schema=source.schema, shards_num=int(info.get('shards_num') or 2), **extra)
+
+    # Layout dei tenant ed ef tarati seguono i dati (il dual-write no: riguarda la sorgente)
+    properties = {k: v for k, v in (info.get('properties') or {}).items()
+                  if k.startswith('kb.') and k != DUAL_WRITE_PROPERTY}
+    if properties:
+        shadow.set_properties(properties)
+
+    if not extra:
+        for partition in source.partitions:
+            if not shadow.has_partition(partition.name):
+                shadow.create_partition(partition.name)
+
+    shadow.create_index(field_name="vector", index_params=index_params)
+    create_optional_indexes(shadow, index_params["metric_type"])
+    return shadow
+
+def copy_rows(source, shadow, batch_size):
+    """
+    Copia tutte le righe (campi dinamici compresi) mantenendo la partizione di ciascuna.
+
+    Le righe già presenti nella collection ombra arrivano dal dual-write e sono
+    più recenti di quelle lette dalla sorgente: non vengono sovrascritte.
+    """
+    with_partition_key = any(getattr(f, 'is_partition_key', False) for f in source.schema.fields)
+    # Con il partition key Milvus instrada da solo: una sola passata sull'intera collection
+    partitions = [None] if with_partition_key else [p.name for p in source.partitions]
+
+    copied = 0
+    started = time.perf_counter()
+    for partition in partitions:
+        partition_names = [partition] if partition else None
+        for batch in iter_query_batches(source, "id >= 0", ["*"], batch_size, partition_names):
+            ids = [row["id"] for row in batch]
+            existing = {row["id"] for row in shadow.query(expr=f"id in {ids}", output_fields=["id"],
+                                                          consistency_level="Strong")}
+            missing = [row for row in batch if row["id"] not in existing]
+            if missing:
+                shadow.insert(missing, partition_name=partition)
+            copied += len(batch)
+            if copied % (batch_size * 10) < len(batch):
+                log(f"  copiate {copied} righe ({copied / (time.perf_counter() - started):.0f}/s)")
+    shadow.flush()
+    return copied
+
+def rebuild(args):
+    connect_milvus()
+
+    current = alias_target(args.alias)
+    source_name = args.source or current
+    if not source_name:
+        return {"success": False, "error": f"L'alias {args.alias} non esiste: indicare la collection con --source"}
+    if current is None and utility.has_collection(args.alias):
+        return {"success": False, "error": f"{args.alias} è una collection, non un alias: usare un nome di alias diverso "
+                                           f"(--alias) e impostarlo in MILVUS_COLLECTION"}
+    if not utility.has_collection(source_name):
+        return {"success": False, "error": f"Collection sorgente non trovata: {source_name}"}
+
+    source = Collection(source_name)
+    metric = next((i.params.get('metric_type', 'COSINE') for i in source.indexes if i.field_name == 'vector'), 'COSINE')
+    index_params = vector_index_params(args.index_type, metric, parse_index_params(args.index_param))
+    shadow_name = args.shadow or f"{args.alias}_{args.index_type.lower()}_{time.strftime('%Y%m%d%H%M%S')}"
+    result = {
+        "success": True,
+        "alias": args.alias,
+        "previous_collection": source_name,
+        "new_collection": shadow_name,
+        "index_params": index_params,
+        "switched": False,
+    }
+
+    if args.dry_run:
+        result["dry_run"] = True
+        return result
+
+    if utility.has_collection(shadow_name):
+        return {"success": False, "error": f"La collection {shadow_name} esiste già"}
+
+    log(f"collection ombra {shadow_name} ({args.index_type}) da {source_name}")
+    source.load()
+    shadow = create_shadow(source, shadow_name, index_params)
+
+    # Dual-write verso l'ombra: i worker lo vedono entro MILVUS_ALIAS_REFRESH secondi, poi parte la copia
+    source.set_properties({DUAL_WRITE_PROPERTY: shadow_name})
+    log(f"dual-write verso {shadow_name}, attesa di {milvus_search.ALIAS_REFRESH_SECONDS}s per i worker")
+    time.sleep(milvus_search.ALIAS_REFRESH_SECONDS)
+
+    try:
+        started = time.perf_counter()
+        result["copied_rows"] = copy_rows(source, shadow, args.batch_size)
+        result["copy_seconds"] = round(time.perf_counter() - started, 2)
+
+        log("attesa costruzione indice e load")
+        started = time.perf_counter()
+        utility.wait_for_index_building_complete(shadow_name)
+        shadow.load()
+        result["index_and_load_seconds"] = round(time.perf_counter() - started, 2)
+
+        source_count = count_entities(source, "id >= 0")
+        shadow_count = count_entities(shadow, "id >= 0")
+        result["source_count"] = source_count
+        result["new_count"] = shadow_count
+        if source_count != shadow_count and not args.force:
+            result["success"] = False
+            result["error"] = (f"Conteggi diversi ({source_count} vs {shadow_count}): scritture durante la copia? "
+                               f"L'alias non è stato spostato; {shadow_name} resta per verifica")
+    except Exception:
+        source.set_properties({DUAL_WRITE_PROPERTY: ""})
+        raise
+    if not result["success"]:
+        # L'alias non si sposta: l'ombra resta per verifica ma non riceve più scritture
+        source.set_properties({DUAL_WRITE_PROPERTY: ""})
+        return result
+
+    # Switch atomico: da qui in poi search/query/insert sull'alias vanno alla nuova collection
+    if current is None:
+        utility.create_alias(shadow_name, args.alias)
+    else:
+        utility.alter_alias(shadow_name, args.alias)
+    result["switched"] = True
+    log(f"alias {args.alias} -> {shadow_name}")
+
+    if current is None:
+        # I client scrivono ancora sul nome reale finché MILVUS_COLLECTION non passa all'alias
+        result["dual_write_kept"] = True
+        result["action_required"] = (f"Impostare MILVUS_COLLECTION={args.alias} e riavviare i worker, poi "
+                                     f"python recreate_milvus_collection.py retire_source {source_name}")
+    else:
+        # I worker vedono il nuovo alias entro MILVUS_ALIAS_REFRESH secondi (fino ad allora c'è il dual-write)
+        log(f"attesa di {args.grace_seconds}s prima di rilasciare {source_name}")
+        time.sleep(args.grace_seconds)
+        source.set_properties({DUAL_WRITE_PROPERTY: ""})
+        if args.drop_old:
+            utility.drop_collection(source_name)
+            result["previous_collection_dropped"] = True
+        else:
+            source.release()
+            result["previous_collection_released"] = True
+            result["rollback"] = f"alter_alias('{source_name}', '{args.alias}') dopo aver ricaricato {source_name}"
+
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Ricostruisce l'indice vettoriale su una collection ombra e sposta l'alias")
+    parser.add_argument("--alias", default=os.getenv("MILVUS_COLLECTION", "kb_chunks"),
+                        help="Alias usato dai client (default: MILVUS_COLLECTION)")
+    parser.add_argument("--source", default="", help="Collection da copiare (default: quella puntata dall'alias)")
+    parser.add_argument("--shadow", default="", help="Nome della nuova collection (default: <alias>_<indice>_<timestamp>)")
+    parser.add_argument("--index-type", default="HNSW", type=str.upper, choices=INDEX_TYPES)
+    parser.add_argument("--index-param", action="append", default=[],
+                        help="Parametro di build chiave=valore (ripetibile, es. nlist=2048)")
+    parser.add_argument("--batch-size", type=int, default=int(os.getenv("MILVUS_EXPORT_BATCH_SIZE", "4096")))
+    parser.add_argument("--grace-seconds", type=float,
+                        default=2 * float(os.getenv("MILVUS_ALIAS_REFRESH", "30")),
+                        help="Attesa dopo lo switch prima di rilasciare la vecchia collection")
+    parser.add_argument("--drop-old", action="store_true", help="Elimina la vecchia collection invece di rilasciarla")
+    parser.add_argument("--force", action="store_true", help="Sposta l'alias anche se i conteggi non coincidono")
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    try:
+        result = rebuild(args)
+    except Exception as e:
+        result = {"success": False, "error": str(e), "error_type": type(e).__name__}
+
+    print(json.dumps(result, indent=2))
+    sys.exit(0 if result["success"] else 1)
+
+if __name__ == "__main__":
+    main()
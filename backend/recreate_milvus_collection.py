@@ -2,29 +2,179 @@
 """
 Script per ricreare la collezione Milvus con schema corretto
 Backup dei dati esistenti e migrazione allo schema con enable_dynamic_field=True
+
+Formato del backup (directory milvus_backup_<collection>/, o MILVUS_BACKUP_DIR):
+- manifest.json: schema, proprietà kb.*, elenco shard con righe, ultimo id e sha256 dei file
+- shard_NNNNN/<campo>.npy: campi numerici e vettori (float32/float16), uno per file
+- shard_NNNNN/extra.jsonl: campi non numerici e campi dinamici, una riga JSON per record
+
+L'export usa il query iterator (memoria costante: uno shard alla volta) ed è
+riprendibile: uno shard compare nel manifest solo quando è completo, e una
+nuova esecuzione riparte dall'ultimo id salvato. Il restore legge gli shard in
+memory-map, verifica i checksum e li inserisce con un pool di thread limitato.
+
+Migrazione online (online_migration): la nuova collection viene creata con un
+altro nome, le scritture di milvus_search.py vengono duplicate su entrambe
+(proprietà kb.dual_write_target della sorgente), i dati esistenti sono copiati
+a velocità limitata, i conteggi verificati per tenant e infine l'alias viene
+spostato sulla nuova collection. Ricerca e scritture non si interrompono mai.
 """
 import os
 import sys
 import json
+import time
+import shutil
+import argparse
+import hashlib
 import warnings
-from pymilvus import connections, Collection, FieldSchema, CollectionSchema, DataType, utility
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# milvus_search va importato prima di pymilvus (gestisce MILVUS_URI con un file di Milvus Lite)
+import milvus_search
+from milvus_search import (
+    COARSE_FIELD, DUAL_WRITE_PROPERTY, INSERT_BATCH_ROWS, EXPORT_BATCH_SIZE, SPARSE_EMPTY, SPARSE_FIELD, coarse_field,
+    coarse_vectors, connect_milvus, has_sparse_field, iter_query_batches, resolve_collection_name, tenant_partitions,
+)
+from pymilvus import Collection, DataType, utility
+
+from create_milvus_collection import build_schema, create_optional_indexes, hnsw_index_params, mark_tenant_partitioning
+
+TENANT_PARTITIONING_MODES = ("none", "partition_key", "partitions")
+
+BACKUP_FORMAT = "kb-milvus-backup"
+BACKUP_VERSION = 1
+MANIFEST_FILE = "manifest.json"
+EXTRA_FILE = "extra.jsonl"
+# 20000 vettori da 3072 dimensioni = ~245 MB per shard in memoria durante l'export
+SHARD_ROWS = int(os.getenv("MILVUS_BACKUP_SHARD_ROWS", "20000"))
+RESTORE_WORKERS = int(os.getenv("MILVUS_RESTORE_WORKERS", "4"))
+RESTORE_VERIFY = os.getenv("MILVUS_RESTORE_VERIFY", "true").lower() == "true"
+
+# Tipi salvati come colonne .npy; gli altri (VARCHAR, JSON, ...) finiscono in extra.jsonl
+NPY_DTYPES = {
+    DataType.BOOL: np.bool_,
+    DataType.INT8: np.int8,
+    DataType.INT16: np.int16,
+    DataType.INT32: np.int32,
+    DataType.INT64: np.int64,
+    DataType.FLOAT: np.float32,
+    DataType.DOUBLE: np.float64,
+    DataType.FLOAT_VECTOR: np.float32,
+    DataType.FLOAT16_VECTOR: np.float16,
+}
 
 # Sopprimi warning
 warnings.filterwarnings("ignore", category=UserWarning)
 
-def connect_milvus():
-    """Connessione a Milvus"""
-    host = os.getenv('MILVUS_HOST', '127.0.0.1')
-    port = int(os.getenv('MILVUS_PORT', '19530'))
-    
-    connections.connect(
-        alias="default",
-        host=host,
-        port=port
-    )
-
-def backup_collection_data(collection_name):
-    """Backup di tutti i dati della collezione esistente"""
+def backup_dir_for(collection_name):
+    return os.getenv("MILVUS_BACKUP_DIR") or f"milvus_backup_{collection_name}"
+
+def describe_schema(schema):
+    """Schema in forma JSON per il manifest"""
+    return {
+        "description": schema.description,
+        "enable_dynamic_field": bool(getattr(schema, "enable_dynamic_field", False)),
+        "fields": [{
+            "name": field.name,
+            "dtype": field.dtype.name,
+            "params": dict(field.params or {}),
+            "is_primary": bool(field.is_primary),
+            "auto_id": bool(getattr(field, "auto_id", False)),
+            "is_partition_key": bool(getattr(field, "is_partition_key", False)),
+        } for field in schema.fields],
+    }
+
+def file_sha256(path, block_size=8 * 1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def write_manifest(backup_dir, manifest):
+    """Scrittura atomica: un manifest interrotto a metà non deve mai sostituire quello valido"""
+    tmp = os.path.join(backup_dir, MANIFEST_FILE + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, os.path.join(backup_dir, MANIFEST_FILE))
+
+def read_manifest(backup_dir):
+    path = os.path.join(backup_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get("format") != BACKUP_FORMAT:
+        raise ValueError(f"{path} non è un manifest di backup Milvus")
+    return manifest
+
+class ShardBuffer:
+    """Colonne preallocate di uno shard: memoria fissa di shard_rows righe"""
+
+    def __init__(self, schema, shard_rows):
+        self.shard_rows = shard_rows
+        self.columns = {}
+        for field in schema.fields:
+            dtype = NPY_DTYPES.get(field.dtype)
+            if dtype is None:
+                continue
+            shape = (shard_rows, int(field.params["dim"])) if "dim" in (field.params or {}) else (shard_rows,)
+            self.columns[field.name] = np.empty(shape, dtype=dtype)
+        self.extras = []
+        self.count = 0
+
+    @property
+    def full(self):
+        return self.count >= self.shard_rows
+
+    def add(self, rows):
+        """Aggiunge righe finché c'è spazio e ritorna quelle rimaste fuori"""
+        taken = rows[:self.shard_rows - self.count]
+        end = self.count + len(taken)
+        for name, column in self.columns.items():
+            column[self.count:end] = np.asarray([row[name] for row in taken], dtype=column.dtype)
+        for row in taken:
+            extra = {key: value for key, value in row.items() if key not in self.columns}
+            self.extras.append(extra)
+        self.count = end
+        return rows[len(taken):]
+
+    def write(self, shard_dir):
+        """Salva lo shard in una directory temporanea e la rinomina solo a scrittura completata"""
+        tmp_dir = shard_dir + ".tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+        for name, column in self.columns.items():
+            np.save(os.path.join(tmp_dir, f"{name}.npy"), column[:self.count])
+        if any(self.extras):
+            with open(os.path.join(tmp_dir, EXTRA_FILE), "w") as f:
+                for extra in self.extras:
+                    f.write(json.dumps(extra, default=str) + "\n")
+        checksums = {name: file_sha256(os.path.join(tmp_dir, name)) for name in sorted(os.listdir(tmp_dir))}
+        shutil.rmtree(shard_dir, ignore_errors=True)
+        os.replace(tmp_dir, shard_dir)
+
+        shard = {
+            "path": os.path.basename(shard_dir),
+            "rows": self.count,
+            "first_id": int(self.columns["id"][0]),
+            "last_id": int(self.columns["id"][self.count - 1]),
+            "files": checksums,
+        }
+        self.extras = []
+        self.count = 0
+        return shard
+
+def backup_collection_data(collection_name, backup_dir=None, shard_rows=SHARD_ROWS, resume=True):
+    """
+    Backup della collezione a shard binari, a memoria costante.
+
+    Con `resume` un backup interrotto riparte dopo l'ultimo shard completo
+    (il query iterator restituisce le righe in ordine di id).
+    """
     try:
         connect_milvus()
         
@@ -33,59 +183,71 @@ def backup_collection_data(collection_name):
         
         collection = Collection(collection_name)
         collection.load()
-        
+        backup_dir = backup_dir or backup_dir_for(collection_name)
+        os.makedirs(backup_dir, exist_ok=True)
+
         # Rileva automaticamente i campi dallo schema
         schema = collection.schema
         field_names = [field.name for field in schema.fields]
         print(f"Detected fields in schema: {field_names}", file=sys.stderr)
-        
-        # Backup in batch per rispettare limite Milvus di 16384 records per query
-        all_results = []
-        batch_size = 10000  # Sicuro sotto il limite di 16384
-        offset = 0
-        
-        while True:
-            # Query batch di dati usando tutti i campi rilevati
-            batch_results = collection.query(
-                expr="id >= 0",
-                output_fields=field_names,  # Usa i campi reali dello schema
-                limit=batch_size,
-                offset=offset
-            )
-            
-            if not batch_results:
-                break
-                
-            all_results.extend(batch_results)
-            print(f"Backed up {len(all_results)} records so far...", file=sys.stderr)
-            offset += len(batch_results)
-            
-            # Se abbiamo ottenuto meno records del batch_size, abbiamo finito
-            if len(batch_results) < batch_size:
-                break
-        
-        results = all_results
-        
-        backup_data = {
-            "collection_name": collection_name,
-            "total_records": len(results),
-            "schema_info": str(collection.schema),
-            "data": results
-        }
-        
-        # Salva backup su file
-        backup_file = f"milvus_backup_{collection_name}.json"
-        with open(backup_file, 'w') as f:
-            # Converti numpy arrays in liste per JSON
-            for record in backup_data["data"]:
-                if "vector" in record and hasattr(record["vector"], "tolist"):
-                    record["vector"] = record["vector"].tolist()
-            json.dump(backup_data, f, indent=2)
+
+        manifest = read_manifest(backup_dir) if resume else None
+        if manifest and (manifest.get("complete") or manifest.get("collection_name") != collection_name
+                         or manifest.get("schema") != describe_schema(schema)):
+            manifest = None
+        if manifest is None:
+            # Nuovo backup: via gli shard di esecuzioni precedenti
+            for entry in os.listdir(backup_dir):
+                if entry.startswith("shard_"):
+                    shutil.rmtree(os.path.join(backup_dir, entry), ignore_errors=True)
+            manifest = {
+                "format": BACKUP_FORMAT,
+                "version": BACKUP_VERSION,
+                "collection_name": collection_name,
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                "schema": describe_schema(schema),
+                "properties": {k: v for k, v in (collection.describe().get("properties") or {}).items()
+                               if k.startswith("kb.")},
+                "shard_rows": shard_rows,
+                "shards": [],
+                "total_records": 0,
+                "complete": False,
+            }
+            write_manifest(backup_dir, manifest)
+        else:
+            print(f"Resuming backup after {manifest['total_records']} records", file=sys.stderr)
+
+        shards = manifest["shards"]
+        expr = f"id > {shards[-1]['last_id']}" if shards else "id >= 0"
+        buffer = ShardBuffer(schema, manifest["shard_rows"])
+        # "*" comprende i campi dinamici (es. content_hash)
+        output_fields = ["*"] if getattr(schema, "enable_dynamic_field", False) else field_names
+        started = time.perf_counter()
+
+        def flush_shard():
+            shards.append(buffer.write(os.path.join(backup_dir, f"shard_{len(shards):05d}")))
+            manifest["total_records"] += shards[-1]["rows"]
+            write_manifest(backup_dir, manifest)
+            rate = manifest["total_records"] / max(time.perf_counter() - started, 1e-6)
+            print(f"Backed up {manifest['total_records']} records so far ({rate:.0f}/s)...", file=sys.stderr)
+
+        for batch in iter_query_batches(collection, expr, output_fields, min(EXPORT_BATCH_SIZE, buffer.shard_rows)):
+            while batch:
+                batch = buffer.add(batch)
+                if buffer.full:
+                    flush_shard()
+        if buffer.count:
+            flush_shard()
+
+        manifest["complete"] = True
+        manifest["completed_at"] = time.strftime("%Y-%m-%dT%H:%M:%S%z")
+        write_manifest(backup_dir, manifest)
         
         return {
             "success": True,
-            "backup_file": backup_file,
-            "records_backed_up": len(results)
+            "backup_dir": backup_dir,
+            "shards": len(shards),
+            "records_backed_up": manifest["total_records"]
         }
         
     except Exception as e:
@@ -95,8 +257,8 @@ def backup_collection_data(collection_name):
             "error_type": type(e).__name__
         }
 
-def create_new_collection_schema(collection_name, vector_dim=3072):
-    """Crea nuova collezione con schema corretto"""
+def create_new_collection_schema(collection_name, vector_dim=3072, tenant_partitioning="none", num_partitions=64):
+    """Crea nuova collezione con schema corretto (opzionalmente partizionata per tenant)"""
     try:
         connect_milvus()
         
@@ -105,39 +267,35 @@ def create_new_collection_schema(collection_name, vector_dim=3072):
             utility.drop_collection(collection_name)
             print(f"Dropped existing collection: {collection_name}")
         
-        # Definisci campi per lo schema
-        fields = [
-            FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=False),
-            FieldSchema(name="tenant_id", dtype=DataType.INT64),
-            FieldSchema(name="document_id", dtype=DataType.INT64),
-            FieldSchema(name="chunk_index", dtype=DataType.INT64),
-            FieldSchema(name="vector", dtype=DataType.FLOAT_VECTOR, dim=vector_dim)
-        ]
-        
-        # Crea schema con enable_dynamic_field=True
-        schema = CollectionSchema(
-            fields=fields,
+        # Schema con enable_dynamic_field=True (🔑 QUESTO È LA CHIAVE!) e layout tenant richiesto
+        schema = build_schema(
+            vector_dim,
+            tenant_partitioning,
             description="KB chunks vectors with dynamic fields enabled",
-            enable_dynamic_field=True  # 🔑 QUESTO È LA CHIAVE!
+            enable_dynamic_field=True,
+            coarse_dim=int(os.getenv("MILVUS_COARSE_DIM", "0")),
+            coarse_type=os.getenv("MILVUS_COARSE_TYPE", "float32"),
+            sparse=os.getenv("MILVUS_SPARSE_FIELD", "false").lower() == "true"
         )
         
         # Crea nuova collezione
+        extra = {"num_partitions": num_partitions} if tenant_partitioning == "partition_key" else {}
         collection = Collection(
             name=collection_name,
-            schema=schema
+            schema=schema,
+            **extra
         )
+        mark_tenant_partitioning(collection, tenant_partitioning)
         
         # Crea indice per la ricerca vettoriale
-        index_params = {
-            "metric_type": "COSINE",
-            "index_type": "HNSW",
-            "params": {"M": 16, "efConstruction": 256}
-        }
+        index_params = hnsw_index_params("COSINE")
         collection.create_index(field_name="vector", index_params=index_params)
+        create_optional_indexes(collection, index_params["metric_type"])
         
         return {
             "success": True,
             "message": f"Created new collection {collection_name} with dynamic fields enabled",
+            "tenant_partitioning": tenant_partitioning,
             "schema": str(schema)
         }
         
@@ -148,62 +306,135 @@ def create_new_collection_schema(collection_name, vector_dim=3072):
             "error_type": type(e).__name__
         }
 
-def restore_collection_data(collection_name, backup_file):
-    """Ripristina i dati dalla backup"""
+def load_shard(backup_dir, shard, verify=RESTORE_VERIFY):
+    """Colonne dello shard in memory-map (nessuna copia in RAM) e campi extra"""
+    shard_dir = os.path.join(backup_dir, shard["path"])
+    if verify:
+        for name, checksum in shard["files"].items():
+            if file_sha256(os.path.join(shard_dir, name)) != checksum:
+                raise ValueError(f"Checksum errato: {shard['path']}/{name}")
+
+    columns = {name[:-4]: np.load(os.path.join(shard_dir, name), mmap_mode="r")
+               for name in shard["files"] if name.endswith(".npy")}
+    extras = None
+    if EXTRA_FILE in shard["files"]:
+        with open(os.path.join(shard_dir, EXTRA_FILE)) as f:
+            extras = [json.loads(line) for line in f]
+    return columns, extras
+
+def shard_insert_batches(columns, extras, rows):
+    """Batch da inserire per uno shard (indici delle righe), rispettando righe e byte per insert"""
+    row_bytes = sum(column[0].nbytes if column.ndim > 1 else column.itemsize for column in columns.values())
+    if extras:
+        row_bytes += max(1, sum(len(json.dumps(e, default=str)) for e in extras[:100]) // min(len(extras), 100))
+    batch_rows = max(1, min(INSERT_BATCH_ROWS, (48 * 1024 * 1024) // max(row_bytes, 1)))
+    for start in range(0, rows, batch_rows):
+        yield np.arange(start, min(start + batch_rows, rows))
+
+def insert_rows(collection, target_fields, columns, extras, indexes, partition_name):
+    """Inserisce le righe `indexes` dello shard; i campi mancanti nel backup vengono derivati o omessi"""
+    data = {}
+    for field in target_fields:
+        if field.name in columns:
+            values = columns[field.name][indexes]
+            data[field.name] = values.tolist() if values.ndim == 1 else values
+        elif field.name == COARSE_FIELD and "vector" in columns:
+            # Backup precedente al campo compatto: viene calcolato dai vettori completi
+            dtype = np.float16 if field.dtype == DataType.FLOAT16_VECTOR else np.float32
+            data[field.name] = np.asarray(coarse_vectors(columns["vector"][indexes], int(field.params["dim"]), dtype))
+        elif field.dtype == DataType.SPARSE_FLOAT_VECTOR:
+            # JSON salva gli indici come stringhe; un backup senza campo sparso riceve il segnaposto
+            values = [extras[i].get(field.name) for i in indexes] if extras is not None else [None] * len(indexes)
+            data[field.name] = [{int(term): float(weight) for term, weight in value.items()} if value
+                                else dict(SPARSE_EMPTY) for value in values]
+        elif extras is not None:
+            data[field.name] = [extras[i].get(field.name) for i in indexes]
+
+    if extras is None or not any(extras[i] for i in indexes):
+        # Formato a colonne nell'ordine dello schema: il più veloce da serializzare
+        collection.insert([list(data[field.name]) for field in target_fields if field.name in data],
+                          partition_name=partition_name)
+        return len(indexes)
+
+    # Campi dinamici: formato a righe
+    rows = []
+    for position, i in enumerate(indexes):
+        row = {key: value for key, value in extras[i].items() if value is not None}
+        for name, values in data.items():
+            row[name] = values[position]
+        rows.append(row)
+    collection.insert(rows, partition_name=partition_name)
+    return len(indexes)
+
+def restore_shard(collection, target_fields, backup_dir, shard, tenant_partitioning):
+    columns, extras = load_shard(backup_dir, shard)
+    inserted = 0
+    for indexes in shard_insert_batches(columns, extras, shard["rows"]):
+        if tenant_partitioning == "partitions":
+            # Con una partizione per tenant le righe vengono raggruppate per tenant_id
+            tenant_ids = columns["tenant_id"][indexes]
+            for tenant_id in np.unique(tenant_ids):
+                inserted += insert_rows(collection, target_fields, columns, extras, indexes[tenant_ids == tenant_id],
+                                        f"tenant_{int(tenant_id)}")
+        else:
+            inserted += insert_rows(collection, target_fields, columns, extras, indexes, None)
+    return inserted
+
+def restore_collection_data(collection_name, backup_dir, tenant_partitioning="none", workers=RESTORE_WORKERS):
+    """Ripristina i dati dal backup a shard (nelle partizioni tenant_<id> se richiesto)"""
     try:
         connect_milvus()
         
-        if not os.path.exists(backup_file):
-            return {"success": False, "error": f"Backup file {backup_file} not found"}
-        
-        # Carica backup
-        with open(backup_file, 'r') as f:
-            backup_data = json.load(f)
+        manifest = read_manifest(backup_dir) if os.path.isdir(backup_dir) else None
+        if manifest is None:
+            return {"success": False, "error": f"Backup {backup_dir} not found"}
+        if not manifest.get("complete"):
+            return {"success": False, "error": f"Backup {backup_dir} is incomplete: run the backup again to resume it"}
         
         collection = Collection(collection_name)
-        
-        # Prepara dati per inserimento (formato lista)
-        records = backup_data["data"]
-        if not records:
+        shards = manifest["shards"]
+        if not shards:
             return {"success": True, "message": "No data to restore"}
-        
-        # Rileva i campi dal primo record
-        sample_record = records[0]
-        field_names = list(sample_record.keys())
-        print(f"Restoring fields: {field_names}", file=sys.stderr)
-        
-        # Crea liste per ogni campo
-        field_data = {field: [] for field in field_names}
-        
-        for record in records:
-            for field in field_names:
-                field_data[field].append(record[field])
-        
-        # Converti in lista ordinata per Milvus (deve corrispondere all'ordine dello schema)
-        data_lists = [field_data[field] for field in field_names]
-        
-        # Inserisci in batch (max 1000 per volta)
-        batch_size = 1000
+
+        target_fields = [field for field in collection.schema.fields if not getattr(field, "auto_id", False)]
+        backup_fields = {field["name"]: field for field in manifest["schema"]["fields"]}
+        for field in target_fields:
+            dim = (field.params or {}).get("dim")
+            saved = backup_fields.get(field.name)
+            if dim and saved and int(saved["params"].get("dim", 0)) != int(dim):
+                return {"success": False, "error": f"Dimensione di {field.name} diversa: "
+                                                   f"backup {saved['params'].get('dim')}, collection {dim}"}
+        print(f"Restoring fields: {[field.name for field in target_fields]}", file=sys.stderr)
+
+        if tenant_partitioning == "partitions":
+            # Partizioni create prima del pool: create_partition non va eseguita in parallelo
+            tenants = set()
+            for shard in shards:
+                tenants.update(int(t) for t in np.unique(np.load(os.path.join(backup_dir, shard["path"], "tenant_id.npy"),
+                                                                 mmap_mode="r")))
+            for tenant_id in sorted(tenants):
+                if not collection.has_partition(f"tenant_{tenant_id}"):
+                    collection.create_partition(f"tenant_{tenant_id}")
+        
+        total_records = manifest["total_records"]
         total_inserted = 0
-        total_records = len(records)
-        
-        for i in range(0, total_records, batch_size):
-            # Prepara batch data per ogni campo
-            batch_data = []
-            for field in field_names:
-                batch_data.append(field_data[field][i:i+batch_size])
-            
-            collection.insert(batch_data)
-            batch_size_actual = len(batch_data[0])
-            total_inserted += batch_size_actual
-            print(f"Restored {total_inserted}/{total_records} records", file=sys.stderr)
+        started = time.perf_counter()
+        # Pool limitato: al più `workers` shard in lettura/insert contemporaneamente
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            tasks = [pool.submit(restore_shard, collection, target_fields, backup_dir, shard, tenant_partitioning)
+                     for shard in shards]
+            for task in tasks:
+                total_inserted += task.result()
+                rate = total_inserted / max(time.perf_counter() - started, 1e-6)
+                print(f"Restored {total_inserted}/{total_records} records ({rate:.0f}/s)", file=sys.stderr)
         
         collection.flush()
         
         return {
             "success": True,
             "restored_records": total_inserted,
-            "original_records": len(records)
+            "original_records": total_records,
+            "shards": len(shards)
         }
         
     except Exception as e:
@@ -213,26 +444,297 @@ def restore_collection_data(collection_name, backup_file):
             "error_type": type(e).__name__
         }
 
+BACKFILL_ROWS_PER_SECOND = int(os.getenv("MILVUS_BACKFILL_ROWS_PER_SECOND", "5000"))
+
+def vector_dim(collection):
+    return next(int(field.params["dim"]) for field in collection.schema.fields if field.name == "vector")
+
+def backfill_rows(source, target, rows):
+    """
+    Copia nella destinazione le righe che non ci sono ancora.
+
+    Le righe già presenti sono state scritte dal dual-write e sono più recenti
+    di quelle lette dalla sorgente: non vengono sovrascritte.
+    """
+    ids = [int(row["id"]) for row in rows]
+    existing = {int(row["id"]) for row in target.query(expr=f"id in {ids}", output_fields=["id"], consistency_level="Strong")}
+    missing = [row for row in rows if int(row["id"]) not in existing]
+    if not missing:
+        return 0
+
+    # Campi dello schema sorgente assenti nel nuovo (non devono diventare campi dinamici)
+    dropped = {f.name for f in source.schema.fields} - {f.name for f in target.schema.fields}
+    coarse_dim, coarse_dtype = coarse_field(target)
+    with_sparse = has_sparse_field(target)
+    if coarse_dim:
+        coarse = coarse_vectors([row["vector"] for row in missing], coarse_dim, coarse_dtype)
+
+    groups = {}
+    for position, row in enumerate(missing):
+        row = {key: value for key, value in row.items() if key not in dropped}
+        if coarse_dim and COARSE_FIELD not in row:
+            row[COARSE_FIELD] = coarse[position]
+        if with_sparse and SPARSE_FIELD not in row:
+            row[SPARSE_FIELD] = dict(SPARSE_EMPTY)
+        partitions = tenant_partitions(target, int(row["tenant_id"]), create=True)
+        groups.setdefault(partitions[0] if partitions else None, []).append(row)
+    for partition_name, group in groups.items():
+        target.insert(group, partition_name=partition_name)
+    return len(missing)
+
+def backfill(source, target, rows_per_second, batch_size=EXPORT_BATCH_SIZE):
+    """Copia l'intera sorgente con il query iterator, limitando la velocità per non saturare Milvus"""
+    scanned = copied = 0
+    started = time.perf_counter()
+    for batch in iter_query_batches(source, "id >= 0", ["*"], batch_size):
+        copied += backfill_rows(source, target, batch)
+        scanned += len(batch)
+        if rows_per_second > 0:
+            ahead = scanned / rows_per_second - (time.perf_counter() - started)
+            if ahead > 0:
+                time.sleep(ahead)
+        if scanned % (batch_size * 10) < len(batch):
+            print(f"Backfilled {copied} of {scanned} scanned records "
+                  f"({scanned / max(time.perf_counter() - started, 1e-6):.0f}/s)", file=sys.stderr)
+    return {"scanned": scanned, "copied": copied, "seconds": round(time.perf_counter() - started, 2)}
+
+def tenant_counts(collection, batch_size=EXPORT_BATCH_SIZE):
+    counts = Counter()
+    for batch in iter_query_batches(collection, "id >= 0", ["tenant_id"], batch_size, consistency_level="Strong"):
+        counts.update(int(row["tenant_id"]) for row in batch)
+    return counts
+
+def tenant_ids(collection, tenant_id, batch_size=EXPORT_BATCH_SIZE):
+    batches = iter_query_batches(collection, f"tenant_id == {tenant_id}", ["id"], batch_size, consistency_level="Strong")
+    return {int(row["id"]) for batch in batches for row in batch}
+
+def reconcile_tenant(source, target, tenant_id, batch_size=EXPORT_BATCH_SIZE):
+    """Allinea un tenant divergente: copia gli id mancanti, cancella quelli che la sorgente non ha più"""
+    # Prima la destinazione: il dual-write scrive prima sulla sorgente, quindi una scrittura
+    # in volo non può comparire come riga in eccesso (e venire cancellata)
+    target_ids = tenant_ids(target, tenant_id, batch_size)
+    source_ids = tenant_ids(source, tenant_id, batch_size)
+    missing = sorted(source_ids - target_ids)
+    extra = sorted(target_ids - source_ids)
+
+    for start in range(0, len(missing), batch_size):
+        rows = source.query(expr=f"id in {missing[start:start + batch_size]}", output_fields=["*"],
+                            consistency_level="Strong")
+        backfill_rows(source, target, rows)
+    for start in range(0, len(extra), 16384):
+        target.delete(f"id in {extra[start:start + 16384]}")
+    return {"tenant_id": tenant_id, "copied": len(missing), "deleted": len(extra)}
+
+def verify_tenants(source, target, batch_size=EXPORT_BATCH_SIZE, attempts=3, pause=1.0):
+    """
+    Conteggi per tenant (letture Strong); i tenant divergenti vengono riallineati e ricontati.
+
+    Con il dual-write attivo i conteggi delle due collection sono letti in
+    istanti diversi: una differenza può essere solo una scrittura in volo,
+    per questo riallineamento e riconteggio vengono ripetuti fino ad `attempts` volte.
+    """
+    source_counts = tenant_counts(source, batch_size)
+    target_counts = tenant_counts(target, batch_size)
+    diverging = sorted(t for t in set(source_counts) | set(target_counts) if source_counts[t] != target_counts[t])
+
+    reconciled = []
+    mismatches = []
+    for attempt in range(attempts):
+        if not diverging:
+            break
+        if attempt:
+            time.sleep(pause)
+        reconciled.extend(reconcile_tenant(source, target, t, batch_size) for t in diverging)
+        mismatches = []
+        for tenant_id in diverging:
+            expr = f"tenant_id == {tenant_id}"
+            source_count = milvus_search.count_entities(source, expr, consistency_level="Strong")
+            target_count = milvus_search.count_entities(target, expr, consistency_level="Strong")
+            if source_count != target_count:
+                mismatches.append({"tenant_id": tenant_id, "source": source_count, "target": target_count})
+        diverging = [m["tenant_id"] for m in mismatches]
+
+    return {
+        "tenants": len(set(source_counts) | set(target_counts)),
+        "source_records": sum(source_counts.values()),
+        "reconciled": [r for r in reconciled if r["copied"] or r["deleted"]],
+        "mismatches": mismatches,
+    }
+
+def online_migration(collection_name, tenant_partitioning="none", alias=None, target_name=None,
+                     rows_per_second=BACKFILL_ROWS_PER_SECOND, grace_seconds=None, drop_old=False):
+    """
+    Migrazione senza downtime verso una nuova collection dietro un alias.
+
+    `collection_name` è l'alias usato dai client (MILVUS_COLLECTION) oppure,
+    alla prima migrazione, la collection reale: in quel caso serve `alias`,
+    da impostare poi in MILVUS_COLLECTION. In questo caso il dual-write
+    resta attivo e la sorgente si ritira con retire_source dopo il cambio
+    di MILVUS_COLLECTION. Rieseguire con lo stesso `target_name` riprende
+    una migrazione interrotta.
+    """
+    try:
+        connect_milvus()
+        refresh = milvus_search.ALIAS_REFRESH_SECONDS
+        grace_seconds = 2 * refresh if grace_seconds is None else grace_seconds
+
+        # has_collection è vero sia per le collection sia per gli alias
+        if not utility.has_collection(collection_name):
+            return {"success": False, "error": f"Collection {collection_name} not found"}
+        source_name = resolve_collection_name(collection_name)
+        if source_name != collection_name:
+            alias = collection_name
+        elif not alias:
+            return {"success": False, "error": f"{collection_name} is a collection, not an alias: "
+                                               f"pass --alias and then set it as MILVUS_COLLECTION"}
+        elif utility.has_collection(alias) and resolve_collection_name(alias) == alias:
+            return {"success": False, "error": f"{alias} is an existing collection and cannot become an alias"}
+
+        source = Collection(source_name)
+        source.load()
+        target_name = target_name or f"{alias}_{time.strftime('%Y%m%d%H%M%S')}"
+        result = {"success": True, "alias": alias, "previous_collection": source_name,
+                  "new_collection": target_name, "switched": False}
+
+        # 1. Nuova collection (riusata se esiste: ripresa di una migrazione interrotta)
+        if utility.has_collection(target_name):
+            result["resumed"] = True
+        else:
+            created = create_new_collection_schema(target_name, vector_dim(source), tenant_partitioning)
+            if not created["success"]:
+                return created
+        target = Collection(target_name)
+        tuned = {k: v for k, v in (source.describe().get("properties") or {}).items()
+                 if k.startswith(milvus_search.SEARCH_EF_PROPERTY)}
+        if tuned:
+            target.set_properties(tuned)
+        target.load()
+
+        # 2. Dual-write: i worker lo vedono entro MILVUS_ALIAS_REFRESH secondi, poi parte la copia
+        source.set_properties({DUAL_WRITE_PROPERTY: target_name})
+        print(f"Dual-write enabled towards {target_name}, waiting {refresh}s for the workers", file=sys.stderr)
+        time.sleep(refresh)
+
+        # 3. Copia dei dati esistenti e verifica per tenant
+        result["backfill"] = backfill(source, target, rows_per_second)
+        target.flush()
+        result["verification"] = verify_tenants(source, target, pause=refresh)
+        if result["verification"]["mismatches"]:
+            result["success"] = False
+            result["error"] = (f"Per-tenant counts differ after reconciliation: alias not moved, dual-write stays on. "
+                               f"Run again with --target {target_name} to resume")
+            return result
+
+        # 4. Switch atomico dell'alias
+        if utility.has_collection(alias):
+            utility.alter_alias(target_name, alias)
+        else:
+            utility.create_alias(target_name, alias)
+        result["switched"] = True
+
+        # Alla prima migrazione i client scrivono ancora sul nome reale finché MILVUS_COLLECTION
+        # non passa all'alias: il dual-write resta attivo e la sorgente non viene toccata
+        if source_name == collection_name:
+            result["dual_write_kept"] = True
+            result["action_required"] = (f"Set MILVUS_COLLECTION={alias} and restart the workers, then run "
+                                         f"retire_source {source_name} to stop dual-write towards {target_name}")
+            print(f"Alias {alias} -> {target_name} created: dual-write from {source_name} stays on until "
+                  f"MILVUS_COLLECTION uses the alias", file=sys.stderr)
+            return result
+
+        print(f"Alias {alias} -> {target_name}, waiting {grace_seconds}s before retiring {source_name}",
+              file=sys.stderr)
+
+        # 5. I worker che non hanno ancora visto l'alias scrivono ancora sulla sorgente (con dual-write)
+        time.sleep(grace_seconds)
+        retired = retire_source(source_name, drop_old)
+        if not retired["success"]:
+            return {**result, **retired}
+        result.update({k: v for k, v in retired.items() if k.startswith("previous_collection_")})
+        return result
+
+    except Exception as e:
+        return {
+            "success": False,
+            "error": str(e),
+            "error_type": type(e).__name__
+        }
+
+def retire_source(source_name, drop_old=False):
+    """
+    Ritira la collection sorgente di una migrazione online: spegne il dual-write e la
+    rilascia (o la elimina). Da lanciare solo quando nessun client scrive più sul nome
+    reale, cioè dopo che MILVUS_COLLECTION punta all'alias.
+    """
+    try:
+        connect_milvus()
+        if not utility.has_collection(source_name):
+            return {"success": False, "error": f"Collection {source_name} not found"}
+        if resolve_collection_name(source_name) != source_name:
+            return {"success": False, "error": f"{source_name} is an alias: pass the previous collection"}
+        aliases = utility.list_aliases(source_name)
+        if aliases:
+            return {"success": False, "error": f"{source_name} is still behind alias {', '.join(aliases)}"}
+
+        source = Collection(source_name)
+        result = {"success": True, "previous_collection": source_name,
+                  "dual_write_target": (source.describe().get("properties") or {}).get(DUAL_WRITE_PROPERTY) or None}
+        source.set_properties({DUAL_WRITE_PROPERTY: ""})
+        if drop_old:
+            utility.drop_collection(source_name)
+            result["previous_collection_dropped"] = True
+        else:
+            source.release()
+            result["previous_collection_released"] = True
+        return result
+
+    except Exception as e:
+        return {
+            "success": False,
+            "error": str(e),
+            "error_type": type(e).__name__
+        }
+
 def main():
-    """Main function - gestisce backup, ricreazione e restore"""
-    if len(sys.argv) != 3:
+    """Main function - gestisce backup, ricreazione, restore e migrazione online"""
+    parser = argparse.ArgumentParser(
+        usage="python recreate_milvus_collection.py <operation> <collection_name> [none|partition_key|partitions]")
+    parser.add_argument("operation", choices=["backup", "recreate", "restore", "full_migration", "online_migration",
+                                              "retire_source"])
+    parser.add_argument("collection_name")
+    # Layout multi-tenant della collection ricreata (migrazione dal layout a filtro tenant_id)
+    parser.add_argument("tenant_partitioning", nargs="?", default="none")
+    parser.add_argument("--alias", default="", help="online_migration: alias da creare se collection_name non lo è")
+    parser.add_argument("--target", default="", help="online_migration: nome della nuova collection (ripresa)")
+    parser.add_argument("--rows-per-second", type=int, default=BACKFILL_ROWS_PER_SECOND,
+                        help="online_migration: velocità massima della copia (0 = illimitata)")
+    parser.add_argument("--grace-seconds", type=float, default=None,
+                        help="online_migration: attesa dopo lo switch prima di ritirare la vecchia collection")
+    parser.add_argument("--drop-old", action="store_true", help="online_migration/retire_source: elimina la vecchia collection")
+    try:
+        args = parser.parse_args()
+    except SystemExit:
         print(json.dumps({
             "success": False,
-            "error": "Usage: python recreate_milvus_collection.py <operation> <collection_name>"
+            "error": "Usage: python recreate_milvus_collection.py <operation> <collection_name> "
+                     "[none|partition_key|partitions]"
         }))
         sys.exit(1)
     
-    operation = sys.argv[1]
-    collection_name = sys.argv[2]
+    operation = args.operation
+    collection_name = args.collection_name
+    tenant_partitioning = args.tenant_partitioning
+    if tenant_partitioning not in TENANT_PARTITIONING_MODES:
+        print(json.dumps({"success": False, "error": f"Unknown tenant partitioning: {tenant_partitioning}"}))
+        sys.exit(1)
     
     try:
         if operation == "backup":
             result = backup_collection_data(collection_name)
         elif operation == "recreate":
-            result = create_new_collection_schema(collection_name)
+            result = create_new_collection_schema(collection_name, tenant_partitioning=tenant_partitioning)
         elif operation == "restore":
-            backup_file = f"milvus_backup_{collection_name}.json"
-            result = restore_collection_data(collection_name, backup_file)
+            result = restore_collection_data(collection_name, backup_dir_for(collection_name), tenant_partitioning)
         elif operation == "full_migration":
             # Migrazione completa: backup + recreate + restore
             print("Step 1: Backup existing data...")
@@ -242,13 +744,14 @@ def main():
                 sys.exit(1)
             
             print("Step 2: Recreate collection with new schema...")
-            recreate_result = create_new_collection_schema(collection_name)
+            recreate_result = create_new_collection_schema(collection_name, tenant_partitioning=tenant_partitioning)
             if not recreate_result["success"]:
                 print(json.dumps(recreate_result))
                 sys.exit(1)
             
             print("Step 3: Restore data...")
-            restore_result = restore_collection_data(collection_name, backup_result.get("backup_file"))
+            restore_result = restore_collection_data(collection_name, backup_result.get("backup_dir", backup_dir_for(collection_name)),
+                                                     tenant_partitioning)
             
             result = {
                 "success": restore_result["success"],
@@ -256,10 +759,17 @@ def main():
                 "recreate": recreate_result,
                 "restore": restore_result
             }
+        elif operation == "online_migration":
+            result = online_migration(collection_name, tenant_partitioning, args.alias or None, args.target or None,
+                                      args.rows_per_second, args.grace_seconds, args.drop_old)
+        elif operation == "retire_source":
+            result = retire_source(collection_name, args.drop_old)
         else:
             result = {"success": False, "error": f"Unknown operation: {operation}"}
         
         print(json.dumps(result, indent=2))
+        if not result["success"]:
+            sys.exit(1)
         
     except Exception as e:
         print(json.dumps({
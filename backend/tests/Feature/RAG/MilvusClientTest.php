@@ -0,0 +1,213 @@
+<?php
+
+namespace Tests\Feature\RAG;
+
+use App\Services\RAG\MilvusClient;
+use Illuminate\Support\Facades\Log;
+use Tests\TestCase;
+
+/**
+ * Trasporto di MilvusClient: worker su Unix socket, fallback al processo one-shot
+ * e parsing della risposta JSON. Python e il worker sono sostituiti da processi finti.
+ */
+class MilvusClientTest extends TestCase
+{
+    private string $dir;
+
+    protected function setUp(): void
+    {
+        parent::setUp();
+
+        if (PHP_OS_FAMILY === 'Windows') {
+            $this->markTestSkipped('Unix domain socket e script shell non disponibili su Windows');
+        }
+
+        Log::spy();
+
+        $this->dir = sys_get_temp_dir().'/milvus-client-test-'.uniqid();
+        mkdir($this->dir);
+
+        // Finto interprete Python: salva i parametri ricevuti (@file) e stampa l'output preparato dal test
+        $python = $this->dir.'/python';
+        file_put_contents($python, "#!/bin/sh\ncp \"\${2#@}\" \"{$this->dir}/params.json\"\ncat \"{$this->dir}/output.txt\"\n");
+        chmod($python, 0755);
+
+        config([
+            'rag.vector.milvus.python_path' => $python,
+            'rag.vector.milvus.collection' => 'kb_test',
+            'rag.vector.milvus.worker_socket' => null,
+            'rag.vector.milvus.timings' => false,
+        ]);
+    }
+
+    protected function tearDown(): void
+    {
+        if (isset($this->dir) && is_dir($this->dir)) {
+            array_map('unlink', glob($this->dir.'/*') ?: []);
+            rmdir($this->dir);
+        }
+
+        parent::tearDown();
+    }
+
+    public function test_one_shot_process_receives_params_and_returns_the_last_json_line(): void
+    {
+        $this->oneShotOutput(implode("\n", [
+            'Detected fields in schema: [id, tenant_id]',
+            json_encode(['success' => true, 'count' => 42]),
+            'milvus slow call: operation=count_by_tenant operation_ms=1200.5 total=1900.1ms',
+        ]));
+
+        $count = (new MilvusClient)->countByTenant(5);
+
+        $this->assertSame(42, $count);
+        $params = $this->sentParams();
+        $this->assertSame('count_by_tenant', $params['operation']);
+        $this->assertSame('kb_test', $params['collection']);
+        $this->assertSame(5, $params['tenant_id']);
+        $this->assertArrayHasKey('sent_at', $params);
+    }
+
+    public function test_one_shot_invalid_json_is_reported_as_failure(): void
+    {
+        $this->oneShotOutput("Traceback (most recent call last):\nModuleNotFoundError: No module named 'pymilvus'");
+
+        $result = (new MilvusClient)->compact();
+
+        $this->assertFalse($result['success']);
+        $this->assertSame('Invalid JSON response from Python script', $result['error']);
+        Log::shouldHaveReceived('error')->with('milvus.python.invalid_json', \Mockery::type('array'))->once();
+    }
+
+    public function test_one_shot_without_output_is_reported_as_failure(): void
+    {
+        $this->oneShotOutput('');
+
+        $result = (new MilvusClient)->compact();
+
+        $this->assertFalse($result['success']);
+        $this->assertSame('No output from Python script', $result['error']);
+    }
+
+    public function test_compaction_params_keep_flush_before_separate_from_the_write_flush_mode(): void
+    {
+        $this->oneShotOutput(json_encode(['success' => true, 'collection' => 'kb_test', 'triggered' => false]));
+
+        (new MilvusClient)->compact(['dry_run' => true, 'flush_before' => false, 'wait_seconds' => 10]);
+
+        $params = $this->sentParams();
+        $this->assertSame('compaction', $params['operation']);
+        $this->assertFalse($params['flush_before']);
+        $this->assertTrue($params['dry_run']);
+        $this->assertArrayNotHasKey('flush', $params);
+        $this->assertEquals(10, $params['wait_seconds']);
+    }
+
+    public function test_worker_response_is_used_when_the_socket_is_available(): void
+    {
+        $socket = $this->dir.'/worker.sock';
+        $worker = $this->startWorker($socket, json_encode(['success' => true, 'count' => 7]));
+        config(['rag.vector.milvus.worker_socket' => $socket]);
+        $this->oneShotOutput(json_encode(['success' => true, 'count' => 42]));
+
+        try {
+            $count = (new MilvusClient)->countByTenant(3);
+        } finally {
+            $this->stopWorker($worker);
+        }
+
+        $this->assertSame(7, $count);
+        $request = json_decode(file_get_contents($this->dir.'/request.json'), true);
+        $this->assertSame('count_by_tenant', $request['operation']);
+        $this->assertSame(3, $request['tenant_id']);
+        $this->assertFileDoesNotExist($this->dir.'/params.json');
+    }
+
+    public function test_invalid_worker_response_is_reported_as_failure(): void
+    {
+        $socket = $this->dir.'/worker.sock';
+        $worker = $this->startWorker($socket, 'not json');
+        config(['rag.vector.milvus.worker_socket' => $socket]);
+
+        try {
+            $result = (new MilvusClient)->compact();
+        } finally {
+            $this->stopWorker($worker);
+        }
+
+        $this->assertFalse($result['success']);
+        $this->assertSame('Invalid JSON response from Milvus worker', $result['error']);
+    }
+
+    public function test_unreachable_worker_falls_back_to_one_shot(): void
+    {
+        config(['rag.vector.milvus.worker_socket' => $this->dir.'/missing.sock']);
+        $this->oneShotOutput(json_encode(['success' => true, 'count' => 42]));
+
+        $count = (new MilvusClient)->countByTenant(5);
+
+        $this->assertSame(42, $count);
+        $this->assertSame('count_by_tenant', $this->sentParams()['operation']);
+        Log::shouldHaveReceived('warning')
+            ->withArgs(fn ($message, $context = []) => $message === 'milvus.worker.unavailable'
+                && $context['fallback'] === 'one-shot'
+                && $context['operation'] === 'count_by_tenant')
+            ->once();
+    }
+
+    private function oneShotOutput(string $output): void
+    {
+        file_put_contents($this->dir.'/output.txt', $output === '' ? '' : $output."\n");
+    }
+
+    private function sentParams(): array
+    {
+        $this->assertFileExists($this->dir.'/params.json', 'Il processo one-shot non è stato avviato');
+
+        return json_decode(file_get_contents($this->dir.'/params.json'), true);
+    }
+
+    /**
+     * Finto worker: accetta una connessione, salva la richiesta NDJSON e risponde con `$response`
+     *
+     * @return resource
+     */
+    private function startWorker(string $socket, string $response)
+    {
+        $script = $this->dir.'/worker.php';
+        file_put_contents($script, <<<'PHP'
+<?php
+[$_, $socket, $requestFile, $response] = $argv;
+$server = stream_socket_server('unix://'.$socket, $errno, $errstr);
+fwrite(STDOUT, "ready\n");
+$connection = stream_socket_accept($server, 10);
+if ($connection !== false) {
+    file_put_contents($requestFile, fgets($connection));
+    fwrite($connection, $response."\n");
+    fclose($connection);
+}
+fclose($server);
+unlink($socket);
+PHP);
+
+        $command = [PHP_BINARY, $script, $socket, $this->dir.'/request.json', $response];
+        $process = proc_open($command, [1 => ['pipe', 'w']], $pipes);
+        $this->assertIsResource($process);
+        $this->assertSame("ready\n", fgets($pipes[1]));
+        fclose($pipes[1]);
+
+        return $process;
+    }
+
+    /**
+     * @param  resource  $process
+     */
+    private function stopWorker($process): void
+    {
+        $status = proc_get_status($process);
+        if ($status['running']) {
+            proc_terminate($process);
+        }
+        proc_close($process);
+    }
+}
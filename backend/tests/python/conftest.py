@@ -0,0 +1,63 @@
+"""
+Fixture condivise dei test degli script Python di Milvus.
+
+I test girano su Milvus Lite (file locale) creato in una directory temporanea:
+MILVUS_URI va impostato prima dell'import di milvus_search, che lo legge all'avvio.
+"""
+import itertools
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, BACKEND_DIR)
+
+_LITE_DIR = tempfile.mkdtemp(prefix='milvus-lite-tests-')
+os.environ['MILVUS_URI'] = os.path.join(_LITE_DIR, 'milvus.db')
+os.environ.setdefault('MILVUS_ALIAS_REFRESH', '0')
+
+import milvus_search  # noqa: E402  (deve precedere pymilvus)
+from create_milvus_collection import ensure_collection  # noqa: E402
+from pymilvus import utility  # noqa: E402
+
+DIM = 8
+_names = itertools.count()
+
+def pytest_sessionfinish(session, exitstatus):
+    milvus_search.reset_connection()
+    shutil.rmtree(_LITE_DIR, ignore_errors=True)
+
+def random_vectors(count, dim=DIM, seed=None):
+    rng = random.Random(seed)
+    return [[rng.uniform(-1, 1) for _ in range(dim)] for _ in range(count)]
+
+@pytest.fixture
+def make_collection():
+    """Crea collection con nome univoco per test e le elimina (con i loro alias) alla fine"""
+    created = []
+
+    def factory(index_type='HNSW', dynamic=True, **kwargs):
+        milvus_search.connect_milvus()
+        name = f"kb_test_{os.getpid()}_{next(_names)}"
+        ensure_collection(name, DIM, index_type=index_type, enable_dynamic_field=dynamic, **kwargs)
+        created.append(name)
+        return name
+
+    yield factory
+
+    milvus_search.connect_milvus()
+    for name in utility.list_collections():
+        if name in created or any(name.startswith(f"{base}_") for base in created):
+            for alias in utility.list_aliases(name):
+                utility.drop_alias(alias)
+            utility.drop_collection(name)
+    milvus_search.reset_connection()
+
+@pytest.fixture
+def collection(make_collection):
+    """Collection HNSW con campi dinamici, vuota"""
+    return make_collection()
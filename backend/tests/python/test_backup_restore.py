@@ -0,0 +1,100 @@
+import json
+
+import numpy as np
+
+import milvus_search
+import recreate_milvus_collection as recreate
+from conftest import random_vectors
+from pymilvus import Collection
+
+def seed(collection):
+    """25 chunk su due tenant, con il campo dinamico content_hash"""
+    vectors = {}
+    for tenant_id, document_id, count in ((1, 1, 10), (1, 2, 8), (2, 3, 7)):
+        vectors[document_id] = random_vectors(count, seed=document_id)
+        milvus_search.sync_document(collection, tenant_id, document_id, vectors[document_id],
+                                    chunk_hashes=[f"h{document_id}-{i}" for i in range(count)])
+    return vectors
+
+def rows(name):
+    result = Collection(name).query(expr="id >= 0", output_fields=["*"], consistency_level="Strong")
+    return {int(row["id"]): row for row in result}
+
+def test_sharded_backup_restore_round_trip(make_collection, tmp_path):
+    source = make_collection()
+    seed(source)
+
+    backup = recreate.backup_collection_data(source, str(tmp_path), shard_rows=10)
+
+    assert backup["success"] is True
+    assert (backup["shards"], backup["records_backed_up"]) == (3, 25)
+    manifest = json.loads((tmp_path / recreate.MANIFEST_FILE).read_text())
+    assert manifest["complete"] is True
+    assert [shard["rows"] for shard in manifest["shards"]] == [10, 10, 5]
+    assert all(shard["files"] for shard in manifest["shards"])
+
+    target = make_collection()
+    restored = recreate.restore_collection_data(target, str(tmp_path), workers=2)
+
+    assert restored["success"] is True and restored["restored_records"] == 25
+    before, after = rows(source), rows(target)
+    assert before.keys() == after.keys()
+    for primary_id, row in before.items():
+        assert after[primary_id]["tenant_id"] == row["tenant_id"]
+        assert after[primary_id]["content_hash"] == row["content_hash"]
+        np.testing.assert_allclose(after[primary_id]["vector"], row["vector"], rtol=1e-6)
+
+def test_restore_into_tenant_partitions(make_collection, tmp_path):
+    source = make_collection()
+    seed(source)
+    recreate.backup_collection_data(source, str(tmp_path), shard_rows=10)
+    target = f"{source}_parts"
+    assert recreate.create_new_collection_schema(target, vector_dim=8, tenant_partitioning="partitions")["success"]
+
+    restored = recreate.restore_collection_data(target, str(tmp_path), "partitions")
+
+    assert restored["success"] is True
+    collection = Collection(target)
+    assert {"tenant_1", "tenant_2"} <= {p.name for p in collection.partitions}
+    collection.load()
+    assert milvus_search.count_entities(collection, "id >= 0", ["tenant_2"], consistency_level="Strong") == 7
+
+def test_interrupted_backup_resumes_after_the_last_complete_shard(make_collection, tmp_path):
+    source = make_collection()
+    seed(source)
+    recreate.backup_collection_data(source, str(tmp_path), shard_rows=10)
+
+    # Simula un'interruzione dopo il primo shard
+    manifest = recreate.read_manifest(str(tmp_path))
+    manifest.update(complete=False, shards=manifest["shards"][:1], total_records=10)
+    recreate.write_manifest(str(tmp_path), manifest)
+
+    resumed = recreate.backup_collection_data(source, str(tmp_path), shard_rows=10)
+
+    assert resumed["success"] is True
+    assert (resumed["shards"], resumed["records_backed_up"]) == (3, 25)
+
+def test_corrupted_shard_fails_the_restore(make_collection, tmp_path):
+    source = make_collection()
+    seed(source)
+    recreate.backup_collection_data(source, str(tmp_path), shard_rows=10)
+    shard_dir = tmp_path / recreate.read_manifest(str(tmp_path))["shards"][1]["path"]
+    np.save(shard_dir / "id.npy", np.zeros(10, dtype=np.int64))
+
+    restored = recreate.restore_collection_data(make_collection(), str(tmp_path))
+
+    assert restored["success"] is False
+    assert "Checksum" in restored["error"]
+
+def test_incomplete_backup_is_not_restored(make_collection, tmp_path):
+    source = make_collection()
+    seed(source)
+    recreate.backup_collection_data(source, str(tmp_path), shard_rows=10)
+    manifest = recreate.read_manifest(str(tmp_path))
+    manifest["complete"] = False
+    recreate.write_manifest(str(tmp_path), manifest)
+
+    restored = recreate.restore_collection_data(make_collection(), str(tmp_path))
+
+    assert restored["success"] is False
+    assert "incomplete" in restored["error"]
@@ -0,0 +1,37 @@
+import pytest
+
+import milvus_search
+from conftest import random_vectors
+from milvus_search import InvalidParams, bool_param
+
+def test_bool_param_does_not_turn_strings_into_true():
+    assert bool_param({'flush_before': 'false'}, 'flush_before', True) is False
+    assert bool_param({'flush_before': 0}, 'flush_before', True) is False
+    assert bool_param({}, 'flush_before', True) is True
+    with pytest.raises(InvalidParams, match='flush_before must be a boolean'):
+        bool_param({'flush_before': 'none'}, 'flush_before', True)
+
+def test_write_flush_mode_does_not_apply_to_compaction(collection):
+    milvus_search.upsert_vectors(collection, 1, 1, random_vectors(4, seed=1), flush='sync')
+
+    result = milvus_search.dispatch({'operation': 'compaction', 'collection': collection, 'flush': True,
+                                     'dry_run': True})
+
+    assert result['success'] is True
+    assert result['triggered'] is False
+
+def test_write_operations_still_validate_the_flush_mode(collection):
+    with pytest.raises(InvalidParams, match='flush must be one of'):
+        milvus_search.dispatch({'operation': 'delete_by_ids', 'collection': collection, 'primary_ids': [1],
+                                'flush': 'bogus'})
+
+def test_forced_compaction_runs_after_deletes(collection):
+    milvus_search.upsert_vectors(collection, 1, 1, random_vectors(20, seed=2), flush='sync')
+    milvus_search.delete_by_primary_ids(collection, [100000 + i for i in range(10)])
+
+    result = milvus_search.dispatch({'operation': 'compaction', 'collection': collection, 'force': True,
+                                     'flush_before': True, 'wait_seconds': 30})
+
+    assert result['success'] is True
+    assert result['triggered'] is True
+    assert result['compaction']['state'] in ('Completed', 'Executing')
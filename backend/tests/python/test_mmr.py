@@ -0,0 +1,75 @@
+import numpy as np
+
+import milvus_search
+from conftest import random_vectors
+from milvus_search import mmr_select
+
+def reference_mmr(query, matrix, mmr_lambda, k):
+    """MMR con cicli espliciti, come KbSearchService::mmr (similarità con i selezionati da 0)"""
+    def cosine(a, b):
+        return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+    selected = []
+    candidates = list(range(len(matrix)))
+    while candidates and len(selected) < k:
+        def score(i):
+            diversity = max([0.0] + [cosine(matrix[i], matrix[j]) for j in selected])
+            return mmr_lambda * cosine(query, matrix[i]) - (1 - mmr_lambda) * diversity
+        best = max(candidates, key=score)
+        selected.append(best)
+        candidates.remove(best)
+    return selected
+
+def test_mmr_select_matches_the_reference_formula():
+    rng = np.random.default_rng(3)
+    matrix = rng.normal(size=(40, 16))
+    query = rng.normal(size=16)
+
+    for mmr_lambda in (0.3, 0.5, 0.8):
+        selected, scores, _ = mmr_select(query, matrix, mmr_lambda, 8)
+        assert selected == reference_mmr(query, matrix, mmr_lambda, 8)
+        assert len(scores) == 8
+
+def test_mmr_select_skips_near_duplicates():
+    base = np.array([1.0, 0.0, 0.0])
+    matrix = np.array([base, base * 1.01, [0.7, 0.7, 0.0], [0.0, 0.0, 1.0]])
+
+    selected, _, _ = mmr_select([1.0, 0.2, 0.0], matrix, 0.5, 2)
+
+    assert selected == [0, 2]
+
+def test_mmr_select_with_lambda_one_is_pure_relevance():
+    rng = np.random.default_rng(4)
+    matrix = rng.normal(size=(10, 4))
+    query = rng.normal(size=4)
+
+    selected, scores, query_sims = mmr_select(query, matrix, 1.0, 3)
+
+    assert selected == np.argsort(-query_sims)[:3].tolist()
+    assert scores == sorted(scores, reverse=True)
+
+def test_mmr_select_caps_k_at_the_candidate_count():
+    selected, _, _ = mmr_select([1.0, 0.0], [[1.0, 0.0], [0.0, 1.0]], 0.5, 5)
+
+    assert sorted(selected) == [0, 1]
+
+def test_search_mmr_over_stored_vectors(collection):
+    vectors = random_vectors(10, seed=5)
+    milvus_search.upsert_vectors(collection, 1, 1, vectors, flush='sync')
+    candidate_ids = [100000 + i for i in range(10)]
+    query = random_vectors(1, seed=8)[0]
+
+    result = milvus_search.search_mmr(collection, query, 1, k=4, mmr_lambda=0.5, candidate_ids=candidate_ids)
+
+    assert result['success'] is True
+    ids = [h["id"] for h in result['hits']]
+    expected = reference_mmr(np.array(query), np.array(vectors), 0.5, 4)
+    assert ids == [100000 + i for i in expected]
+
+def test_search_mmr_reports_missing_candidates(collection):
+    milvus_search.upsert_vectors(collection, 1, 1, random_vectors(3, seed=6), flush='sync')
+
+    result = milvus_search.search_mmr(collection, random_vectors(1, seed=7)[0], 1, k=2,
+                                      candidate_ids=[100000, 100001, 999999])
+
+    assert result['missing_ids'] == [999999]
@@ -0,0 +1,74 @@
+import milvus_search
+import recreate_milvus_collection as recreate
+from conftest import random_vectors
+from pymilvus import Collection, utility
+
+def dual_write_target(name):
+    return (Collection(name).describe().get("properties") or {}).get(milvus_search.DUAL_WRITE_PROPERTY)
+
+def migrate(name, **kwargs):
+    return recreate.online_migration(name, rows_per_second=0, grace_seconds=0, **kwargs)
+
+def test_first_migration_moves_the_alias_and_keeps_dual_write(collection):
+    milvus_search.upsert_vectors(collection, 1, 1, random_vectors(6, seed=1), flush='sync')
+    milvus_search.upsert_vectors(collection, 2, 2, random_vectors(4, seed=2), flush='sync')
+    alias = f"{collection}_live"
+
+    result = migrate(collection, alias=alias, target_name=f"{collection}_v2")
+
+    assert result["success"] is True and result["switched"] is True
+    assert result["backfill"]["copied"] == 10
+    assert result["verification"]["mismatches"] == []
+    assert milvus_search.resolve_collection_name(alias) == f"{collection}_v2"
+    # I client usano ancora il nome reale: la sorgente resta intatta e con dual-write
+    assert result["dual_write_kept"] is True and "action_required" in result
+    assert dual_write_target(collection) == f"{collection}_v2"
+    assert utility.has_collection(collection)
+
+    write = milvus_search.upsert_vectors(collection, 1, 3, random_vectors(2, seed=3), flush='sync')
+    assert write["dual_write"]["success"] is True
+    assert milvus_search.count_by_document(alias, 1, 3)["count"] == 2
+
+    retired = recreate.retire_source(collection)
+    assert retired["success"] is True and retired["previous_collection_released"] is True
+    assert dual_write_target(collection) == ""
+
+def test_migration_behind_an_alias_retires_the_source(collection):
+    milvus_search.upsert_vectors(collection, 1, 1, random_vectors(5, seed=4), flush='sync')
+    alias = f"{collection}_live"
+    assert migrate(collection, alias=alias, target_name=f"{collection}_v2")["success"] is True
+    recreate.retire_source(collection)
+
+    result = migrate(alias, target_name=f"{collection}_v3")
+
+    assert result["success"] is True
+    assert result["previous_collection"] == f"{collection}_v2"
+    assert result["previous_collection_released"] is True
+    assert "dual_write_kept" not in result
+    assert dual_write_target(f"{collection}_v2") == ""
+    assert milvus_search.resolve_collection_name(alias) == f"{collection}_v3"
+    assert milvus_search.count_by_tenant(alias, 1)["count"] == 5
+
+def test_real_collection_without_alias_is_refused(collection):
+    result = migrate(collection)
+
+    assert result["success"] is False
+    assert "--alias" in result["error"]
+
+def test_source_behind_an_alias_cannot_be_retired(collection):
+    alias = f"{collection}_live"
+    utility.create_alias(collection, alias)
+
+    result = recreate.retire_source(collection)
+
+    assert result["success"] is False
+    assert alias in result["error"]
+
+def test_failed_mirror_write_does_not_fail_the_primary_write(collection):
+    Collection(collection).set_properties({milvus_search.DUAL_WRITE_PROPERTY: f"{collection}_missing"})
+
+    result = milvus_search.upsert_vectors(collection, 1, 1, random_vectors(2, seed=5), flush='sync')
+
+    assert result["success"] is True
+    assert result["dual_write"]["success"] is False
+    assert milvus_search.count_by_document(collection, 1, 1)["count"] == 2
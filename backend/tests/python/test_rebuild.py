@@ -0,0 +1,47 @@
+import argparse
+
+import milvus_search
+import rebuild_milvus_index
+from conftest import random_vectors
+from pymilvus import Collection
+
+def rebuild_args(**overrides):
+    args = dict(alias='', source='', shadow='', index_type='HNSW', index_param=[], batch_size=64,
+                grace_seconds=0, drop_old=False, force=False, dry_run=False)
+    args.update(overrides)
+    return argparse.Namespace(**args)
+
+def properties(name):
+    return Collection(name).describe().get('properties') or {}
+
+def test_first_rebuild_keeps_dual_write_until_clients_use_the_alias(collection):
+    milvus_search.upsert_vectors(collection, 1, 1, random_vectors(5, seed=1), flush='sync')
+    alias = f"{collection}_live"
+
+    result = rebuild_milvus_index.rebuild(rebuild_args(alias=alias, source=collection, shadow=f"{collection}_hnsw"))
+
+    assert result['success'] is True and result['switched'] is True
+    assert result['copied_rows'] == 5
+    assert result['dual_write_kept'] is True
+    assert properties(collection)[milvus_search.DUAL_WRITE_PROPERTY] == f"{collection}_hnsw"
+    assert milvus_search.DUAL_WRITE_PROPERTY not in properties(f"{collection}_hnsw")
+
+    # Un client che scrive ancora sul nome reale non perde la scrittura
+    write = milvus_search.upsert_vectors(collection, 1, 2, random_vectors(3, seed=2), flush='sync')
+    assert write['dual_write']['success'] is True
+    assert milvus_search.count_by_document(alias, 1, 2)['count'] == 3
+
+def test_rebuild_behind_alias_retires_the_source(collection):
+    milvus_search.upsert_vectors(collection, 1, 1, random_vectors(4, seed=3), flush='sync')
+    alias = f"{collection}_live"
+    first = rebuild_milvus_index.rebuild(rebuild_args(alias=alias, source=collection, shadow=f"{collection}_v2"))
+    assert first['success'] is True
+
+    result = rebuild_milvus_index.rebuild(rebuild_args(alias=alias, shadow=f"{collection}_v3"))
+
+    assert result['success'] is True
+    assert result['previous_collection'] == f"{collection}_v2"
+    assert result['previous_collection_released'] is True
+    assert properties(f"{collection}_v2")[milvus_search.DUAL_WRITE_PROPERTY] == ""
+    assert milvus_search.resolve_collection_name(alias) == f"{collection}_v3"
+    assert milvus_search.count_by_document(alias, 1, 1)['count'] == 4
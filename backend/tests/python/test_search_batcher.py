@@ -0,0 +1,135 @@
+import threading
+import time
+
+import milvus_search
+from conftest import random_vectors
+from milvus_search import SearchBatcher
+
+def echo(calls, block=None):
+    """execute() di prova: ritorna per ogni query `max_limit` hit che la identificano"""
+    def execute(queries, max_limit):
+        calls.append((list(queries), max_limit))
+        if block is not None and len(calls) == 1:
+            block.wait(5)
+        return [[(query, rank) for rank in range(max_limit)] for query in queries]
+    return execute
+
+def run_concurrently(batcher, requests, execute):
+    """Lancia una search per (key, query, limit) in thread separati e ritorna i risultati per query"""
+    results = {}
+
+    def worker(key, query, limit):
+        results[query] = batcher.search(key, query, limit, execute)
+
+    threads = [threading.Thread(target=worker, args=request) for request in requests]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.005)
+    assert condition()
+
+def test_idle_worker_runs_a_search_without_waiting():
+    batcher = SearchBatcher(window_ms=1000, max_batch=8)
+    calls = []
+
+    hits, size, wait_ms = batcher.search('k', 'q', 2, echo(calls))
+
+    assert hits == [('q', 0), ('q', 1)]
+    assert size == 1
+    assert wait_ms < 100
+
+def test_concurrent_searches_with_the_same_key_share_one_call():
+    batcher = SearchBatcher(window_ms=2000, max_batch=4)
+    calls, release = [], threading.Event()
+    execute = echo(calls, release)
+
+    # Una search in corso: le successive si accodano invece di partire subito
+    first, _ = run_concurrently(batcher, [('k', 'q0', 1)], execute)
+    wait_for(lambda: len(calls) == 1)
+    threads, results = run_concurrently(batcher, [('k', f"q{i}", i) for i in range(1, 5)], execute)
+    wait_for(lambda: len(calls) == 2)
+    release.set()
+    for thread in first + threads:
+        thread.join(5)
+
+    queries, max_limit = calls[1]
+    assert sorted(queries) == ['q1', 'q2', 'q3', 'q4']
+    assert max_limit == 4
+    for i in range(1, 5):
+        hits, size, _ = results[f"q{i}"]
+        assert size == 4
+        assert hits == [(f"q{i}", rank) for rank in range(i)]
+    assert batcher.stats()['max_size'] == 4
+
+def test_different_keys_are_never_mixed():
+    batcher = SearchBatcher(window_ms=100, max_batch=8)
+    calls, release = [], threading.Event()
+    execute = echo(calls, release)
+
+    first, _ = run_concurrently(batcher, [('k', 'q0', 1)], execute)
+    wait_for(lambda: len(calls) == 1)
+    threads, results = run_concurrently(batcher, [('k', 'a', 1), ('k2', 'b', 1)], execute)
+    wait_for(lambda: len(calls) == 3)
+    release.set()
+    for thread in first + threads:
+        thread.join(5)
+
+    assert sorted(queries for queries, _ in calls[1:]) == [['a'], ['b']]
+    assert results['a'][1] == results['b'][1] == 1
+
+def test_errors_reach_every_request_of_the_batch():
+    batcher = SearchBatcher(window_ms=2000, max_batch=2)
+    calls, release = [], threading.Event()
+    blocking = echo(calls, release)
+
+    def failing(queries, max_limit):
+        calls.append(queries)
+        raise RuntimeError('milvus down')
+
+    first, _ = run_concurrently(batcher, [('k', 'q0', 1)], blocking)
+    wait_for(lambda: len(calls) == 1)
+    errors = []
+
+    def worker(query):
+        try:
+            batcher.search('k', query, 1, failing)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=worker, args=(q,)) for q in ('a', 'b')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    release.set()
+    first[0].join(5)
+
+    assert errors == ['milvus down', 'milvus down']
+
+def test_batched_searches_match_single_searches(collection, monkeypatch):
+    vectors = random_vectors(20, seed=1)
+    milvus_search.upsert_vectors(collection, 1, 1, vectors, flush='sync')
+    expected = {i: [hit['id'] for hit in milvus_search.search_vectors(collection, vectors[i], 1, 3,
+                                                                      use_cache=False)['hits']]
+                for i in range(6)}
+
+    monkeypatch.setattr(milvus_search, '_search_batcher', SearchBatcher(window_ms=50, max_batch=8))
+    responses = {}
+
+    def worker(i):
+        responses[i] = milvus_search.search_vectors(collection, vectors[i], 1, 3, use_cache=False)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    for i, response in responses.items():
+        assert response['success'] is True
+        assert 'batch' in response
+        assert [hit['id'] for hit in response['hits']] == expected[i]
@@ -0,0 +1,70 @@
+import milvus_search
+from conftest import random_vectors
+from milvus_search import SearchResultCache
+
+VECTOR = [0.1, 0.2, 0.3]
+
+def test_write_on_a_tenant_invalidates_only_that_tenant():
+    cache = SearchResultCache()
+    first = cache.key('kb', 1, VECTOR, 10, {})
+    other = cache.key('kb', 2, VECTOR, 10, {})
+    cache.put(first, ['a'])
+    cache.put(other, ['b'])
+
+    cache.invalidate('kb', 1)
+
+    assert cache.get(cache.key('kb', 1, VECTOR, 10, {})) is None
+    assert cache.get(cache.key('kb', 2, VECTOR, 10, {})) == ['b']
+
+def test_collection_wide_invalidation_reaches_every_tenant():
+    cache = SearchResultCache()
+    cache.put(cache.key('kb', 1, VECTOR, 10, {}), ['a'])
+    cache.put(cache.key('other', 1, VECTOR, 10, {}), ['c'])
+
+    cache.invalidate('kb')
+
+    assert cache.get(cache.key('kb', 1, VECTOR, 10, {})) is None
+    assert cache.get(cache.key('other', 1, VECTOR, 10, {})) == ['c']
+
+def test_result_of_a_search_overtaken_by_a_write_is_not_stored():
+    cache = SearchResultCache()
+    key = cache.key('kb', 1, VECTOR, 10, {})
+
+    cache.invalidate('kb', 1)
+    cache.put(key, ['stale'])
+
+    assert cache.counters(None)['size'] == 0
+
+def test_nearly_identical_vectors_share_an_entry_and_expired_entries_miss():
+    cache = SearchResultCache(ttl=0.0)
+    assert cache.key('kb', 1, VECTOR, 10, {}) == cache.key('kb', 1, [0.1000001, 0.2, 0.3], 10, {})
+
+    key = cache.key('kb', 1, VECTOR, 10, {})
+    cache.put(key, ['a'])
+    assert cache.get(key) is None
+
+def test_least_recently_used_entry_is_evicted():
+    cache = SearchResultCache(max_entries=2)
+    keys = [cache.key('kb', 1, [float(i)], 10, {}) for i in range(3)]
+    cache.put(keys[0], [0])
+    cache.put(keys[1], [1])
+    cache.get(keys[0])
+    cache.put(keys[2], [2])
+
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == [0]
+
+def test_upsert_through_dispatch_invalidates_cached_searches(collection):
+    vectors = random_vectors(3, seed=1)
+    milvus_search.upsert_vectors(collection, 1, 1, vectors, flush='sync')
+    search = {'operation': 'search', 'collection': collection, 'tenant_id': 1, 'limit': 5, 'query_vector': vectors[0]}
+
+    assert milvus_search.dispatch(search)['cache']['hit'] is False
+    assert milvus_search.dispatch(search)['cache']['hit'] is True
+
+    milvus_search.dispatch({'operation': 'upsert', 'collection': collection, 'tenant_id': 1, 'document_id': 2,
+                            'vectors': [vectors[0]], 'flush': 'sync'})
+    result = milvus_search.dispatch(search)
+
+    assert result['cache']['hit'] is False
+    assert 200000 in [hit['id'] for hit in result['hits']]
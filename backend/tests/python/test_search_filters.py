@@ -0,0 +1,57 @@
+import milvus_search
+from conftest import random_vectors
+from milvus_search import group_hits
+
+def hit(document_id, chunk_index, distance):
+    return {"id": document_id * 100000 + chunk_index, "distance": distance, "score": 1.0 - distance}
+
+def test_group_hits_keeps_relevance_order_within_limits():
+    hits = [hit(1, 0, 0.9), hit(1, 1, 0.8), hit(2, 0, 0.7), hit(1, 2, 0.6), hit(3, 0, 0.5), hit(2, 1, 0.4)]
+
+    grouped = group_hits(hits, limit=2, group_size=2)
+
+    assert [h["id"] for h in grouped] == [100000, 100001, 200000, 200001]
+
+def test_group_hits_with_one_chunk_per_document():
+    hits = [hit(1, 0, 0.9), hit(1, 1, 0.8), hit(2, 0, 0.7), hit(3, 0, 0.6)]
+
+    assert [h["id"] for h in group_hits(hits, limit=5, group_size=1)] == [100000, 200000, 300000]
+
+def test_group_hits_empty():
+    assert group_hits([], limit=3, group_size=2) == []
+
+def seed_documents(collection):
+    vectors = random_vectors(12, seed=11)
+    for document_id in (1, 2, 3):
+        milvus_search.upsert_vectors(collection, 1, document_id, vectors[(document_id - 1) * 4:document_id * 4],
+                                     flush='sync')
+    return vectors
+
+def test_search_grouped_by_document(collection):
+    vectors = seed_documents(collection)
+
+    result = milvus_search.search_vectors(collection, vectors[0], 1, limit=2, use_cache=False,
+                                          group_by='document_id', group_size=2)
+
+    assert result['success'] is True
+    documents = [h["id"] // 100000 for h in result['hits']]
+    assert len(set(documents)) <= 2
+    assert all(documents.count(d) <= 2 for d in documents)
+    assert result['hits'][0]['id'] == 100000
+
+def test_search_document_allow_and_deny_lists(collection):
+    vectors = seed_documents(collection)
+
+    allowed = milvus_search.search_vectors(collection, vectors[0], 1, limit=10, use_cache=False, document_ids=[2])
+    denied = milvus_search.search_vectors(collection, vectors[0], 1, limit=10, use_cache=False,
+                                         exclude_document_ids=[1])
+
+    assert {h["id"] // 100000 for h in allowed['hits']} == {2}
+    assert {h["id"] // 100000 for h in denied['hits']} == {2, 3}
+
+def test_search_min_score_drops_weaker_hits(collection):
+    vectors = seed_documents(collection)
+
+    result = milvus_search.search_vectors(collection, vectors[0], 1, limit=10, use_cache=False, min_score=0.99)
+
+    assert [h["id"] for h in result['hits']] == [100000]
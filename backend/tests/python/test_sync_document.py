@@ -0,0 +1,61 @@
+import milvus_search
+from conftest import random_vectors
+
+def sync(collection, vectors, hashes=None, **kwargs):
+    return milvus_search.sync_document(collection, 1, 9, vectors, chunk_hashes=hashes, flush='sync', **kwargs)
+
+def test_only_changed_chunks_are_written_and_removed_chunks_deleted(collection):
+    vectors = random_vectors(4, seed=1)
+    first = sync(collection, vectors, ['a', 'b', 'c', 'd'])
+    assert (first['upserted_count'], first['unchanged_count'], first['deleted_count']) == (4, 0, 0)
+    assert first['hash_compare'] is True
+
+    changed = vectors[:2] + random_vectors(1, seed=2)
+    second = sync(collection, changed, ['a', 'b', 'x'])
+
+    assert second['success'] is True
+    assert (second['upserted_count'], second['unchanged_count'], second['deleted_count']) == (1, 2, 1)
+    assert milvus_search.count_by_document(collection, 1, 9)['count'] == 3
+    rows = milvus_search.get_collection(collection).query(expr="document_id == 9", output_fields=["content_hash"],
+                                                          consistency_level="Strong")
+    assert sorted(row['content_hash'] for row in rows) == ['a', 'b', 'x']
+
+def test_unchanged_document_writes_nothing(collection):
+    vectors = random_vectors(3, seed=3)
+    sync(collection, vectors, ['a', 'b', 'c'])
+
+    result = sync(collection, vectors, ['a', 'b', 'c'])
+
+    assert (result['upserted_count'], result['unchanged_count'], result['deleted_count']) == (0, 3, 0)
+
+def test_metadata_change_rewrites_every_chunk(collection):
+    vectors = random_vectors(2, seed=4)
+    sync(collection, vectors, ['a', 'b'], metadata={'title': 'Orari'})
+
+    result = sync(collection, vectors, ['a', 'b'], metadata={'title': 'Orari uffici'})
+
+    assert (result['upserted_count'], result['unchanged_count']) == (2, 0)
+
+def test_without_hashes_every_chunk_is_rewritten(collection):
+    vectors = random_vectors(3, seed=5)
+    sync(collection, vectors)
+
+    result = sync(collection, vectors[:2])
+
+    assert result['hash_compare'] is False
+    assert (result['upserted_count'], result['unchanged_count'], result['deleted_count']) == (2, 0, 1)
+
+def test_chunk_hashes_must_match_vectors(collection):
+    result = sync(collection, random_vectors(2, seed=6), ['a'])
+
+    assert result['success'] is False
+
+def test_documents_larger_than_one_query_page(collection):
+    # Una query Milvus restituisce al massimo 16384 righe: i chunk esistenti vanno letti a pagine
+    vectors = random_vectors(17000, seed=7)
+    sync(collection, vectors)
+
+    result = sync(collection, vectors[:100])
+
+    assert result['deleted_count'] == 16900
+    assert milvus_search.count_by_document(collection, 1, 9)['count'] == 100
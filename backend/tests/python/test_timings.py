@@ -0,0 +1,31 @@
+import milvus_search
+
+def test_slow_call_threshold_ignores_interpreter_and_import(capsys, monkeypatch):
+    monkeypatch.setattr(milvus_search, 'SLOW_CALL_MS', 1000.0)
+    timings = milvus_search.begin_timings({'operation': 'search'})
+    timings.phases['interpreter'] = 600.0
+    timings.phases['import'] = 900.0
+
+    milvus_search.end_timings(timings)
+
+    assert 'milvus slow call' not in capsys.readouterr().err
+
+def test_slow_call_threshold_applies_to_operation_time(capsys, monkeypatch):
+    monkeypatch.setattr(milvus_search, 'SLOW_CALL_MS', 1000.0)
+    timings = milvus_search.begin_timings({'operation': 'search'})
+    timings._started -= 1.5
+
+    milvus_search.end_timings(timings)
+
+    assert 'milvus slow call: operation=search' in capsys.readouterr().err
+
+def test_phases_exclude_nested_time():
+    timings = milvus_search.begin_timings({'operation': 'search'})
+    with milvus_search.timed_phase('load'):
+        with milvus_search.timed_phase('connect'):
+            pass
+    milvus_search.end_timings(timings)
+
+    phases = timings.as_dict()
+    assert phases['total'] >= phases['load'] + phases['connect']
+    assert set(milvus_search.TIMING_PHASES) <= set(phases)
@@ -0,0 +1,47 @@
+import argparse
+
+import milvus_search
+import tune_milvus_search
+from conftest import random_vectors
+from pymilvus import Collection
+
+def tune_args(collection, **overrides):
+    args = dict(collection=collection, tenant=1, k=3, queries=5, ef='16,32', target_recall=0.5, build_params='',
+                max_corpus=100, batch_size=64, seed=1, dry_run=False)
+    args.update(overrides)
+    return argparse.Namespace(**args)
+
+def test_tuned_ef_is_stored_with_the_index_type(collection):
+    milvus_search.upsert_vectors(collection, 1, 1, random_vectors(30, seed=1), flush='sync')
+
+    result = tune_milvus_search.tune(tune_args(collection))
+
+    assert result['success'] is True and result['index_type'] == 'HNSW'
+    stored = Collection(collection).describe()['properties'][f"{milvus_search.SEARCH_EF_PROPERTY}.1"]
+    assert stored == f"{result['chosen_ef']}@HNSW"
+    milvus_search.invalidate_collection(collection)
+    assert milvus_search.tuned_ef(milvus_search.get_collection(collection), 1) == result['chosen_ef']
+
+def test_tuning_refuses_non_hnsw_indexes(make_collection):
+    name = make_collection(index_type='IVF_SQ8')
+    milvus_search.upsert_vectors(name, 1, 1, random_vectors(30, seed=2), flush='sync')
+
+    result = tune_milvus_search.tune(tune_args(name))
+
+    assert result['success'] is False
+    assert 'IVF_SQ8' in result['error']
+
+def test_ef_tuned_on_another_index_type_is_ignored(make_collection):
+    name = make_collection(index_type='IVF_SQ8')
+    # Proprietà copiate da una collection HNSW (rebuild) e valore legacy senza tipo
+    Collection(name).set_properties({f"{milvus_search.SEARCH_EF_PROPERTY}.1": "200@HNSW",
+                                     milvus_search.SEARCH_EF_PROPERTY: "300"})
+
+    assert milvus_search.tuned_ef(milvus_search.get_collection(name), 1) is None
+
+def test_legacy_ef_without_index_type_applies_to_hnsw(collection):
+    Collection(collection).set_properties({milvus_search.SEARCH_EF_PROPERTY: "300"})
+
+    handle = milvus_search.get_collection(collection)
+    assert milvus_search.tuned_ef(handle, 7) == 300
+    assert milvus_search.search_params(handle, 7, 10)['params'] == {"ef": 300}
@@ -0,0 +1,68 @@
+import base64
+
+import numpy as np
+import pytest
+
+import milvus_search
+from milvus_search import InvalidParams, decode_vectors, encode_hits
+
+def b64(matrix):
+    return base64.b64encode(np.asarray(matrix, dtype='<f4').tobytes()).decode('ascii')
+
+def test_base64_buffer_is_split_by_dim():
+    vectors = np.arange(12, dtype=np.float32).reshape(3, 4)
+
+    matrix = decode_vectors({'vectors_b64': b64(vectors)}, 'vectors', dim=4)
+
+    assert matrix.shape == (3, 4)
+    np.testing.assert_array_equal(matrix, vectors)
+
+def test_base64_query_vector_is_a_single_row():
+    matrix = decode_vectors({'query_vector_b64': b64([0.5, -1.0, 2.0])}, 'query_vector', single=True)
+
+    assert matrix.shape == (1, 3)
+    np.testing.assert_array_equal(matrix[0], [0.5, -1.0, 2.0])
+
+def test_base64_buffer_must_hold_float32_values():
+    with pytest.raises(InvalidParams, match='float32'):
+        decode_vectors({'vectors_b64': base64.b64encode(b'\x00' * 6).decode('ascii')}, 'vectors', dim=4)
+
+def test_buffer_size_must_be_a_multiple_of_dim():
+    with pytest.raises(InvalidParams, match='multiple of dim 4'):
+        decode_vectors({'vectors_b64': b64(np.zeros(6))}, 'vectors', dim=4)
+
+def test_flat_list_without_dim_is_rejected():
+    with pytest.raises(InvalidParams, match='dim is required'):
+        decode_vectors({'vectors': [0.1, 0.2, 0.3, 0.4]}, 'vectors')
+
+def test_flat_list_with_dim_and_nested_list():
+    flat = decode_vectors({'vectors': [0.1, 0.2, 0.3, 0.4]}, 'vectors', dim=2)
+    nested = decode_vectors({'vectors': [[0.1, 0.2], [0.3, 0.4]]}, 'vectors')
+
+    np.testing.assert_array_equal(flat, nested)
+    assert flat.dtype == np.float32
+
+def test_missing_vectors_return_none():
+    assert decode_vectors({}, 'vectors', dim=4) is None
+
+def test_npy_sidecar_file(tmp_path):
+    path = tmp_path / 'vectors.npy'
+    np.save(path, np.ones((2, 3), dtype=np.float32))
+
+    matrix = decode_vectors({'vectors_file': str(path)}, 'vectors')
+
+    assert matrix.shape == (2, 3)
+
+def test_binary_hits_round_trip():
+    hits = [{'id': 100001, 'distance': 0.25, 'score': 0.75}, {'id': 7, 'distance': 0.5, 'score': 0.5}]
+
+    encoded = encode_hits(hits, 'binary')
+
+    assert encoded['count'] == 2
+    assert np.frombuffer(base64.b64decode(encoded['ids_b64']), dtype='<i8').tolist() == [100001, 7]
+    assert np.frombuffer(base64.b64decode(encoded['distances_b64']), dtype='<f4').tolist() == [0.25, 0.5]
+
+def test_dispatch_rejects_flat_write_vectors_without_dim():
+    with pytest.raises(InvalidParams, match='dim is required'):
+        milvus_search.dispatch({'operation': 'upsert', 'collection': 'unused', 'tenant_id': 1, 'document_id': 1,
+                                'vectors': [0.1, 0.2, 0.3, 0.4]})
@@ -0,0 +1,31 @@
+import milvus_search
+from conftest import random_vectors
+
+def test_delete_by_primary_ids_counts_only_existing_rows(collection):
+    milvus_search.upsert_vectors(collection, 1, 3, random_vectors(4, seed=1), flush='sync')
+
+    result = milvus_search.delete_by_primary_ids(collection, [300000, 300001, 999999, 888888])
+
+    assert result['success'] is True
+    assert result['deleted_count'] == 2
+    assert result['requested_count'] == 4
+    assert milvus_search.count_by_document(collection, 1, 3)['count'] == 2
+
+def test_delete_by_primary_ids_all_missing(collection):
+    milvus_search.upsert_vectors(collection, 1, 3, random_vectors(2, seed=2), flush='sync')
+
+    result = milvus_search.delete_by_primary_ids(collection, [111, 222])
+
+    assert result['success'] is True
+    assert result['deleted_count'] == 0
+
+def test_unflushed_writes_are_visible_to_strong_queries(collection):
+    vectors = random_vectors(3, seed=3)
+
+    result = milvus_search.upsert_vectors(collection, 1, 5, vectors, flush='none')
+
+    assert result['flushed'] is False
+    assert 'searchable' not in result
+    rows = milvus_search.get_collection(collection).query(expr="document_id == 5", output_fields=["id"],
+                                                          consistency_level="Strong")
+    assert len(rows) == 3
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+Taratura di ef (HNSW) per tenant: curva recall@k / latenza.
+
+Campiona vettori reali del tenant come query, calcola il top-k esatto con
+NumPy (brute force a blocchi sull'intero tenant) e misura recall@k e
+latenza p50/p95 di Milvus per ogni valore di ef. Il valore scelto (il più
+piccolo che raggiunge --target-recall) viene salvato come proprietà della
+collection, insieme al tipo di indice, e usato da milvus_search.py finché
+l'indice resta dello stesso tipo. Gli indici non HNSW non si tarano.
+
+Con --build-params si confrontano anche M/efConstruction su una collection
+temporanea con un sottoinsieme del tenant, eliminata a fine esecuzione.
+
+Il risultato è un oggetto JSON su stdout; l'avanzamento va su stderr.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import warnings
+
+import numpy as np
+
+# milvus_search va importato prima di pymilvus (gestisce MILVUS_URI con un file di Milvus Lite)
+import milvus_search
+from milvus_search import (
+    SEARCH_EF_PROPERTY, connect_milvus, format_tuned_ef, get_collection, get_tenant_collection, iter_query_batches,
+    vector_index_type,
+)
+from pymilvus import Collection, utility
+from create_milvus_collection import build_schema, hnsw_index_params
+
+warnings.filterwarnings("ignore", category=UserWarning)
+
+DEFAULT_EF_VALUES = "16,32,48,64,96,128,192,256,384,512"
+
+def log(message):
+    print(message, file=sys.stderr)
+
+def normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+def sample_queries(collection, tenant_id, partitions, num_queries, seed):
+    """Sceglie a caso `num_queries` chunk del tenant e ne legge i vettori"""
+    ids = []
+    for batch in iter_query_batches(collection, f"tenant_id == {tenant_id}", ["id"], partition_names=partitions):
+        ids.extend(int(r["id"]) for r in batch)
+    if not ids:
+        return np.empty(0, dtype=np.int64), None, 0
+
+    rng = np.random.default_rng(seed)
+    chosen = sorted(int(i) for i in rng.choice(ids, size=min(num_queries, len(ids)), replace=False))
+    rows = collection.query(expr=f"id in {chosen}", output_fields=["id", "vector"], partition_names=partitions)
+    rows.sort(key=lambda r: int(r["id"]))
+    query_ids = np.array([int(r["id"]) for r in rows], dtype=np.int64)
+    queries = np.asarray([r["vector"] for r in rows], dtype=np.float32)
+    return query_ids, queries, len(ids)
+
+def exact_topk(queries, query_ids, blocks, k):
+    """
+    Top-k esatto (coseno) delle query su un corpus letto a blocchi.
+
+    `blocks` produce coppie (ids, matrice); la query stessa viene esclusa
+    dal proprio risultato. Memoria proporzionale a query × (k + blocco).
+    """
+    queries = normalize(queries)
+    best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+    best_ids = np.full((len(queries), k), -1, dtype=np.int64)
+
+    for ids, matrix in blocks:
+        scores = queries @ normalize(matrix).T
+        scores[query_ids[:, None] == ids[None, :]] = -np.inf
+
+        merged_scores = np.concatenate([best_scores, scores], axis=1)
+        merged_ids = np.concatenate([best_ids, np.broadcast_to(ids, scores.shape)], axis=1)
+        top = np.argpartition(-merged_scores, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(merged_scores, top, axis=1)
+        best_ids = np.take_along_axis(merged_ids, top, axis=1)
+
+    return [set(int(i) for i in row if i >= 0) for row in best_ids]
+
+def tenant_blocks(collection, tenant_id, partitions, batch_size):
+    """Vettori del tenant a blocchi, letti con il query iterator"""
+    expr = f"tenant_id == {tenant_id}"
+    for batch in iter_query_batches(collection, expr, ["id", "vector"], batch_size, partitions):
+        yield (np.array([int(r["id"]) for r in batch], dtype=np.int64),
+               np.asarray([r["vector"] for r in batch], dtype=np.float32))
+
+def sweep_ef(collection, tenant_id, partitions, queries, query_ids, truth, k, ef_values, metric="COSINE"):
+    """Misura recall@k e latenza per ogni ef (una search per query, come in produzione)"""
+    expr = f"tenant_id == {tenant_id}"
+    curve = []
+    for ef in ef_values:
+        params = {"metric_type": metric, "params": {"ef": max(ef, k + 1)}}
+        # Warm-up: la prima search paga cache fredde e segmenti non ancora in memoria
+        collection.search(data=[queries[0].tolist()], anns_field="vector", param=params, limit=k + 1,
+                          expr=expr, partition_names=partitions)
+
+        latencies = []
+        recalls = []
+        for query, query_id, expected in zip(queries, query_ids, truth):
+            started = time.perf_counter()
+            results = collection.search(data=[query.tolist()], anns_field="vector", param=params, limit=k + 1,
+                                        expr=expr, partition_names=partitions)
+            latencies.append((time.perf_counter() - started) * 1000)
+
+            found = [int(hit.id) for hit in results[0] if int(hit.id) != int(query_id)][:k]
+            recalls.append(len(expected.intersection(found)) / max(1, len(expected)))
+
+        point = {
+            "ef": ef,
+            "recall": round(float(np.mean(recalls)), 4),
+            "p50_ms": round(float(np.percentile(latencies, 50)), 2),
+            "p95_ms": round(float(np.percentile(latencies, 95)), 2),
+        }
+        log(f"  ef={ef:<4} recall@{k}={point['recall']:.4f} p50={point['p50_ms']}ms p95={point['p95_ms']}ms")
+        curve.append(point)
+    return curve
+
+def choose_ef(curve, target_recall):
+    """Il più piccolo ef che raggiunge il target; altrimenti quello con la recall migliore"""
+    for point in curve:
+        if point["recall"] >= target_recall:
+            return point["ef"], True
+    return max(curve, key=lambda p: (p["recall"], -p["ef"]))["ef"], False
+
+def sweep_build_params(source, tenant_id, partitions, build_params, ef_values, k, num_queries, max_corpus, seed,
+                       batch_size):
+    """Confronta M/efConstruction su una collection temporanea con un campione del tenant"""
+    dim = next(int(f.params["dim"]) for f in source.schema.fields if f.name == "vector")
+    ids, vectors = [], []
+    for block_ids, matrix in tenant_blocks(source, tenant_id, partitions, batch_size):
+        ids.append(block_ids)
+        vectors.append(matrix)
+        if sum(len(b) for b in ids) >= max_corpus:
+            break
+    ids = np.concatenate(ids)[:max_corpus]
+    vectors = np.concatenate(vectors)[:max_corpus]
+
+    rng = np.random.default_rng(seed)
+    picked = np.sort(rng.choice(len(ids), size=min(num_queries, len(ids)), replace=False))
+    query_ids, queries = ids[picked], vectors[picked]
+    truth = exact_topk(queries, query_ids, [(ids, vectors)], k)
+
+    scratch_name = f"{source.name}_tune_{os.getpid()}"
+    scratch = Collection(name=scratch_name, schema=build_schema(dim, description="ef tuning scratch"))
+    results = []
+    try:
+        for start in range(0, len(ids), milvus_search.INSERT_BATCH_ROWS):
+            end = start + milvus_search.INSERT_BATCH_ROWS
+            scratch.insert([ids[start:end].tolist(), [tenant_id] * len(ids[start:end]),
+                            (ids[start:end] // 100000).tolist(), (ids[start:end] % 100000).tolist(),
+                            vectors[start:end]])
+        scratch.flush()
+
+        for m, ef_construction in build_params:
+            log(f"build M={m} efConstruction={ef_construction} su {len(ids)} vettori")
+            if scratch.has_index():
+                scratch.release()
+                scratch.drop_index()
+            started = time.perf_counter()
+            index_params = hnsw_index_params("COSINE")
+            index_params["params"] = {"M": m, "efConstruction": ef_construction}
+            scratch.create_index(field_name="vector", index_params=index_params)
+            utility.wait_for_index_building_complete(scratch_name)
+            build_seconds = time.perf_counter() - started
+            scratch.load()
+
+            results.append({
+                "M": m,
+                "efConstruction": ef_construction,
+                "build_seconds": round(build_seconds, 2),
+                "curve": sweep_ef(scratch, tenant_id, None, queries, query_ids, truth, k, ef_values),
+            })
+    finally:
+        utility.drop_collection(scratch_name)
+
+    return {"corpus_size": int(len(ids)), "results": results}
+
+def store_ef(collection, tenant_id, ef, index_type):
+    """Salva l'ef scelto con il tipo di indice: proprietà kb.search_ef.<tenant> letta da search_vectors"""
+    collection.set_properties({f"{SEARCH_EF_PROPERTY}.{tenant_id}": format_tuned_ef(ef, index_type)})
+
+def parse_build_params(value):
+    """'16:200,32:256' -> [(16, 200), (32, 256)]"""
+    pairs = []
+    for item in filter(None, (v.strip() for v in value.split(","))):
+        m, ef_construction = item.split(":")
+        pairs.append((int(m), int(ef_construction)))
+    return pairs
+
+def tune(args):
+    connect_milvus()
+    if not utility.has_collection(args.collection):
+        return {"success": False, "error": f"Collection non trovata: {args.collection}"}
+
+    collection, partitions = get_tenant_collection(args.collection, args.tenant)
+    index_type = vector_index_type(collection)
+    if not index_type.startswith("HNSW"):
+        return {"success": False, "error": f"L'indice di {collection.name} è {index_type}: ef si tara solo su HNSW"}
+
+    query_ids, queries, tenant_rows = sample_queries(collection, args.tenant, partitions, args.queries, args.seed)
+    if queries is None or tenant_rows <= args.k:
+        return {"success": False, "error": f"Il tenant {args.tenant} ha troppo pochi chunk ({tenant_rows}) per k={args.k}"}
+
+    log(f"ground truth: {len(queries)} query su {tenant_rows} chunk del tenant {args.tenant}")
+    started = time.perf_counter()
+    truth = exact_topk(queries, query_ids, tenant_blocks(collection, args.tenant, partitions, args.batch_size), args.k)
+    ground_truth_seconds = time.perf_counter() - started
+
+    ef_values = sorted({int(v) for v in args.ef.split(",") if v.strip()})
+    log(f"sweep ef {ef_values}")
+    curve = sweep_ef(collection, args.tenant, partitions, queries, query_ids, truth, args.k, ef_values)
+    chosen_ef, target_met = choose_ef(curve, args.target_recall)
+
+    result = {
+        "success": True,
+        "collection": args.collection,
+        "index_type": index_type,
+        "tenant_id": args.tenant,
+        "k": args.k,
+        "queries": len(queries),
+        "tenant_rows": tenant_rows,
+        "ground_truth_seconds": round(ground_truth_seconds, 2),
+        "target_recall": args.target_recall,
+        "target_met": target_met,
+        "curve": curve,
+        "chosen_ef": chosen_ef,
+        "stored": False,
+    }
+
+    if not args.dry_run:
+        store_ef(get_collection(args.collection), args.tenant, chosen_ef, index_type)
+        result["stored"] = True
+
+    if args.build_params:
+        result["build_sweep"] = sweep_build_params(
+            collection, args.tenant, partitions, parse_build_params(args.build_params), ef_values, args.k,
+            args.queries, args.max_corpus, args.seed, args.batch_size,
+        )
+
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Taratura di ef HNSW per tenant (recall@k vs latenza)")
+    parser.add_argument("--collection", default=os.getenv("MILVUS_COLLECTION", "kb_chunks_v1"))
+    parser.add_argument("--tenant", type=int, required=True)
+    parser.add_argument("--k", type=int, default=10, help="recall@k (default: 10)")
+    parser.add_argument("--queries", type=int, default=200, help="Vettori campionati come query")
+    parser.add_argument("--ef", default=DEFAULT_EF_VALUES, help="Valori di ef da provare, separati da virgola")
+    parser.add_argument("--target-recall", type=float, default=0.95)
+    parser.add_argument("--build-params", default="",
+                        help="Coppie M:efConstruction da confrontare su una collection temporanea (es. 16:200,32:256)")
+    parser.add_argument("--max-corpus", type=int, default=50000,
+                        help="Massimo di vettori copiati nella collection temporanea")
+    parser.add_argument("--batch-size", type=int, default=milvus_search.EXPORT_BATCH_SIZE)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--dry-run", action="store_true", help="Non salva l'ef scelto")
+    args = parser.parse_args()
+
+    if args.tenant <= 0 or args.k <= 0:
+        parser.error("--tenant e --k devono essere positivi")
+
+    try:
+        result = tune(args)
+    except Exception as e:
+        result = {"success": False, "error": str(e), "error_type": type(e).__name__}
+
+    print(json.dumps(result, indent=2))
+    sys.exit(0 if result["success"] else 1)
+
+if __name__ == "__main__":
+    main()